@@ -0,0 +1,48 @@
+'''
+Compare the old way of resolving an abbreviated hash (fetch every hash and
+compare prefixes in Python) with the indexed range query used by
+Nota.find_by_hash().
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.hash_prefix [nnotes ...]
+'''
+
+import sys
+from .util import make_database, remove_database, timed
+
+
+def python_scan(nota, hash):
+    rows = nota.cur.execute("SELECT noteId, hash FROM note WHERE book > 0;").fetchall()
+    l = len(hash)
+    return [r[0] for r in rows if r[1][0:l] == hash]
+
+
+def range_query(nota, hash):
+    (condition, params) = nota.hash_range(hash)
+    return [r[0] for r in nota.cur.execute("SELECT noteId FROM note WHERE book > 0 AND " + condition + ";", params)]
+
+
+def main(sizes, repeat=20):
+    print("%10s %14s %14s %8s" % ("notes", "scan (ms)", "index (ms)", "speedup"))
+    for n in sizes:
+        nota = make_database(n, keywords_per_note=0)
+        try:
+            hashes = [r[0][0:7] for r in nota.cur.execute("SELECT hash FROM note ORDER BY noteId LIMIT ?;", [repeat])]
+            scan = index = 0.0
+            for h in hashes:
+                a, t = timed(python_scan, nota, h)
+                scan += t
+                b, t = timed(range_query, nota, h)
+                index += t
+                assert a == b
+            scan = 1000 * scan / len(hashes)
+            index = 1000 * index / len(hashes)
+            print("%10d %14.3f %14.3f %8.0f" % (n, scan, index, scan / index))
+        finally:
+            remove_database(nota)
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000]
+    main(sizes)
@@ -0,0 +1,39 @@
+'''
+Show that looking up notes costs a constant number of SQL statements,
+whatever the size of the result set.
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.hydration [nnotes ...]
+'''
+
+import sys
+from .util import make_database, remove_database, timed
+
+
+def count_statements(nota, f, *args, **kwargs):
+    statements = []
+    nota.con.set_trace_callback(statements.append)
+    found, seconds = timed(f, *args, **kwargs)
+    nota.con.set_trace_callback(None)
+    return len(found), len(statements), seconds
+
+
+def main(sizes):
+    print("%10s %-16s %10s %10s %10s" % ("notes", "method", "found", "queries", "seconds"))
+    for n in sizes:
+        nota = make_database(n)
+        try:
+            for label, f, kwargs in (
+                    ("find_by_hash", nota.find_by_hash, {"hash": None}),
+                    ("find_by_keyword", nota.find_by_keyword, {"keywords": ["keyword1"], "strict_match": True}),
+                    ("find_recent", nota.find_recent, {"nrecent": n})):
+                nfound, nqueries, seconds = count_statements(nota, f, **kwargs)
+                print("%10d %-16s %10d %10d %10.4f" % (n, label, nfound, nqueries, seconds))
+        finally:
+            remove_database(nota)
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [100, 1000, 10000, 100000]
+    main(sizes)
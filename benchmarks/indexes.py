@@ -0,0 +1,58 @@
+'''
+Time common lookups with and without the indexes added in database version
+0.12.x.
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.indexes [nnotes ...]
+'''
+
+import sys
+from .util import make_database, remove_database, timed
+
+indexes = {"notekeyword_noteid": "notekeyword(noteid)",
+        "notekeyword_keywordid": "notekeyword(keywordid)",
+        "keyword_keyword": "keyword(keyword)",
+        "note_attachment_noteId": "note_attachment(noteId)",
+        "note_book": "note(book)",
+        "note_date": "note(date)"}
+
+
+def operations(nota, n):
+    middle = n // 2
+    return [("find_recent(4)", lambda: nota.find_recent(nrecent=4)),
+            ("find_by_keyword", lambda: nota.find_by_keyword(keywords=["keyword1"], strict_match=True)),
+            ("find_by_hash(book=2)", lambda: nota.find_by_hash(hash=None, book=2)),
+            ("get_keywords", lambda: nota.get_keywords(middle)),
+            ("get_attachment_list", lambda: nota.get_attachment_list(middle)),
+            ("trash_length", lambda: nota.trash_length()),
+            ("keyword lookup", lambda: nota.cur.execute("SELECT keywordId FROM keyword WHERE keyword=?;", ["keyword99"]).fetchall())]
+
+
+def main(sizes, repeat=5):
+    print("%10s %-22s %14s %14s" % ("notes", "operation", "before (ms)", "after (ms)"))
+    for n in sizes:
+        nota = make_database(n, nkeywords=10000)
+        try:
+            # A few notes in the trash and in a second book.
+            nota.cur.execute("UPDATE note SET book = 0 WHERE noteId % 100 = 0;")
+            nota.cur.execute("UPDATE note SET book = 2 WHERE noteId % 100 = 1;")
+            for name in indexes:
+                nota.cur.execute("DROP INDEX %s;" % name)
+            nota.con.commit()
+            before = {}
+            for (label, f) in operations(nota, n):
+                before[label] = min(timed(f)[1] for i in range(repeat))
+            for name in indexes:
+                nota.cur.execute("CREATE INDEX %s ON %s;" % (name, indexes[name]))
+            nota.con.commit()
+            for (label, f) in operations(nota, n):
+                after = min(timed(f)[1] for i in range(repeat))
+                print("%10d %-22s %14.3f %14.3f" % (n, label, 1000 * before[label], 1000 * after))
+        finally:
+            remove_database(nota)
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [500000]
+    main(sizes)
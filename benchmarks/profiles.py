@@ -0,0 +1,40 @@
+'''
+Compare the connection profiles in Nota.profiles, timing the addition of
+notes one at a time (each with its own commit, as with 'nota -a') and then
+searches of a larger database.
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.profiles [nnotes [nadd]]
+
+Since the cost of a commit depends on the disk, set TMPDIR to a directory
+on the disk of interest, e.g. a synced folder.
+'''
+
+import sys
+from nota.notaclass import Nota
+from .util import make_database, remove_database, timed
+
+
+def add_notes(nota, nadd):
+    for i in range(nadd):
+        nota.add(title="added note %d" % i, keywords=["added", "keyword%d" % (i % 100)], content="content %d" % i)
+
+
+def main(nnotes, nadd, repeat=5):
+    print("%-10s %14s %18s %18s" % ("profile", "add (notes/s)", "search (ms)", "keyword (ms)"))
+    for profile in sorted(Nota.profiles):
+        nota = make_database(nnotes, profile=profile)
+        try:
+            elapsed = timed(add_notes, nota, nadd)[1]
+            search = min(timed(nota.search, "note 12*")[1] for i in range(repeat))
+            keyword = min(timed(nota.find_by_keyword, keywords=["keyword1"], strict_match=True)[1] for i in range(repeat))
+            print("%-10s %14.0f %18.3f %18.3f" % (profile, nadd / elapsed, 1000 * search, 1000 * keyword))
+        finally:
+            remove_database(nota)
+
+
+if __name__ == "__main__":
+    nnotes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nadd = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    main(nnotes, nadd)
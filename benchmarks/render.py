@@ -0,0 +1,75 @@
+'''
+Time the formatting of note listings, in lines per second written to
+/dev/null, for each of the formatters in nota.renderer, and for the
+print()-per-piece code that they replaced.
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.render [nnotes]
+'''
+
+import os
+import sys
+from nota.renderer import Renderer, PlainFormatter, ColorFormatter, MarkdownFormatter
+from .util import timed
+
+
+class colors:
+    hash = '\033[31m'
+    title = '\033[1m'
+    keyword = '\033[35m'
+    book = '\033[34m\033[1m'
+    normal = '\033[0m'
+
+
+def age(date):
+    return "3 days ago"
+
+
+def make_notes(nnotes):
+    return [{"noteId": i, "hash": "%064x" % (i * 2654435761), "title": "note %d" % i,
+        "keywords": ["keyword%d" % (i % 100), "keyword%d" % (i % 7), "shared"],
+        "date": "2020-01-01 00:00:00", "due": "", "book": 1} for i in range(nnotes)]
+
+
+def render(formatter, notes, stream):
+    renderer = Renderer(formatter, stream)
+    renderer.book("Default")
+    for note in notes:
+        renderer.summary(note)
+    renderer.flush()
+
+
+def print_pieces(notes, stream):
+    '''The listing loop as it was, with a print() for each piece of a line.'''
+    print(colors.book + "Book: Default" + colors.normal, end="\n", file=stream)
+    for f in notes:
+        print("  " + colors.hash + "%s " % f['hash'][0:7] + colors.normal, end="", file=stream)
+        print(colors.title + "%s" % f['title'] + colors.normal + " ", end="", file=stream)
+        print("[", end="", file=stream)
+        nk = len(f['keywords'])
+        for i in range(nk):
+            print(colors.keyword + f['keywords'][i] + colors.normal, end="", file=stream)
+            if (i < nk-1):
+                print(", ", end="", file=stream)
+        print("]", end="", file=stream)
+        print(" %s " % age(f['date']), end="\n", file=stream)
+    stream.flush()
+
+
+def main(nnotes, repeat=3):
+    notes = make_notes(nnotes)
+    cases = [("print() per piece", lambda stream: print_pieces(notes, stream)),
+            ("plain", lambda stream: render(PlainFormatter(age), notes, stream)),
+            ("color", lambda stream: render(ColorFormatter(colors, age), notes, stream)),
+            ("markdown", lambda stream: render(MarkdownFormatter(age), notes, stream))]
+    print("%-20s %14s" % ("formatter", "lines/s"))
+    with open(os.devnull, "w") as stream:
+        for (name, f) in cases:
+            elapsed = min(timed(f, stream)[1] for i in range(repeat))
+            print("%-20s %14.0f" % (name, nnotes / elapsed))
+
+
+if __name__ == "__main__":
+    nnotes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    main(nnotes)
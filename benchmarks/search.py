@@ -0,0 +1,27 @@
+'''
+Time full-text searches with Nota.search().
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.search [nnotes ...]
+'''
+
+import sys
+from .util import make_database, remove_database, timed
+
+
+def main(sizes, queries=("note", "content 12*", "note NOT content", "missingword")):
+    print("%10s %-20s %10s %12s" % ("notes", "query", "found", "ms"))
+    for n in sizes:
+        nota = make_database(n, keywords_per_note=1)
+        try:
+            for query in queries:
+                found, seconds = timed(nota.search, query, limit=20)
+                print("%10d %-20s %10d %12.3f" % (n, query, len(found), 1000 * seconds))
+        finally:
+            remove_database(nota)
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    main(sizes)
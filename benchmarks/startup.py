@@ -0,0 +1,78 @@
+'''
+Time the start-up of 'nota', which matters most when it is called from a
+shell prompt or an editor. The import of nota.main is timed with Python's
+'-X importtime' option, and the modules that take longest to import are
+listed; then 'nota <hash>' is timed from start to finish, against a bare
+'python3 -c pass'. The exit status is 1 if importing nota.main takes longer
+than the budget, so this may be used to catch slow imports creeping back.
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.startup [budget_ms [nnotes]]
+'''
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from .util import make_database, remove_database
+
+
+def import_times(env):
+    '''Return {module: (self_us, cumulative_us)} for an import of nota.main.'''
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import nota.main"],
+            env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in out.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            (own, cumulative, module) = line[12:].split("|")
+            if own.strip().isdigit():
+                times[module.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def run_time(argv, env, repeat):
+    '''Return the shortest time, in seconds, taken to run 'argv'.'''
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(budget, nnotes, repeat=10):
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None) # time imports from cached bytecode
+    import_times(env) # write the bytecode
+    runs = [import_times(env) for i in range(repeat)]
+    best = min(runs, key=lambda t: t["nota.main"][1])
+    total = best["nota.main"][1] / 1000
+    print("import nota.main: %.1f ms (budget %.1f ms)" % (total, budget))
+    print("slowest modules (self time):")
+    for (module, (own, cumulative)) in sorted(best.items(), key=lambda item: -item[1][0])[0:8]:
+        print("  %-32s %7.1f ms" % (module, own / 1000))
+    nota = make_database(nnotes)
+    home = tempfile.mkdtemp(prefix="nota_bench_home_")
+    try:
+        with open(os.path.join(home, ".notarc"), "w") as f:
+            f.write('database = "%s"\n' % nota.db)
+        env["HOME"] = home
+        hash = nota.cur.execute("SELECT hash FROM note WHERE noteId=1;").fetchone()[0][0:7]
+        bare = run_time([sys.executable, "-c", "pass"], env, repeat)
+        lookup = run_time([sys.executable, "-m", "nota", hash], env, repeat)
+        print("python3 -c pass:  %.1f ms" % (1000 * bare))
+        print("nota %s:     %.1f ms (%.1f ms more)" % (hash, 1000 * lookup, 1000 * (lookup - bare)))
+    finally:
+        os.remove(os.path.join(home, ".notarc"))
+        os.rmdir(home)
+        remove_database(nota)
+    return total <= budget
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    nnotes = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    sys.exit(0 if main(budget, nnotes) else 1)
@@ -0,0 +1,131 @@
+'''
+Time the main operations of nota on databases of several sizes, made by
+generate_database() from a fixed seed, and write the results as JSON, so
+that runs on different commits can be compared. Each result gives the
+number of notes in the database, the operation, the number of items it
+handled (e.g. notes added, or look-ups made), and the time it took (the
+shortest of a few runs, for operations that do not change the database).
+
+Usage (from the top-level directory):
+
+    python3 -m benchmarks.suite [results.json [nnotes ...]]
+
+The results go to stdout if the filename is '-' or not given, and the
+sizes default to 1000, 10000, 100000 and 1000000 notes. The largest
+sizes take a long time, mostly in 'import', since adding notes one at a
+time to a large full-text index is slow.
+'''
+
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from .util import generate_database, open_database, remove_database, timed
+
+summary_fields = ["title", "keywords", "due", "date", "hash", "book"] # as listed by 'nota'
+
+
+def add_notes(nota, nadd):
+    for i in range(nadd):
+        nota.add(title="added note %d" % i, keywords=["added", "keyword%d" % i], content="content of added note %d" % i)
+
+
+def find_by_hashes(nota, hashes):
+    for hash in hashes:
+        nota.find_by_hash(hash=hash, fields=summary_fields)
+
+
+def export_notes(nota, filename):
+    count = 0
+    with open(filename, "w", encoding="utf-8") as f:
+        for n in nota.iter_by_hash():
+            del n["book"]
+            del n["noteId"]
+            f.write(json.dumps(n) + "\n")
+            count += 1
+    return count
+
+
+def import_notes(filename):
+    fd, name = tempfile.mkstemp(prefix="nota_bench_import_", suffix=".db")
+    os.close(fd)
+    os.remove(name) # so that Nota() initializes it
+    nota = open_database(name)
+    try:
+        with open(filename, encoding="utf-8") as f:
+            return nota.bulk_add(json.loads(line) for line in f)
+    finally:
+        remove_database(nota)
+
+
+def commit():
+    '''Return the git commit being benchmarked, or None if it cannot be found.'''
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(nnotes, seed, repeat=3, nlookups=100, nadd=100):
+    '''Return the results for a database of 'nnotes' notes.'''
+    results = []
+    def result(operation, count, seconds):
+        print("%10d %-24s %8d %12.3f ms" % (nnotes, operation, count, 1000 * seconds), file=sys.stderr)
+        results.append({"notes": nnotes, "operation": operation, "count": count, "seconds": seconds})
+    def best(f, *args, **kwargs):
+        return min(timed(f, *args, **kwargs)[1] for i in range(repeat))
+    (nota, seconds) = timed(generate_database, nnotes, seed=seed)
+    result("generate", nnotes, seconds)
+    try:
+        step = max(1, nnotes // nlookups)
+        hashes = [h for (h,) in nota.cur.execute("SELECT substr(hash, 1, 7) FROM note WHERE noteId % ? = 0 LIMIT ?;",
+                [step, nlookups])]
+        result("find_by_hash", len(hashes), best(find_by_hashes, nota, hashes))
+        result("find_by_keyword (common)", 1,
+                best(nota.find_by_keyword, keywords=["keyword0"], strict_match=True, fields=summary_fields))
+        result("find_by_keyword (rare)", 1,
+                best(nota.find_by_keyword, keywords=["keyword1500"], strict_match=True, fields=summary_fields))
+        result("find_by_keyword (and)", 1,
+                best(nota.find_by_keyword, keywords=["keyword0", "keyword1"], strict_match=True, fields=summary_fields))
+        result("find_recent", 1, best(nota.find_recent, nrecent=20, fields=summary_fields))
+        result("search", 1, best(nota.search, "w1a*", fields=["hash", "title", "keywords"]))
+        result("add", nadd, timed(add_notes, nota, nadd)[1])
+        fd, exported = tempfile.mkstemp(prefix="nota_bench_", suffix=".json")
+        os.close(fd)
+        try:
+            (count, seconds) = timed(export_notes, nota, exported)
+            result("export", count, seconds)
+            (count, seconds) = timed(import_notes, exported)
+            result("import", count, seconds)
+        finally:
+            os.remove(exported)
+        trashed = nota.cur.execute("SELECT count(*) FROM note WHERE book = 0;").fetchone()[0]
+        result("empty_trash", trashed, timed(nota.empty_trash)[1])
+    finally:
+        remove_database(nota)
+    return results
+
+
+def main(output, sizes, seed=1):
+    report = {"commit": commit(), "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "seed": seed, "results": []}
+    for nnotes in sizes:
+        report["results"].extend(run(nnotes, seed))
+    if output == "-":
+        json.dump(report, sys.stdout, indent=1)
+        print("")
+    else:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == "__main__":
+    output = sys.argv[1] if len(sys.argv) > 1 else "-"
+    sizes = [int(n) for n in sys.argv[2:]] or [1000, 10000, 100000, 1000000]
+    main(output, sizes)
@@ -0,0 +1,144 @@
+'''
+Helpers shared by the benchmark scripts.
+'''
+
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+import time
+import hashlib
+import random
+from itertools import accumulate
+from nota.notaclass import Nota
+
+
+def open_database(name, quiet=True, profile="default"):
+    '''
+    Return a Nota object for the database file 'name', with its connection
+    set up with the named 'profile'. A new file is brought up to date by the
+    schema updates, which report their progress on stdout; unless 'quiet' is
+    false, that report is hidden, so that only the results are printed.
+    '''
+    if not quiet:
+        return Nota(db=name, quiet=quiet, profile=profile)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Nota(db=name, quiet=quiet, profile=profile)
+
+
+def make_database(nnotes, nkeywords=100, keywords_per_note=3, quiet=True, profile="default"):
+    '''
+    Create a temporary database holding 'nnotes' synthetic notes, each linked
+    to 'keywords_per_note' keywords drawn from a vocabulary of 'nkeywords'.
+    The rows are inserted directly, since calling Nota.add() for each note
+    would make set-up dominate the benchmark. The connection is set up with
+    the named 'profile' (see Nota.profiles). Returns the Nota object; the
+    database file is named by its 'db' attribute.
+    '''
+    fd, name = tempfile.mkstemp(prefix="nota_bench_", suffix=".db")
+    os.close(fd)
+    nota = open_database(name, quiet=quiet, profile=profile)
+    nota.cur.executemany("INSERT INTO keyword(keywordId, keyword) VALUES (?, ?);",
+            [(k + 1, "keyword%d" % k) for k in range(nkeywords)])
+    notes = []
+    links = []
+    for i in range(1, nnotes + 1):
+        date = "2020-01-01 00:00:%02d" % (i % 60)
+        title = "note %d" % i
+        hash = hashlib.sha256((title + str(i) + date).encode('utf8')).hexdigest()
+        notes.append((i, 1, date, date, "", title, "content of note %d" % i, hash, 0, 1))
+        for k in range(keywords_per_note):
+            links.append((i, 1 + (i * 7 + k * 13) % nkeywords))
+    nota.cur.executemany("INSERT INTO note(noteId, authorId, date, modified, due, title, content, hash, privacy, book) " +
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", notes)
+    nota.cur.executemany("INSERT INTO notekeyword(noteid, keywordid) VALUES (?, ?);", links)
+    nota.con.commit()
+    return nota
+
+
+def zipf_weights(n, s):
+    '''Return the cumulative weights of ranks 1 to n in a Zipf distribution with exponent s.'''
+    return list(accumulate(1 / r ** s for r in range(1, n + 1)))
+
+
+def generate_database(nnotes, seed=1, nkeywords=2000, zipf=1.1, keywords_per_note=3, nbooks=4,
+        attachment_fraction=0.01, trash_fraction=0.05, due_fraction=0.02, quiet=True, profile="default"):
+    '''
+    Create a temporary database like a real one, holding 'nnotes' notes,
+    generated from the given random 'seed', so that the same arguments
+    always give the same database. Keywords, and the words of titles and
+    contents, are drawn from vocabularies whose use follows a Zipf
+    distribution with the given exponent, so that a few keywords are linked
+    to many notes and most to few. The notes are spread over 'nbooks' books
+    (besides the trash), over the five years before 2024, and the given
+    fractions of them have attachments (drawn from a few distinct files),
+    are in the trash, or have due dates. As for make_database(), rows are
+    inserted directly, and the Nota object is returned.
+    '''
+    rng = random.Random(seed)
+    fd, name = tempfile.mkstemp(prefix="nota_bench_", suffix=".db")
+    os.close(fd)
+    nota = open_database(name, quiet=quiet, profile=profile)
+    for b in range(2, nbooks + 1):
+        nota.cur.execute("INSERT INTO book(number, name) VALUES (?, ?);", (b, "book%d" % b))
+    keywords = ["keyword%d" % k for k in range(nkeywords)]
+    nota.cur.executemany("INSERT INTO keyword(keywordId, keyword) VALUES (?, ?);",
+            [(k + 1, keyword) for (k, keyword) in enumerate(keywords)])
+    keyword_weights = zipf_weights(nkeywords, zipf)
+    words = ["w%x" % rng.getrandbits(24) for i in range(5000)]
+    word_weights = zipf_weights(len(words), zipf)
+    start = datetime.datetime(2019, 1, 1)
+    files = [bytes(rng.getrandbits(8) for i in range(rng.randint(1000, 20000))) for i in range(20)]
+    attachments = []
+    batch = 10000
+    # The full-text index is built in one pass at the end, which is much
+    # faster than updating it note by note, as its trigger would.
+    (fts_trigger,) = nota.cur.execute("SELECT sql FROM sqlite_master WHERE name = 'note_fts_insert';").fetchone()
+    nota.cur.execute("DROP TRIGGER note_fts_insert;")
+    for first in range(1, nnotes + 1, batch):
+        notes = []
+        links = []
+        for i in range(first, min(first + batch, nnotes + 1)):
+            date = (start + datetime.timedelta(seconds=rng.randrange(5 * 365 * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+            title = " ".join(rng.choices(words, cum_weights=word_weights, k=rng.randint(2, 8)))
+            content = " ".join(rng.choices(words, cum_weights=word_weights, k=rng.randint(10, 100)))
+            book = 0 if rng.random() < trash_fraction else rng.randint(1, nbooks)
+            due = ""
+            if rng.random() < due_fraction:
+                due = (start + datetime.timedelta(seconds=rng.randrange(6 * 365 * 86400))).strftime("%Y-%m-%d %H:%M:%S.%f")
+            hash = hashlib.sha256((title + str(i) + date).encode('utf8')).hexdigest()
+            notes.append((i, 1, date, date, due, title, content, hash, 0, book))
+            for k in sorted(set(rng.choices(range(1, nkeywords + 1), cum_weights=keyword_weights, k=keywords_per_note))):
+                links.append((i, k))
+            if rng.random() < attachment_fraction:
+                attachments.append((i, rng.randrange(len(files))))
+        nota.cur.executemany("INSERT INTO note(noteId, authorId, date, modified, due, title, content, hash, privacy, book) " +
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", notes)
+        nota.cur.executemany("INSERT INTO notekeyword(noteid, keywordid) VALUES (?, ?);", links)
+        nota.con.commit()
+    nota.cur.execute("INSERT INTO note_fts(note_fts) VALUES ('rebuild');")
+    nota.cur.execute(fts_trigger)
+    nota.con.commit()
+    digests = [nota.store_blob(contents=f) for f in files]
+    for (noteId, f) in attachments:
+        nota.cur.execute("INSERT INTO attachment(filename, sha256) VALUES (?, ?);", ["file%d.bin" % f, digests[f]])
+        nota.cur.execute("INSERT INTO note_attachment(noteId, attachmentId) VALUES (?, ?);", [noteId, nota.cur.lastrowid])
+    nota.con.commit()
+    nota.cur.execute("ANALYZE;")
+    return nota
+
+
+def remove_database(nota):
+    nota.con.close()
+    os.remove(nota.db)
+    for suffix in ("-wal", "-shm", "-journal"):
+        if os.path.exists(nota.db + suffix):
+            os.remove(nota.db + suffix)
+
+
+def timed(f, *args, **kwargs):
+    '''Return (result, seconds) for a call to f.'''
+    start = time.perf_counter()
+    rval = f(*args, **kwargs)
+    return rval, time.perf_counter() - start
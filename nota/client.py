@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+import json
+import os
+import socket
+import sys
+from .sockets import socket_path, trusted_socket
+
+
+class NotaClient:
+    def __init__(self, db="nota.db", debug=0, quiet=False, profile="default"):
+        '''
+
+        A stand-in for a Nota object that passes calls to a server started
+        with 'nota --serve', if one is running for the database. Methods that
+        the server does not provide are called on a Nota object of the
+        client's own, which is made when first needed. Use connect() to find
+        out whether a server is running.
+
+        '''
+        self.db = os.path.expanduser(db)
+        self.debug = debug
+        self.quiet = quiet
+        self.profile = profile
+        self.sock = None
+        self.local = None
+        self.next_id = 0
+
+
+    def connect(self):
+        '''
+        Connect to the server, returning False if there is none, or if its
+        socket might belong to someone else (see trusted_socket()).
+        '''
+        self.path = socket_path(self.db)
+        if not trusted_socket(self.path):
+            if os.path.exists(self.path):
+                self.warning("not using the socket '%s', since it or its directory is not private to you" % self.path)
+            return False
+        try:
+            self.open()
+        except OSError:
+            return False
+        self.close() # each request opens a connection of its own; see call()
+        self.fyi("using the server on socket '%s'", self.path)
+        return True
+
+
+    def open(self):
+        '''Open a connection to the server, for the next request.'''
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(self.path)
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            raise
+        self.stream = self.sock.makefile("rwb")
+
+
+    def close(self):
+        '''Close the connection to the server, if any.'''
+        if self.sock is not None:
+            self.stream.close()
+            self.sock.close()
+            self.sock = None
+
+
+    def call(self, method, **params):
+        '''
+        Call a method of the server's Nota object, and return the result. Each
+        request has a connection of its own, since the server answers one
+        connection at a time, so that other clients need not wait while this
+        one (or its pager) is busy with something else.
+        '''
+        self.next_id += 1
+        request = {"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params}
+        try:
+            if self.sock is None:
+                self.open()
+            self.stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            self.stream.flush()
+            response = json.loads(self.stream.readline())
+        except (OSError, ValueError):
+            self.error("lost connection to the server for database '%s'" % self.db)
+        finally:
+            self.close()
+        if "error" in response:
+            if not self.quiet:
+                print(response["error"]["message"], end="", file=sys.stderr)
+            sys.exit(response["error"].get("data") or 1)
+        return response["result"]
+
+
+    def __getattr__(self, name):
+        from .server import NotaServer # only once there is a server to call
+        if name in NotaServer.exported:
+            def remote(*args, **kwargs):
+                # The server takes arguments by name, so name any given by position.
+                from .notaclass import Nota
+                import inspect
+                params = inspect.signature(getattr(Nota, name)).bind(self, *args, **kwargs).arguments
+                del params["self"]
+                return self.call(name, **params)
+            return remote
+        if self.local is None:
+            from .notaclass import Nota
+            self.local = Nota(db=self.db, debug=self.debug, quiet=self.quiet, profile=self.profile)
+        return getattr(self.local, name)
+
+
+    def iter_found(self, hash=None, keywords=None, strict_match=False, book=-1, due_between=None,
+            batch=1000, after=None, fields=None):
+        '''As Nota.iter_found(), fetching one page of notes per request.'''
+        from .notaclass import Nota
+        return Nota.iter_found(self, hash, keywords, strict_match, book, due_between, batch, after, fields)
+
+
+    def iter_by_hash(self, hash=None, book=-1, batch=1000, fields=None):
+        return self.iter_found(hash=hash, book=book, batch=batch, fields=fields)
+
+
+    def hash_abbreviation_length(self):
+        '''
+        As Nota.hash_abbreviation_length(). The server only reads the stored
+        length, so if none is stored, the client's own Nota object stores it.
+        '''
+        nc = self.call("get_metadata", name="hash_abbreviation_length")
+        if nc is None:
+            return self.__getattr__("hash_abbreviation_length")()
+        return int(nc)
+
+
+    def age(self, d):
+        from .notaclass import Nota
+        return Nota.age(self, d) # needs nothing from the database
+
+
+    def ages(self, dates, now=None, cache=None):
+        from .notaclass import Nota
+        return Nota.ages(self, dates, now, cache)
+
+
+    def fyi(self, msg, *args, prefix="  "):
+        '''As Nota.fyi(), through the same logger.'''
+        if self.debug:
+            from .notaclass import Nota
+            Nota.fyi(self, msg, *args, prefix=prefix)
+
+
+    def logger(self):
+        from .notaclass import Nota
+        return Nota.logger(self)
+
+
+    def warning(self, msg, prefix="Warning: "):
+        if not self.quiet:
+            print(prefix + msg, file=sys.stderr)
+
+
+    def error(self, msg, level=1, prefix="Error: "):
+        if not self.quiet:
+            print(prefix + msg, file=sys.stderr)
+        sys.exit(level)
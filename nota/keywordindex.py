@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+import bisect
+import heapq
+
+
+class KeywordIndex:
+    def __init__(self, rows=()):
+        '''
+
+        An in-memory index of the keyword table, used to resolve the keywords
+        typed by users into keywordId values. It is built from (keywordId,
+        keyword) rows, and holds a table of exact keywords, a table of
+        lowercased keywords, a sorted list of lowercased keywords for prefix
+        matching, and a table of character bigrams for fuzzy matching.
+
+        '''
+        self.ids = {}       # keyword -> [keywordId, ...]
+        self.lower_ids = {} # lowercased keyword -> [keywordId, ...]
+        self.lower = []     # sorted lowercased keywords
+        self.bigrams = {}   # bigram -> set of lowercased keywords
+        for (keywordId, keyword) in rows:
+            self.add(keywordId, keyword)
+
+
+    def bigrams_of(self, word):
+        word = "^" + word + "$" # so that short words, and word ends, have bigrams
+        return set(word[i:i+2] for i in range(len(word) - 1))
+
+
+    def add(self, keywordId, keyword):
+        '''Add a keyword, e.g. after it has been inserted into the keyword table.'''
+        keyword = str(keyword)
+        self.ids.setdefault(keyword, []).append(keywordId)
+        lower = keyword.lower()
+        if lower not in self.lower_ids:
+            self.lower_ids[lower] = []
+            bisect.insort(self.lower, lower)
+            for bigram in self.bigrams_of(lower):
+                self.bigrams.setdefault(bigram, set()).add(lower)
+        self.lower_ids[lower].append(keywordId)
+
+
+    def exact(self, keyword):
+        '''Return the IDs of keywords that equal the given one.'''
+        return list(self.ids.get(keyword, []))
+
+
+    def nocase(self, keyword):
+        '''Return the IDs of keywords that equal the given one, ignoring case.'''
+        return list(self.lower_ids.get(keyword.lower(), []))
+
+
+    def prefix(self, prefix):
+        '''Return the lowercased keywords that start with the given (lowercased) prefix.'''
+        rval = []
+        for i in range(bisect.bisect_left(self.lower, prefix), len(self.lower)):
+            if not self.lower[i].startswith(prefix):
+                break
+            rval.append(self.lower[i])
+        return rval
+
+
+    def fuzzy(self, word, n=1, cutoff=0.6, candidates=50):
+        '''
+        Return up to 'n' lowercased keywords that are close to the given
+        (lowercased) word, in the sense of difflib.get_close_matches(). Only
+        the 'candidates' keywords sharing the most bigrams with the word are
+        compared, so the cost does not grow with the size of the vocabulary.
+        '''
+        import difflib # only needed for misspelled keywords
+        shared = {}
+        for bigram in self.bigrams_of(word):
+            for keyword in self.bigrams.get(bigram, ()):
+                shared[keyword] = shared.get(keyword, 0) + 1
+        best = heapq.nlargest(candidates, shared, key=lambda k: shared[k])
+        return difflib.get_close_matches(word, best, n=n, cutoff=cutoff)
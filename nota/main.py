@@ -1,21 +1,172 @@
 #!/usr/bin/python3
 
 from .notaclass import Nota
-import argparse
+from .client import NotaClient
+from .renderer import Renderer, PlainFormatter, ColorFormatter, MarkdownFormatter
 import sys
 import json
+import io
 import os
 import re
-import textwrap
 import datetime
-import tempfile
-from random import randint, seed
-from time import strptime
-import subprocess
+import time
+import types
+import itertools
 
 indent = "  "
 showRandomHint = False
 
+def argument_parser(defaultDatabase="~/Dropbox/nota.db", defaultProfile="default"):
+    '''
+    Return the parser for the command line, with defaults for --database
+    and --profile as given (normally from the ~/.notarc file).
+    '''
+    import argparse
+    import textwrap
+    parser = argparse.ArgumentParser(prog="nota", description="Nota: an organizer for textual notes",
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog=textwrap.dedent('''\
+    There are several ways to use nota. Try 'nota --hints' for some hints, and see
+    http://dankelley.github.io/nota/ for more. Some common uses are as follows.
+
+        nota                    # list notes, with first column being hash code
+        nota ab                 # list notes with hash starting 'ab'
+        nota -k key             # list notes with indicated keyword
+        nota -k a,b             # list notes with keywords a and b
+        nota -k 'a|b'           # list notes with keyword a or b
+        nota -k 'a,!b'          # list notes with keyword a but not b
+        nota --search words     # list notes containing the indicated words
+        nota -a                 # add a note (opens a text editor)
+        nota -a -t=... -c=...   # add a note (without a text editor)
+        nota -e ab              # edit note with hash starting 'ab' (opens editor)
+        nota -d ab              # delete note with hash starting 'ab'
+        nota --export ab > F    # export note(s) to file 'F'
+        nota --import F         # import note(s) from file 'F'
+        nota --export - --file F.gz  # export all notes to gzip-compressed file 'F.gz'
+        nota --create-book Foo  # create a new book named Foo
+        nota --serve &          # serve the database, so later commands start faster
+        nota -b Foo             # list notes in book named Foo
+        nota -r                 # list recent notes
+        nota --limit 20         # list the first 20 notes
+        nota --limit 20 --after ab  # list the 20 notes after the one with hash 'ab'
+
+    The ~/.notarc file may be used for customization, and may contain e.g. the
+    following:
+
+        Specify database name
+            db = \"~/Dropbox/nota.db\"
+        Turn on debugging mode
+            debug = True
+        Set verbose level to 0 to turn off trash/hint reports
+            verbose = 0
+        Show internal database ID numbers for development tests
+            show_id = False
+        Tune the database connection for a database in a synced folder (or
+        use "wal" for a database on a local disk, or "default")
+            profile = "synced"
+        Use color in displays
+            color = True
+        or set up a color theme, using one of
+            color = "bubblegum" # red hash, cyan keywords
+            color = "forest" # green hash, straw keywords
+            color = "run" # red hash, underlined keywords
+            color = "default" # same as "bubblegum"
+        or specify hash, title, keyword, and book colors directly:
+            color.hash = "red"
+            color.title = "bold"
+            color.keyword = "cyan"
+            color.book = "blue"
+        where the black variants are: "bold", "dim", "underlined", "blink",
+        "reverse" and "normal" and the available colors are: "black", "red",
+        "green", "yellow", "blue", "magenta", "cyan", "lightgray", "darkgray",
+        "lightred", "lightgreen", "lightyellow", "lightblue", "lightmagenta",
+        and "lightcyan".
+
+    Advanced usage:
+
+        Recreate hashes (to remove duplicate hashes, which are unlikely)
+            nota --special=rehash
+        Check (and if need be, rebuild) the keywords cached with each note
+            nota --special=check-keywords
+        Count and time the SQL statements run by a command
+            nota --profile-sql -k foo
+
+
+        '''))
+    parser.add_argument("hash", nargs="?", default="", help="abbreviated hash to search for", metavar="hash")
+    parser.add_argument("-a", "--add", action="store_true", dest="add", default=False, help="add a note; may be given alone, or in combination with --title and possibly also with --content and --keywords")
+    parser.add_argument("-b", "--book", type=str, dest="book", default="", help="specify book named 'B'", metavar="B")
+    parser.add_argument("-e", "--edit", type=str, default=None, help="edit note with hash 'H'", metavar="H")
+    parser.add_argument("-d", "--delete", type=str, default=None, help="move note with hash 'H' to trash", metavar="H")
+    parser.add_argument("-u", "--undelete", type=str, default=None, help="remove note with hash 'H' from trash", metavar="H")
+    parser.add_argument("-t", "--title", type=str, default="", help="string with note title", metavar="T")
+    parser.add_argument("-k", "--keywords", type=str, default="", help="string with comma-separated keywords; when searching, notes must match all of them, and 'a|b' matches either a or b, while '!a' matches notes without a", metavar="K")
+    parser.add_argument("-A", "--attachments", type=str, default="", help="string with comma-separated filenames", metavar="A")
+    #parser.add_argument("-K", "--Keywords", type=str, default="", help="string of comma-separated keywords", metavar="K")
+    parser.add_argument("-c", "--content", type=str, default="", help="string with note contents", metavar="C")
+    parser.add_argument("--extract", action="store_true", dest="extract_attachments", default=False, help="Extract attachments to the present directory (or that named by --extract-dir)")
+    parser.add_argument("--extract-dir", type=str, default=None, dest="extract_dir", help="extract attachments to directory 'D', which is created if need be", metavar="D")
+    parser.add_argument("--limit", type=int, default=None, help="list at most N notes", metavar="N")
+    parser.add_argument("--page", type=int, default=1, help="with --limit, list the P-th group of N notes", metavar="P")
+    parser.add_argument("--after", type=str, default=None, help="list the notes that follow the note with hash 'H' (e.g. the last one listed with --limit)", metavar="H")
+    parser.add_argument("--jobs", type=int, default=4, help="number of attachments to extract at once (defaults to 4)", metavar="N")
+    #parser.add_argument("-r", "--recent", action="store_true", dest="recent_notes", default=False, help="show recent notes")
+    parser.add_argument("-p", "--pipe", action="store_true", dest="pipe", default=False, help="output is to a pipe")
+    parser.add_argument("-r", "--recent", nargs='?', type=int, action="store", const=-2, default=-1, dest="recent_notes", help="show N recent notes (defaults to N=4)", metavar="N")
+    parser.add_argument("--create-book", type=str, default="", dest="create_book", help="create a book named 'B'", metavar="B")
+    parser.add_argument("--change-book", nargs=2, type=str, default="", dest="change_book", help="move note with hash 'H' to book 'B'", metavar=("H", "B"))
+    parser.add_argument("--list-books", action="store_true", dest="list_books", default=False, help="list books")
+    parser.add_argument("--list-keywords", action="store_true", dest="list_keywords", default=False, help="list keywords")
+    parser.add_argument("--rename-book", type=str, nargs=2, help="rename notebook 'O' as 'N'", metavar=("O","N"))
+    parser.add_argument("--rename-keyword", type=str, nargs=2, help="rename keyword 'O' as 'N'", metavar=("O","N"))
+    parser.add_argument("--pager", type=str, dest="pager", default=None, help="pager for long output; may be 'more' (the default), 'less', or 'none'. It will be called with arguments '-R -X -F', which make sense for both 'less' and 'more'. If not given with --pager, a value is searched for in ~/.notarc.", metavar="cmd")
+    parser.add_argument("--count", action="store_true", dest="count", default=False, help="report only count of found results")
+    parser.add_argument("--debug", action="store_true", dest="debug", default=False, help="set debugging on")
+    parser.add_argument("--export", type=str, default=None, help="export notes matching hash (use has '-' for all notes)", metavar="hash")
+    parser.add_argument("--import", type=str, default=None, dest="do_import", help="import notes from --export output", metavar="file")
+    if False: # may add later but don't tell users so, just yet
+        parser.add_argument("--privacy", type=int, default=0, help="set privacy level (0=open, 1=closed)", metavar="level")
+    parser.add_argument("--file", type=str, help="filename for i/o, e.g. for --export output (which is otherwise written to stdout)", metavar="name")
+    parser.add_argument("--compress", type=str, default=None, choices=["gzip", "zstd"], help="compress --export output, or decompress --import input, with 'gzip' or 'zstd' (inferred from filenames ending in '.gz' or '.zst'; 'zstd' requires the zstandard package)", metavar="method")
+    parser.add_argument("--color", type=str, default=None, help="specify named scheme or True/False", metavar="c")
+    parser.add_argument("--database", type=str, default=defaultDatabase, help="filename for database (defaults to ~/Dropbox/nota.db if not supplied as this argument, and if not specified in the ~/.notarc", metavar="db")
+    parser.add_argument("--profile", type=str, default=defaultProfile, choices=sorted(Nota.profiles), help="connection settings for the database (defaults to 'default' if not supplied as this argument, and if not specified in the ~/.notarc)")
+    parser.add_argument("--due", type=str, default="", help="time when item is due, e.g. 'tomorrow' or '3 days'; when listing, show only the notes due that day (for 'today' or 'tomorrow') or between now and then, so not those overdue", metavar="when")
+    parser.add_argument("--empty-trash", action="store_true", dest="empty_trash", default=False, help="empty trash, permanently deleting notes therein")
+    parser.add_argument("--hints", action="store_true", dest="hints", default=False, help="get hints")
+    parser.add_argument("--markdown", action="store_true", dest="markdown", default=False, help="use markdown format for output")
+    parser.add_argument("--serve", action="store_true", dest="serve", default=False, help="serve the database to later invocations of nota, which then start faster")
+    parser.add_argument("--local", action="store_true", dest="local", default=False, help="do not use a server started with --serve")
+    parser.add_argument("--profile-sql", action="store_true", dest="profile_sql", default=False, help="report the SQL statements run, with their timings, and the query plans of any taking over 100 ms (implies --local)")
+    parser.add_argument("--search", type=str, default=None, help="search titles and contents of notes for the words in 'W'", metavar="W")
+    parser.add_argument("--special", type=str, default="", help="special actions", metavar="action")
+    parser.add_argument("--trash", action="store_true", dest="trash", default=False, help="show contents of trash")
+    parser.add_argument("--vacuum", action="store_true", dest="vacuum", default=False, help="with --empty-trash, also compact the database file")
+    parser.add_argument("--verbose", type=int, default=None, help="set level of verbosity (0=quiet, 1=default)", metavar="level")
+    parser.add_argument("--version", action="store_true", dest="version", default=False, help="get version number")
+    return parser
+
+
+def fast_args(argv, defaultDatabase="~/Dropbox/nota.db", defaultProfile="default"):
+    '''
+    Return the parsed arguments for the commonest command lines, 'nota' and
+    'nota <hash>', without building the parser, whose import and set-up take
+    longer than the look-up itself. For other command lines, return None.
+    The values must match those from argument_parser(); see the tests.
+    '''
+    if len(argv) > 1 or (argv and argv[0][0:1] == "-"):
+        return None
+    return types.SimpleNamespace(hash=argv[0] if argv else "", add=False, book="", edit=None,
+            delete=None, undelete=None, title="", keywords="", attachments="", content="",
+            extract_attachments=False, extract_dir=None, limit=None, page=1, after=None, jobs=4,
+            pipe=False, recent_notes=-1, create_book="", change_book="", list_books=False,
+            list_keywords=False, rename_book=None, rename_keyword=None, pager=None, count=False,
+            debug=False, export=None, do_import=None, file=None, compress=None, color=None,
+            database=defaultDatabase, profile=defaultProfile, due="", empty_trash=False,
+            hints=False, markdown=False, serve=False, local=False, profile_sql=False, search=None, special="",
+            trash=False, vacuum=False, verbose=None, version=False)
+
+
 def nota():
     hints = [
             'see recent notes "nota -r"',
@@ -25,6 +176,7 @@ def nota():
             'back up database by e.g. "cp ~/Dropbox/nota.db ~/nota-backup.db"',
             'create new book: "nota --create-book Bookname"',
             'create new note hashes: "nota --special rehash"',
+            'check the keywords cached with notes: "nota --special check-keywords"',
             'create PDF of note with hash \'abcd\': "nota --markdown abcd | pandoc -V geometry:margin=1in -o abcd.pdf"',
             'delete note with hash \'ab...\': "nota -d ab"',
             'edit note with hash \'ab...\': "nota -e ab" (opens EDITOR)',
@@ -40,6 +192,7 @@ def nota():
             'list notes in markdown format: "nota --markdown"',
             'list notes with hash \'ab...\': "nota ab"',
             'list notes with keyword \'foo\': "nota -k foo"',
+            'list notes containing the word \'foo\': "nota --search foo"',
             'list notes within book: "nota -b Bookname"',
             'list notes without pager: "nota --pager=none"',
             'move note to new book: "nota --change-book hash Newbook"',
@@ -47,6 +200,7 @@ def nota():
             'rename keyword: "nota --rename-keyword Old New"',
             'untrash notes with hash \'ab...\': "nota --undelete ab"',
             'extract attachments from note with given hash: "nota --extract hash"',
+            'extract attachments of notes with keyword \'foo\' to a directory: "nota -k foo --extract-dir D"',
             'visit http://dankelley.github.io/nota/documentation.html to learn more']
 
     def color_code(c, default="\033[0m"):
@@ -73,27 +227,46 @@ def nota():
         return(rval)
 
 
-    def due_str(due):
-        due = datetime.datetime.strptime(due, '%Y-%m-%d %H:%M:%S.%f')
-        now = datetime.datetime.now()
-        when = abs(due - now).total_seconds()
-        if due > now:
-            if when < 2 * 3600:
-                return("(due in %d minutes)" % round(when / 60))
-            elif when < 86400:
-                return("(due in %d hours)" % round(when / 3600))
+    def random_hint():
+        import random
+        return hints[random.randint(0, len(hints)-1)]
+
+    def open_notes_file(name, mode, compress=None):
+        '''
+        Open a file of exported notes for reading (mode "r") or writing (mode
+        "w"), as text. A name of None or "-" means stdin or stdout. The file may
+        be compressed, with compress being "gzip" or "zstd"; if compress is not
+        given, it is inferred from a filename ending in ".gz" or ".zst".
+        '''
+        if name == "-":
+            name = None
+        if not compress and name:
+            if name.endswith(".gz"):
+                compress = "gzip"
+            elif name.endswith(".zst"):
+                compress = "zstd"
+        if not compress:
+            if name:
+                return open(name, mode, encoding="utf-8")
+            return sys.stdin if mode == "r" else sys.stdout
+        raw = open(name, mode + "b") if name else (sys.stdin.buffer if mode == "r" else sys.stdout.buffer)
+        if compress == "gzip":
+            import gzip
+            stream = gzip.GzipFile(fileobj=raw, mode=mode + "b")
+        elif compress == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                print("Error: zstd compression requires the 'zstandard' package", file=sys.stderr)
+                sys.exit(1)
+            if mode == "r":
+                stream = zstandard.ZstdDecompressor().stream_reader(raw)
             else:
-                return("(due in %d days)" % round(when / 3600 / 24))
+                stream = zstandard.ZstdCompressor().stream_writer(raw)
         else:
-            if when < 2 * 3600:
-                return("(overdue by %d minutes)" % (when / 60))
-            elif when < 86400:
-                return("(overdue by %d hours)" % (when / 3600))
-            else:
-                return("(overdue by %.1f days)" % (when / 3600 / 24))
-
-    def random_hint():
-        return hints[randint(0, len(hints)-1)]
+            print("Error: compression must be 'gzip' or 'zstd', not '%s'" % compress, file=sys.stderr)
+            sys.exit(1)
+        return io.TextIOWrapper(stream, encoding="utf-8")
 
     def get_from_dotfile(file, token, default=""):
         try:
@@ -132,104 +305,12 @@ def nota():
     verbose = int(get_from_dotfile("~/.notarc", "verbose", -999))
     pager = get_from_dotfile("~/.notarc", "pager", None)
 
-    parser = argparse.ArgumentParser(prog="nota", description="Nota: an organizer for textual notes",
-            formatter_class=argparse.RawDescriptionHelpFormatter,
-            epilog=textwrap.dedent('''\
-    There are several ways to use nota. Try 'nota --hints' for some hints, and see
-    http://dankelley.github.io/nota/ for more. Some common uses are as follows.
-
-        nota                    # list notes, with first column being hash code
-        nota ab                 # list notes with hash starting 'ab'
-        nota -k key             # list notes with indicated keyword
-        nota -a                 # add a note (opens a text editor)
-        nota -a -t=... -c=...   # add a note (without a text editor)
-        nota -e ab              # edit note with hash starting 'ab' (opens editor)
-        nota -d ab              # delete note with hash starting 'ab'
-        nota --export ab > F    # export note(s) to file 'F'
-        nota --import F         # import note(s) from file 'F'
-        nota --create-book Foo  # create a new book named Foo
-        nota -b Foo             # list notes in book named Foo
-        nota -r                 # list recent notes
-
-    The ~/.notarc file may be used for customization, and may contain e.g. the
-    following:
-
-        Specify database name
-            db = \"~/Dropbox/nota.db\"
-        Turn on debugging mode
-            debug = True
-        Set verbose level to 0 to turn off trash/hint reports
-            verbose = 0
-        Show internal database ID numbers for development tests
-            show_id = False
-        Use color in displays
-            color = True
-        or set up a color theme, using one of
-            color = "bubblegum" # red hash, cyan keywords
-            color = "forest" # green hash, straw keywords
-            color = "run" # red hash, underlined keywords
-            color = "default" # same as "bubblegum"
-        or specify hash, title, keyword, and book colors directly:
-            color.hash = "red"
-            color.title = "bold"
-            color.keyword = "cyan"
-            color.book = "blue"
-        where the black variants are: "bold", "dim", "underlined", "blink",
-        "reverse" and "normal" and the available colors are: "black", "red",
-        "green", "yellow", "blue", "magenta", "cyan", "lightgray", "darkgray",
-        "lightred", "lightgreen", "lightyellow", "lightblue", "lightmagenta",
-        and "lightcyan".
-
-    Advanced usage:
-
-        Recreate hashes (to remove duplicate hashes, which are unlikely)
-            nota --special=rehash
-
-
-        '''))
-    parser.add_argument("hash", nargs="?", default="", help="abbreviated hash to search for", metavar="hash")
-    parser.add_argument("-a", "--add", action="store_true", dest="add", default=False, help="add a note; may be given alone, or in combination with --title and possibly also with --content and --keywords")
-    parser.add_argument("-b", "--book", type=str, dest="book", default="", help="specify book named 'B'", metavar="B")
-    parser.add_argument("-e", "--edit", type=str, default=None, help="edit note with hash 'H'", metavar="H")
-    parser.add_argument("-d", "--delete", type=str, default=None, help="move note with hash 'H' to trash", metavar="H")
-    parser.add_argument("-u", "--undelete", type=str, default=None, help="remove note with hash 'H' from trash", metavar="H")
-    parser.add_argument("-t", "--title", type=str, default="", help="string with note title", metavar="T")
-    parser.add_argument("-k", "--keywords", type=str, default="", help="string with comma-separated keywords", metavar="K")
-    parser.add_argument("-A", "--attachments", type=str, default="", help="string with comma-separated filenames", metavar="A")
-    #parser.add_argument("-K", "--Keywords", type=str, default="", help="string of comma-separated keywords", metavar="K")
-    parser.add_argument("-c", "--content", type=str, default="", help="string with note contents", metavar="C")
-    parser.add_argument("--extract", action="store_true", dest="extract_attachments", default=False, help="Extract attachments to a temporary directory")
-    #parser.add_argument("-r", "--recent", action="store_true", dest="recent_notes", default=False, help="show recent notes")
-    parser.add_argument("-p", "--pipe", action="store_true", dest="pipe", default=False, help="output is to a pipe")
-    parser.add_argument("-r", "--recent", nargs='?', type=int, action="store", const=-2, default=-1, dest="recent_notes", help="show N recent notes (defaults to N=4)", metavar="N")
-    parser.add_argument("--create-book", type=str, default="", dest="create_book", help="create a book named 'B'", metavar="B")
-    parser.add_argument("--change-book", nargs=2, type=str, default="", dest="change_book", help="move note with hash 'H' to book 'B'", metavar=("H", "B"))
-    parser.add_argument("--list-books", action="store_true", dest="list_books", default=False, help="list books")
-    parser.add_argument("--list-keywords", action="store_true", dest="list_keywords", default=False, help="list keywords")
-    parser.add_argument("--rename-book", type=str, nargs=2, help="rename notebook 'O' as 'N'", metavar=("O","N"))
-    parser.add_argument("--rename-keyword", type=str, nargs=2, help="rename keyword 'O' as 'N'", metavar=("O","N"))
-    parser.add_argument("--pager", type=str, dest="pager", default=None, help="pager for long output; may be 'more' (the default), 'less', or 'none'. It will be called with arguments '-R -X -F', which make sense for both 'less' and 'more'. If not given with --pager, a value is searched for in ~/.notarc.", metavar="cmd")
-    parser.add_argument("--count", action="store_true", dest="count", default=False, help="report only count of found results")
-    parser.add_argument("--debug", action="store_true", dest="debug", default=False, help="set debugging on")
-    parser.add_argument("--export", type=str, default=None, help="export notes matching hash (use has '-' for all notes)", metavar="hash")
-    parser.add_argument("--import", type=str, default=None, dest="do_import", help="import notes from --export output", metavar="file")
-    if False: # may add later but don't tell users so, just yet
-        parser.add_argument("--privacy", type=int, default=0, help="set privacy level (0=open, 1=closed)", metavar="level")
-    parser.add_argument("--file", type=str, help="filename for i/o", metavar="name")
     # Process the dotfile (need for next parser call)
     defaultDatabase = get_from_dotfile("~/.notarc", "database", "~/Dropbox/nota.db")
-    # Back to the parser
-    parser.add_argument("--color", type=str, default=None, help="specify named scheme or True/False", metavar="c")
-    parser.add_argument("--database", type=str, default=defaultDatabase, help="filename for database (defaults to ~/Dropbox/nota.db if not supplied as this argument, and if not specified in the ~/.notarc", metavar="db")
-    parser.add_argument("--due", type=str, default="", help="time when item is due", metavar="when")
-    parser.add_argument("--empty-trash", action="store_true", dest="empty_trash", default=False, help="empty trash, permanently deleting notes therein")
-    parser.add_argument("--hints", action="store_true", dest="hints", default=False, help="get hints")
-    parser.add_argument("--markdown", action="store_true", dest="markdown", default=False, help="use markdown format for output")
-    parser.add_argument("--special", type=str, default="", help="special actions", metavar="action")
-    parser.add_argument("--trash", action="store_true", dest="trash", default=False, help="show contents of trash")
-    parser.add_argument("--verbose", type=int, default=None, help="set level of verbosity (0=quiet, 1=default)", metavar="level")
-    parser.add_argument("--version", action="store_true", dest="version", default=False, help="get version number")
-    args = parser.parse_args()
+    defaultProfile = get_from_dotfile("~/.notarc", "profile", "default")
+    args = fast_args(sys.argv[1:], defaultDatabase, defaultProfile)
+    if args is None:
+        args = argument_parser(defaultDatabase, defaultProfile).parse_args()
 
     # FIXME: probably this commented-out stuff can just be deleted,
     # since I like the look of the present scheme.
@@ -242,6 +323,8 @@ def nota():
     args.keywords = [key.strip() for key in args.keywords.split(',')]
     args.attachmentsoriginal = args.attachments
     args.attachments = [key.strip() for key in args.attachments.split(',')]
+    if args.extract_dir:
+        args.extract_attachments = True
     #args.Keywordsoriginal = args.Keywords
     #args.Keywords = [Key.lstrip().rstrip() for Key in args.Keywords.split(',')]
 
@@ -250,6 +333,7 @@ def nota():
         hash = '\033[33m'   # yellow [git hash color]
         title = '\033[1m'   # bold
         keyword = '\033[4m' # darkcyan [git '@@' color]
+        book = ''           # set by some color schemes
         normal = '\033[0m' # black
     if args.color:
         if args.color == "True":
@@ -308,6 +392,15 @@ def nota():
         color.book = ''
         color.normal = ""
 
+    def make_renderer(hash_length):
+        '''Return a Renderer for listings, in markdown, in color or as plain text.'''
+        if args.markdown:
+            return Renderer(MarkdownFormatter(nota.age, hash_length, show_id))
+        elif use_color:
+            return Renderer(ColorFormatter(color, nota.age, hash_length, show_id))
+        else:
+            return Renderer(PlainFormatter(nota.age, hash_length, show_id))
+
 
     if not args.debug:
         args.debug = debug
@@ -338,7 +431,29 @@ def nota():
             args.verbose = verbose
     #print("args.verbose: %s" % args.verbose)
 
-    nota = Nota(debug=args.debug, db=args.database, quiet=args.count)
+    if args.serve:
+        from .server import NotaServer
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0)) # so the socket is removed on 'kill'
+        nota = Nota(debug=args.debug, db=args.database, quiet=args.count, profile=args.profile)
+        server = NotaServer(nota)
+        print("Serving database '%s' on socket '%s'; press Control-C to stop." % (nota.db, server.path))
+        server.serve()
+        sys.exit(0)
+    # Use a server started with 'nota --serve', if there is one.
+    nota = None
+    stats = None
+    if args.profile_sql:
+        from .sqlstats import SqlStats
+        import atexit
+        stats = SqlStats()
+        atexit.register(stats.report) # after the command, however it exits
+    if not args.local and not args.profile_sql: # the statements must be run here to be profiled
+        nota = NotaClient(debug=args.debug, db=args.database, quiet=args.count, profile=args.profile)
+        if not nota.connect():
+            nota = None
+    if nota is None:
+        nota = Nota(debug=args.debug, db=args.database, quiet=args.count, profile=args.profile, stats=stats)
 
     if args.version:
         print(nota.version())
@@ -398,8 +513,8 @@ def nota():
         exit(0)
 
     if args.rename_keyword:
-        (old, new) = args.book_rename
-        nota.keyword_rename(old, new)
+        (old, new) = args.rename_keyword
+        nota.rename_keyword(old, new)
         exit(0)
 
     if args.special:
@@ -407,6 +522,13 @@ def nota():
             nota.fyi("should rehash now")
             nota.rehash()
             sys.exit(0)
+        elif args.special == "check-keywords":
+            n = nota.rebuild_keyword_cache()
+            if n:
+                print("Rebuilt the cached keywords of %d notes." % n)
+            else:
+                print("The cached keywords of all notes are correct.")
+            sys.exit(0)
         else:
             nota.error("unknown action '%s'" % args.special)
 
@@ -432,59 +554,67 @@ def nota():
         if not b:
             nota.error("No book named '%s'" % args.book)
         book = list(b.values())[0]
-        nota.fyi("--book yields book index %s" % book)
+        nota.fyi("--book yields book index %s", book)
     else:
         book = -1
 
     if args.delete:
-        nota.fyi("should now delete note %s" % args.delete)
+        nota.fyi("should now delete note %s", args.delete)
         nota.delete(args.delete)
         sys.exit(0)
 
     if args.undelete:
-        nota.fyi("should now undelete note with hash %s" % args.undelete)
+        nota.fyi("should now undelete note with hash %s", args.undelete)
         nota.undelete(args.undelete)
         sys.exit(0)
 
     if args.empty_trash:
         nota.fyi("should now empty the trash")
-        nota.empty_trash()
+        (deleted, freed) = nota.empty_trash(vacuum=args.vacuum)
+        if args.verbose > 0:
+            print("Deleted %d notes from the trash, freeing %.1f kB." % (deleted, freed / 1024))
         sys.exit(0)
 
     if args.edit:
-        nota.fyi("should now edit note %s" % args.edit)
+        nota.fyi("should now edit note %s", args.edit)
         nota.edit(args.edit)
         sys.exit(0)
 
     if args.do_import: # need do_ in name to avoid language conflict
         try:
-            f = open(args.do_import, "r")
+            f = open_notes_file(args.do_import, "r", args.compress)
         except:
             nota.error("cannot read file '%s'" % args.do_import)
-        notes = []
-        i = 0
-        for line in f:
-            try:
-                notes.append(json.loads(line))
-            except:
-                nota.error("cannot read line %d of file '%s'" % (line, args.do_import))
-            i = i + 1
-        for n in notes:
-            try:
-                # The 'book' is ignored because different users have different books.
-                id = nota.add(title=n["title"], keywords=n['keywords'], content=n["content"], date=n['date'], due=n['due'])
-            except:
-                nota.error("cannot create note with title '%s'" % n["title"])
+        def read_notes(f):
+            '''Yield notes from a file of --export output, one line at a time.'''
+            for (i, line) in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    nota.error("cannot read line %d of file '%s'" % (i, args.do_import))
+        # The 'book' is ignored because different users have different books.
+        start = time.perf_counter()
+        count = nota.bulk_add(read_notes(f))
+        elapsed = time.perf_counter() - start
+        f.close()
+        if args.verbose > 0:
+            print("Imported %d notes in %.1f s (%.0f notes/s)." % (count, elapsed, count / max(elapsed, 1e-6)))
+        sys.exit(0)
 
     if args.export:
-        nota.fyi("should export now; hash=%s" % args.export)
+        nota.fyi("should export now; hash=%s", args.export)
         if args.export == '-':
             args.export = None
-        noteIds = nota.find_by_hash(args.export)
-        for n in noteIds:
+        # Notes are written as they are read from the database, so memory use
+        # does not depend on the number of notes.
+        f = open_notes_file(args.file, "w", args.compress)
+        for n in nota.iter_by_hash(args.export):
             del n["book"] # not useful in any other context
             del n["noteId"] # not useful in any other context
-            print(json.dumps(n))
+            f.write(json.dumps(n) + "\n")
+        f.close()
         sys.exit(0)
 
     if args.trash:
@@ -493,22 +623,25 @@ def nota():
         #print("args.keywords[0] '%s'" % args.keywords[0])
         #print("args.hash %s" % args.hash)
         if not '' == args.keywords[0]:
-            trashed = nota.find_by_keyword(keywords=args.keywords, book=0)
+            trashed = nota.find_by_keyword(keywords=args.keywords, book=0, fields=["hash", "title", "keywords"])
         else:
-            trashed = nota.find_by_hash(hash=args.hash, book=0)
-        hal = nota.hash_abbreviation_length()
+            trashed = nota.find_by_hash(hash=args.hash, book=0, fields=["hash", "title", "keywords"])
+        renderer = make_renderer(nota.hash_abbreviation_length())
         for t in trashed:
-            print(color.hash + "%s: " % t['hash'][0:hal] + color.normal, end="")
-            if show_id:
-                print("(%s) " % t['noteId'], end="")
-            print(color.title + "%s" % t['title'] + color.normal + " ", end="")
-            print("[", end="")
-            nk = len(t['keywords'])
-            for i in range(nk):
-                print(color.keyword + t['keywords'][i] + color.normal, end="")
-                if (i < nk-1):
-                    print(", ", end="")
-            print("]", end="\n")
+            renderer.trashed(t)
+        renderer.flush()
+        sys.exit(0)
+
+    if args.search:
+        nota.fyi("should search for '%s' now", args.search)
+        markers = ("*", "*") if args.markdown else (color.keyword, color.normal)
+        found = nota.search(args.search, book=book, markers=markers, fields=["hash", "title", "keywords"])
+        if not found:
+            print("No active notes match this search.")
+        renderer = make_renderer(nota.hash_abbreviation_length())
+        for f in found:
+            renderer.found(f)
+        renderer.flush()
         sys.exit(0)
 
 
@@ -527,205 +660,160 @@ def nota():
         sys.exit(0)
 
     # By a process of elimination, we must be trying to find notes.
-    due_requested = nota.interpret_time(args.due)
+    due_between = None
+    if args.due:
+        due_between = nota.due_window(args.due)
+        if due_between[0] is None:
+            nota.error("cannot understand --due '%s'; try e.g. 'today', 'tomorrow', '3 hours', '2 days' or '1 week'" % args.due)
     if id_desired is not None:
         if id_desired[0:1] == '-': # don't get confused by arg flags
             id_desired = None
+    # Listings of several notes show only these fields, so the contents of notes
+    # are looked up only if a single note is to be shown in full.
+    summary_fields = ["title", "keywords", "due", "date", "hash", "book"]
     trash_count = None
+    query = None # arguments for Nota.find_notes() and Nota.count(), unless 'found' lists the notes
     if id_desired is not None:
-        nota.fyi("search notes by hash (book=%s)" % book)
-        found = nota.find_by_hash(hash=id_desired, book=book) # -1 means all books but trash
-        trash_count = len(nota.find_by_hash(hash=id_desired, book=0))
+        nota.fyi("search notes by hash (book=%s)", book) # -1 means all books but trash
+        query = {"hash": id_desired}
     elif len(args.keywords[0]) and args.keywords[0] != '?':
-        nota.fyi("search notes by keyword (book=%s)" % book)
-        found = nota.find_by_keyword(keywords=args.keywords, book=book)
-        trash_count = len(nota.find_by_keyword(keywords=args.keywords, book=0))
+        nota.fyi("search notes by keyword (book=%s)", book)
+        query = {"keywords": args.keywords}
     elif args.recent_notes:
         if args.recent_notes == -2:
-            found = nota.find_recent(nrecent=4)
+            found = nota.find_recent(nrecent=4, fields=summary_fields, due_between=due_between)
         elif args.recent_notes == -1:
-            found = nota.find_by_hash(hash=args.hash, book=book)
-            trash_count = len(nota.find_by_hash(hash=args.hash, book=0))
+            query = {"hash": args.hash}
         else:
-            found = nota.find_recent(nrecent=args.recent_notes)
+            found = nota.find_recent(nrecent=args.recent_notes, fields=summary_fields, due_between=due_between)
         trash_count = 0
     else:
-        nota.fyi("Search notes by hashless method (book=%s)" % book)
-        found = nota.find_by_hash(hash=args.hash, book=book)
-        trash_count = len(nota.find_by_hash(hash=args.hash, book=0))
-    count = 0
-    nfound = len(found)
-    i = -1
+        nota.fyi("Search notes by hashless method (book=%s)", book)
+        query = {"hash": args.hash}
+    if query is not None:
+        query.update(book=book, due_between=due_between)
+        (active_count, trash_count_query) = nota.count(**query)
+        if trash_count is None:
+            trash_count = trash_count_query
+    if args.count:
+        print(active_count if query is not None else len(found))
+        sys.exit(0)
+    extractions = [] # (attachmentId, filename) tuples, for --extract
     # Single hashes are printed to 7 chars (like on github), but multiple ones are shortened.
     hal = nota.hash_abbreviation_length()
-    hash = []
-    if nfound < 1:
-        print("No active notes match this request.")
-    nota.fyi("hash: %s" % hash)
     books = nota.list_books()
-    books_used = []
-    have_default = False
-    for f in found:
-        if f['book'] > 0 and f['book'] != 1 and f['book'] not in books_used:
-            books_used.append(f['book'])
-        if f['book'] == 1:
-            have_default = True
-    books_used = sorted(books_used, key=lambda s: books[s].lower())
+    if query is None:
+        books_used = set(f['book'] for f in found)
+    else:
+        books_used = nota.books_of(**query)
+    have_default = 1 in books_used
+    books_used = sorted([b for b in books_used if b > 0 and b != 1], key=lambda s: books[s].lower())
     if have_default:
         books_used.insert(0, 1)
-    for b in books_used:
-        if not args.count and not args.due:
-            if not args.pipe:
-                if args.markdown:
-                    print("Book: %s" % nota.book_name(b), end="\n\n")
-                else:
-                    print(color.book + "Book: %s" % nota.book_name(b) + color.normal, end="\n")
-        for f in found:
-            i = i + 1
-            #print(f)
-            try:
-                due = f['due']
-            except:
-                due = None
-            if due_requested[0]:
-                if not due:
-                    continue
-                if args.debug:
-                    print("due_requested: %s" % due_requested[0])
-                due = datetime.datetime.strptime(due, '%Y-%m-%d %H:%M:%S.%f')
-                if args.debug:
-                    print("due value stored in note:", due)
-                if due > due_requested[0]:
-                    when = (due - due_requested[0]).total_seconds()
+
+    def listing(start=None, fields=summary_fields):
+        '''
+        Yield the notes to be listed, grouped by book, starting after the note
+        given by 'start', a (book, noteId) tuple. The notes are looked up a
+        batch at a time, so output can begin before they have all been found.
+        '''
+        for b in books_used:
+            if start is not None and books_used.index(b) < books_used.index(start[0]):
+                continue
+            after = start[1] if start is not None and b == start[0] else None
+            if query is None:
+                notes = [f for f in found if f['book'] == b]
+                if after is not None:
+                    notes = notes[[f['noteId'] for f in notes].index(after) + 1:]
+            else:
+                notes = nota.iter_found(after=after, fields=fields, **dict(query, book=b))
+            for f in notes:
+                yield f
+
+    start = None
+    if args.after:
+        after = nota.find_by_hash(hash=args.after, book=book, fields=["book"])
+        if len(after) != 1:
+            nota.error("--after needs the hash of a single note, but '%s' matches %d notes" % (args.after, len(after)))
+        if after[0]['book'] not in books_used:
+            books_used.append(after[0]['book']) # so the notes after it are found
+        start = (after[0]['book'], after[0]['noteId'])
+    if args.page > 1:
+        if not args.limit:
+            nota.error("--page requires --limit")
+        # Skip the earlier pages, looking up just enough to find where this page starts.
+        skipped = 0
+        for f in itertools.islice(listing(start, fields=["book"]), (args.page - 1) * args.limit):
+            skipped += 1
+            start = (f['book'], f['noteId'])
+        if skipped < (args.page - 1) * args.limit:
+            books_used = []
+    notes = listing(start)
+    if args.limit:
+        notes = itertools.islice(notes, args.limit)
+    # See whether there are several notes (to be summarized) or just one (to be shown in full).
+    first = list(itertools.islice(notes, 2))
+    several = len(first) > 1
+    if len(first) == 1:
+        first = nota.find_by_id(first[0]["noteId"])
+    notes = itertools.chain(first, notes)
+    if not first:
+        print("No active notes match this request.")
+    def with_ages(notes, batch=1000):
+        '''Yield the notes, each with its 'age', found for a batch of notes at a time.'''
+        now = datetime.datetime.now()
+        cache = {}
+        while True:
+            chunk = list(itertools.islice(notes, batch))
+            if not chunk:
+                return
+            for (f, age) in zip(chunk, nota.ages([f['date'] for f in chunk], now, cache)):
+                f['age'] = age
+                yield f
+
+    if not args.markdown:
+        notes = with_ages(notes)
+    renderer = make_renderer(hal)
+    nfound = 0
+    current_book = None
+    for f in notes:
+        nfound += 1
+        if f['book'] != current_book:
+            current_book = f['book']
+            if not args.due and not args.pipe:
+                renderer.book(nota.book_name(current_book))
+        if several:
+            # Several notes, so just summarize.
+            renderer.summary(f)
+            if args.extract_attachments and not args.markdown:
+                for attachmentId in nota.get_attachment_list(noteId=f['noteId']):
+                    filename = nota.get_attachment_filename(attachmentId=attachmentId[0])[0]
+                    extractions.append((attachmentId[0], str(f['hash'][0:7]) + "_" + os.path.basename(str(filename[0]))))
+        else:
+            # Just 1 note, so print in full
+            renderer.full(f, heading=args.markdown or not args.pipe)
+            attachmentIds = nota.get_attachment_list(noteId=f['noteId'])
+            if len(attachmentIds) > 0:
+                if args.extract_attachments:
+                    renderer.write("  Attachments: \n")
                 else:
-                    when = (due_requested[0]- due).total_seconds()
-                if args.debug:
-                    print('when:', when)
-                if when < 0:
-                    continue
-            count += 1 # FIXME: bug: 'nota --count' gives a huge number
-            if not args.count:
-                if nfound > 1:
-                    # Several notes, so just summarize.
-                    if args.markdown:
-                        print("%s" % f['hash'][0:hal], end="\n")
-                        if show_id:
-                            print("(%s) " % f['noteId'], end="")
-                        print("%s\n\n" % f['title'], end="")
-                        print("[", end="")
-                        nk = len(f['keywords'])
-                        for i in range(nk):
-                            print("*%s*" % f['keywords'][i], end="")
-                            if (i < nk-1):
-                                print(", ", end="")
-                        print("]", end="\n\n")
-                    else:
-                        if f['book'] == b:
-                            #print("{%s}" % f['book']) # a number
-                            print(indent + color.hash + "%s " % f['hash'][0:hal] + color.normal, end="")
-                            if show_id:
-                                print("(%s) " % f['noteId'], end="")
-                            print(color.title + "%s" % f['title'] + color.normal + " ", end="")
-                            #print("(" + color.hash + books[f['book']] + color.normal + ") ", end="")
-                            print("[", end="")
-                            nk = len(f['keywords'])
-                            for i in range(nk):
-                                print(color.keyword + f['keywords'][i] + color.normal, end="")
-                                if (i < nk-1):
-                                    print(", ", end="")
-                            print("]", end="")
-                            print(" %s " % nota.age(f['date']), end="\n")
+                    renderer.write("  Attachments (use --extract argument to extract these): \n")
+            for attachmentId in attachmentIds:
+                filename = nota.get_attachment_filename(attachmentId=attachmentId[0])[0]
+                if args.extract_attachments:
+                    tmpname = str(f['hash'][0:7]) + "_" + os.path.basename(str(filename[0]))
+                    extractions.append((attachmentId[0], tmpname))
+                    renderer.write("   '%s'\n        saved as '%s' in %s\n" % (str(filename[0]), tmpname,
+                        "directory '%s'" % args.extract_dir if args.extract_dir else "present directory"))
                 else:
-                    # Just 1 note, so print in full
-                    if args.markdown:
-                        print("Hash: `%s`\n\n" % f['hash'][0:7], end="")
-                        if show_id:
-                            print("(%s) " % f['noteId'], end="")
-                        print("%s\n\n" % f['title'], end="")
-                        print("Keywords: ", end="")
-                        nk = len(f['keywords'])
-                        for i in range(nk):
-                            print(f['keywords'][i], end="")
-                            if (i < nk-1):
-                                print(", ", end="")
-                        print("", end="\n\n")
-                        print("Created: %s" % f['date'], end=" ")
-                        if f['due'] and len(f['due']) > 0:
-                            print(due_str(f['due']))
-                        else:
-                            print('')
-                        print('')
-                        content = f['content'].replace('\\n', '\n')
-                        for contentLine in content.split('\n'):
-                            print(contentLine.rstrip('\n'))
-                            #if len(c):
-                            #    if args.markdown:
-                            #        print(contentLine.rstrip('\n'), '\n')
-                            #    else:
-                            #        print(" ", contentLine.rstrip('\n'), '\n')
-                        print('')
-                    else:
-                        if not args.pipe:
-                            print(indent + color.hash + "%s " % f['hash'][0:7] + color.normal, end="")
-                            if show_id:
-                                print("(%s) " % f['noteId'], end="")
-                            print(color.title + "%s" % f['title'] + color.normal + " ", end="")
-                            print("[", end="")
-                            nk = len(f['keywords'])
-                            for i in range(nk):
-                                print(color.keyword + f['keywords'][i] + color.normal, end="")
-                                if (i < nk-1):
-                                    print(", ", end="")
-                            print("]", end="")
-                            #print(" %s" % f['date'], end=" ")
-                            print(" %s " % nota.age(f['date']), end="")
-                            try:
-                                if f['due'] and len(f['due']) > 0:
-                                    print(due_str(f['due']))
-                                else:
-                                    print('')
-                            except:
-                                print('')
-                        content = f['content'].replace('\\n', '\n')
-                        for contentLine in content.split('\n'):
-                            c = contentLine.rstrip('\n')
-                            print(" ", contentLine.rstrip('\n'))
-                            #> if len(c):
-                            #>     if args.markdown:
-                            #>         print(contentLine.rstrip('\n'))
-                            #>     else:
-                            #>         print(" ", contentLine.rstrip('\n'))
-                        #print('')
-                    #print("id=%d"%f['noteId'])
-                    #print("attachmentIds:")
-                    attachmentIds = nota.get_attachment_list(noteId=f['noteId'])
-                    if len(attachmentIds) > 0:
-                        if args.extract_attachments:
-                            print("  Attachments: ")
-                        else:
-                            print("  Attachments (use --extract argument to extract these): ")
-                    for attachmentId in attachmentIds:
-                        #print(attachmentId[0])
-                        filename = nota.get_attachment_filename(attachmentId=attachmentId[0])[0]
-                        #print("attachmentId %d" % attachmentId[0])
-                        #echo "SELECT contents FROM attachment WHERE attachmentId=3;" | sqlite3 ~/Dropbox/nota.db
-                        if args.extract_attachments:
-                            #tmp = tempfile.NamedTemporaryFile(mode="wb", prefix="nota_", suffix="_"+str(filename[0]))
-                            contents = nota.get_attachment_contents(attachmentId=attachmentId[0])
-                            tmpname = str(f['hash'][0:7]) + "_" + os.path.basename(str(filename[0]))
-                            try:
-                                tmpfile = open(tmpname, "wb")
-                                tmpfile.write(str(contents[0]))
-                                tmpfile.close()
-                            except:
-                                print("cannot store attachment in local directory")
-                            print("   '%s'\n        saved as '%s' in present directory" % (str(filename[0]), tmpname))
-                        else:
-                            print("   %s" % filename)
-    if args.count:
-        print(count)
-    if not args.count and args.verbose > 0 and not args.markdown:
-        t = nota.trash_length()[0] # FIXME: should just return the [0]
+                    renderer.write("   %s\n" % filename)
+    renderer.flush()
+    if extractions:
+        nota.extract_attachments(extractions, directory=args.extract_dir or ".", jobs=args.jobs)
+        if several and args.verbose > 0:
+            print("Extracted %d attachments to %s." % (len(extractions),
+                "directory '%s'" % args.extract_dir if args.extract_dir else "the present directory"))
+    if args.verbose > 0 and not args.markdown:
         t = trash_count
         if t == 0:
             if nfound == 0:
@@ -4,21 +4,51 @@ import sys
 import sqlite3 as sqlite
 import datetime
 import os.path
-import difflib
-from distutils.version import StrictVersion
+from .keywordindex import KeywordIndex
 import re
-import tempfile
-import subprocess
-import hashlib
-import random
-import string
+import json
+import time
 from math import trunc
+# Modules needed only by a few methods (hashlib, random, string, tempfile and
+# concurrent.futures) are imported by those methods, so that 'nota' starts
+# quickly for the usual look-ups.
 
 #reload(sys)
 #sys.setdefaultencoding('utf8')
 
+class NotaError(SystemExit):
+    '''
+    The exception raised by Nota.error(). It is a SystemExit, so the 'nota'
+    command exits with its code, but the server can tell it from others,
+    which stop the server (see NotaServer.call()).
+    '''
+
+
 class Nota:
-    def __init__(self, db="nota.db", authorId=1, debug=0, quiet=False):
+    # Connection settings, set with PRAGMA statements when a database is opened;
+    # see apply_profile(). The "default" profile leaves sqlite's own settings
+    # alone. The "synced" profile suits a database in a synced folder, such as
+    # the usual ~/Dropbox/nota.db, by keeping a single database file (a
+    # truncated, not deleted, rollback journal) while syncing less often and
+    # caching more. The "wal" profile is the fastest, but its write-ahead log
+    # is a second file that holds recent changes, so it should only be used for
+    # a database on a local disk that is not synced.
+    profiles = {"default": {},
+            "synced": {"busy_timeout": 5000, "journal_mode": "TRUNCATE", "synchronous": "NORMAL",
+                "cache_size": -16384, "mmap_size": 64 * 1024 * 1024, "temp_store": "MEMORY"},
+            "wal": {"busy_timeout": 5000, "journal_mode": "WAL", "synchronous": "NORMAL",
+                "cache_size": -65536, "mmap_size": 256 * 1024 * 1024, "temp_store": "MEMORY"}}
+    # The keywords of note 'N', as a JSON array in the order they were attached;
+    # used to fill the note.keywords column, which caches this.
+    keyword_cache_sql = ("(SELECT json_group_array(keyword) FROM (SELECT keyword.keyword AS keyword FROM notekeyword " +
+            "JOIN keyword ON keyword.keywordId = notekeyword.keywordid " +
+            "WHERE notekeyword.noteid = %s ORDER BY notekeyword.notekeywordId))")
+    # The items in the dicts describing notes, each named for a column of the
+    # 'note' table. See the 'fields' argument of hydrate_notes().
+    note_fields = ["noteId", "title", "keywords", "content", "due", "privacy", "date", "modified", "hash", "book"]
+    profile_pragmas = ["busy_timeout", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store"]
+
+    def __init__(self, db="nota.db", authorId=1, debug=0, quiet=False, profile="default", stats=None):
         '''
 
         A class used for the storing and searching of textual notes in a
@@ -26,20 +56,25 @@ class Nota:
         convenient way to search for content. File attachments may also be
         made.
 
+        The connection is set up according to 'profile', which is either the
+        name of an entry in Nota.profiles, or a dictionary in the same form.
+        If 'stats' is a SqlStats object (see nota/sqlstats.py), the SQL
+        statements run are counted and timed there; it is kept as 'stats'.
+
         '''
         self.debug = debug
         self.quiet = quiet
         self.db = db
-        self.fyi("Database '%s' (before path expansion)." % self.db)
+        self.fyi("Database '%s' (before path expansion).", self.db)
         self.db = os.path.expanduser(self.db)
-        self.fyi("Database '%s' (after path expansion)." % self.db)
+        self.fyi("Database '%s' (after path expansion).", self.db)
         mustInitialize = not os.path.exists(self.db)
         if mustInitialize:
             print("Creating new database named \"%s\"." % self.db)
         else:
             try:
                 dbsize = os.path.getsize(self.db)
-                self.fyi("Database file size %s bytes." % dbsize)
+                self.fyi("Database file size %s bytes.", dbsize)
                 mustInitialize = not dbsize
             except:
                 pass
@@ -49,15 +84,25 @@ class Nota:
         except:
             self.error("Error opening connection to database named '%s'" % db)
         self.con = con
-        self.cur = con.cursor()
+        self.stats = stats
+        if stats is None:
+            self.cur = con.cursor()
+        else:
+            stats.attach(con)
+            self.cur = stats.cursor(con)
+        self.apply_profile(profile)
         self.authorId = authorId
+        self.keyword_index = None # built when first needed, by get_keyword_index()
+        self.attachment_chunk_size = 1024 * 1024
+        self.extract_buffer_size = 64 * 1024
         ## 0.3: add note.modified column
-        self.appversion = [0, 8, 12] # db schema changes always yield first or second digit increment
+        self.appversion = [0, 15, 0] # db schema changes always yield first or second digit increment
         self.dbversion = self.appversion
         if mustInitialize:
-            print("Initializing database; run 'nota' again to use it.")
+            # A new database gets the 0.8.x schema, and is then brought up to date
+            # by the same steps used for old databases.
+            print("Initializing database.")
             self.initialize()
-            return(None)
         try:
             v = self.cur.execute("SELECT * FROM version;").fetchone()
             self.dbversion = v
@@ -70,11 +115,11 @@ class Nota:
             dbversion = "%s.%s.%s" % (self.dbversion[0], self.dbversion[1], 0)
         else:
             dbversion = "%s.%s.%s" % (self.dbversion[0], self.dbversion[1], self.dbversion[2])
-        self.fyi("appversion: %s" % appversion)
-        self.fyi("dbversion: %s" % dbversion)
-        self.fyi("self.dbversion: %s" % [self.dbversion])
-        if StrictVersion(appversion) > StrictVersion(dbversion):
-            if StrictVersion(dbversion) < StrictVersion("0.2"):
+        self.fyi("appversion: %s", appversion)
+        self.fyi("dbversion: %s", dbversion)
+        self.fyi("self.dbversion: %s", [self.dbversion])
+        if self.version_tuple(appversion) > self.version_tuple(dbversion):
+            if self.version_tuple(dbversion) < self.version_tuple("0.2"):
                 print("Updating database %s to version 0.2.x ..." % db)
                 try:
                     self.cur.execute('ALTER TABLE note ADD due DEFAULT "";')
@@ -82,7 +127,7 @@ class Nota:
                     print("  Added column 'due' to database table 'note'.")
                 except:
                     self.error("  Problem adding a column named 'due' to the table 'note'")
-            if StrictVersion(dbversion) < StrictVersion("0.3"):
+            if self.version_tuple(dbversion) < self.version_tuple("0.3"):
                 print("Updating database %s to version 0.3.x ..." % db)
                 try:
                     self.cur.execute('ALTER TABLE note ADD modified DEFAULT "";')
@@ -91,7 +136,7 @@ class Nota:
                     print("  Added 'modified' column to 'note' table.")
                 except:
                     self.error("  Problem adding a column named 'modified' to the table named 'note'")
-            if StrictVersion(dbversion) < StrictVersion("0.4"):
+            if self.version_tuple(dbversion) < self.version_tuple("0.4"):
                 print("Updating database %s to version 0.4.x ..." % db)
                 try:
                     cmd = 'ALTER TABLE note ADD hash DEFAULT "";'
@@ -113,14 +158,14 @@ class Nota:
                     self.error("Problem computing hashes of existing notes")
                 try:
                     for i in range(len(rows)):
-                        self.fyi("UPDATE note SET hash = \"%s\" WHERE noteId=%s;" % (str(hash[i]), noteIds[i]))
+                        self.fyi("UPDATE note SET hash = \"%s\" WHERE noteId=%s;", str(hash[i]), noteIds[i])
                         self.cur.execute("UPDATE note SET hash = ? WHERE noteId=?;", (str(hash[i]), noteIds[i]))
                     self.con.commit()
                     print("  Added 'hash' column to 'note' table.")
                 except:
                     self.error("Problem adding a column named 'hash' to the table named 'note'")
                     self.error("Problem saving data to the newly-formed 'hash' column in the 'note' table")
-            if StrictVersion(dbversion) < StrictVersion("0.5"):
+            if self.version_tuple(dbversion) < self.version_tuple("0.5"):
                 # Add 'in_trash' column (removed in version 0.7.x)
                 print("Updating database %s to version 0.5.x ..." % db)
                 try:
@@ -130,18 +175,15 @@ class Nota:
                     print("  Added 'in_trash' column to 'note' table.")
                 except:
                     self.error("Problem adding a column named 'in_trash' to the table named 'note'")
-            if StrictVersion(dbversion) < StrictVersion("0.6"):
+            if self.version_tuple(dbversion) < self.version_tuple("0.6"):
                 print("Updating database %s to version 0.6.x ..." % db)
                 try:
-                    self.cur.execute("DROP TABLE version;")
-                    self.cur.execute("CREATE TABLE version(major, middle, minor);")
-                    self.cur.execute("INSERT INTO version(major, middle, minor) VALUES (?,?,?);",
-                            (self.appversion[0], self.appversion[1], self.appversion[2]))
+                    self.set_version([0, 6, 0])
                     self.con.commit()
                     print("  Added 'middle' column to 'version' table.")
                 except:
                     self.error("Problem adding a 'middle' column to the 'version' table.")
-            if StrictVersion(dbversion) < StrictVersion("0.7"):
+            if self.version_tuple(dbversion) < self.version_tuple("0.7"):
                 # Books were added in 0.7.0, so the in_book column of the note table must be
                 # removed and a new column, 'book', added. This requires copying the whole
                 # 'note' table, because sqlite3 doesn't permit such modifications (!).
@@ -190,7 +232,7 @@ class Nota:
                 #print("oldIds: %s" % oldIds)
                 #print("noteIds: %s" % noteIds)
                 for i in range(len(noteIds)):
-                    self.fyi("UPDATE notekeyword SET noteid=%s WHERE noteid=%s;" % (oldIds[i][0], noteIds[i][0]))
+                    self.fyi("UPDATE notekeyword SET noteid=%s WHERE noteid=%s;", oldIds[i][0], noteIds[i][0])
                     try:
                         self.cur.execute("UPDATE notekeyword SET noteid=? WHERE noteid=?;", (noteIds[i][0], oldIds[i][0]))
                     except:
@@ -204,7 +246,7 @@ class Nota:
                 self.cur.execute("INSERT INTO book(number, name) VALUES (1, 'Default');")
                 print("  Created books named Trash and Default.")
 
-            if StrictVersion(dbversion) < StrictVersion("0.8"):
+            if self.version_tuple(dbversion) < self.version_tuple("0.8"):
                 # Attachments were added in 0.8.0, so we need a table to cross-reference
                 # each attachment to a storage location, plus a table linking notes and
                 # attachments.
@@ -218,24 +260,259 @@ class Nota:
                     self.cur.execute("CREATE TABLE note_attachment (note_attachmentId integer primary key autoincrement, noteId, attachmentId);")
                 except:
                     self.error("Problem with step 2 of update to version 0.8.x (adding note-attachment table)")
+            if self.version_tuple(dbversion) < self.version_tuple("0.9"):
+                # An index on the hash lets abbreviated-hash lookups use a range
+                # query, instead of scanning every note.
+                print("Updating database %s to version 0.9.x ..." % db)
+                try:
+                    self.cur.execute("CREATE INDEX IF NOT EXISTS note_hash ON note(hash);")
+                    self.set_version([0, 9, 0])
+                    self.con.commit()
+                    print("  Added index on 'hash' column of 'note' table.")
+                except:
+                    self.error("Problem with update to version 0.9.x (indexing the 'hash' column of the 'note' table)")
+            if self.version_tuple(dbversion) < self.version_tuple("0.10"):
+                # A table of named values, for quantities that are expensive to
+                # compute on every call, e.g. the hash abbreviation length.
+                print("Updating database %s to version 0.10.x ..." % db)
+                try:
+                    self.cur.execute("CREATE TABLE IF NOT EXISTS metadata(name PRIMARY KEY, value);")
+                    self.set_version([0, 10, 0])
+                    self.con.commit()
+                    print("  Added 'metadata' table.")
+                except:
+                    self.error("Problem with update to version 0.10.x (adding 'metadata' table)")
+            if self.version_tuple(dbversion) < self.version_tuple("0.11"):
+                # A full-text index of titles and contents, for search(). It refers to
+                # the note table for the text itself, and triggers keep it up to date.
+                # The index may be left from an update that failed at a later step,
+                # so it is only created if missing, and then rebuilt.
+                print("Updating database %s to version 0.11.x ..." % db)
+                if not self.has_fts5():
+                    self.warning("this version of SQLite lacks FTS5, so full-text search will be unavailable")
+                    self.set_version([0, 11, 0])
+                    self.con.commit()
+                else:
+                    try:
+                        self.cur.execute("BEGIN;")
+                        self.cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(title, content, content='note', content_rowid='noteId');")
+                        self.cur.execute("CREATE TRIGGER IF NOT EXISTS note_fts_insert AFTER INSERT ON note BEGIN " +
+                                "INSERT INTO note_fts(rowid, title, content) VALUES (new.noteId, new.title, new.content); END;")
+                        self.cur.execute("CREATE TRIGGER IF NOT EXISTS note_fts_delete AFTER DELETE ON note BEGIN " +
+                                "INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.noteId, old.title, old.content); END;")
+                        self.cur.execute("CREATE TRIGGER IF NOT EXISTS note_fts_update AFTER UPDATE OF title, content ON note BEGIN " +
+                                "INSERT INTO note_fts(note_fts, rowid, title, content) VALUES ('delete', old.noteId, old.title, old.content); " +
+                                "INSERT INTO note_fts(rowid, title, content) VALUES (new.noteId, new.title, new.content); END;")
+                        self.cur.execute("INSERT INTO note_fts(note_fts) VALUES ('rebuild');")
+                        self.set_version([0, 11, 0])
+                        self.con.commit()
+                        print("  Added full-text index 'note_fts' for 'note' table.")
+                    except:
+                        self.update_error("Problem with update to version 0.11.x (setting up full-text index)")
+            if self.version_tuple(dbversion) < self.version_tuple("0.12"):
+                # Foreign keys let deletions of notes cascade to the tables that link
+                # notes to keywords and attachments. Since sqlite3 cannot add foreign
+                # keys to existing tables, those tables are copied into new ones
+                # (dropping any links to notes, keywords or attachments that no longer
+                # exist). Then indexes are added for the columns used in searches.
+                # Databases made by versions that did not create the attachment
+                # tables get empty ones first. All this is one transaction, so a
+                # failure leaves the database as it was.
+                print("Updating database %s to version 0.12.x ..." % db)
+                try:
+                    self.cur.execute("BEGIN;")
+                    self.cur.execute("CREATE TABLE IF NOT EXISTS attachment (attachmentId integer primary key autoincrement, filename, contents BLOB);")
+                    self.cur.execute("CREATE TABLE IF NOT EXISTS note_attachment (note_attachmentId integer primary key autoincrement, noteId, attachmentId);")
+                    self.cur.execute("DROP TABLE IF EXISTS notekeyword_new;") # left by a failed update
+                    self.cur.execute("DROP TABLE IF EXISTS note_attachment_new;")
+                except:
+                    self.update_error("Problem with step 1 of update to version 0.12.x (preparing tables)")
+                try:
+                    self.cur.execute("CREATE TABLE notekeyword_new(notekeywordId integer primary key autoincrement, " +
+                            "noteid INTEGER REFERENCES note(noteId) ON DELETE CASCADE, keywordid INTEGER REFERENCES keyword(keywordId) ON DELETE CASCADE);")
+                    self.cur.execute("INSERT INTO notekeyword_new(notekeywordId, noteid, keywordid) " +
+                            "SELECT notekeywordId, noteid, keywordid FROM notekeyword " +
+                            "WHERE noteid IN (SELECT noteId FROM note) AND keywordid IN (SELECT keywordId FROM keyword);")
+                    self.cur.execute("DROP TABLE notekeyword;")
+                    self.cur.execute("ALTER TABLE notekeyword_new RENAME TO notekeyword;")
+                except:
+                    self.update_error("Problem with step 2 of update to version 0.12.x (adding foreign keys to 'notekeyword' table)")
+                try:
+                    self.cur.execute("CREATE TABLE note_attachment_new(note_attachmentId integer primary key autoincrement, " +
+                            "noteId INTEGER REFERENCES note(noteId) ON DELETE CASCADE, attachmentId INTEGER REFERENCES attachment(attachmentId) ON DELETE CASCADE);")
+                    self.cur.execute("INSERT INTO note_attachment_new(note_attachmentId, noteId, attachmentId) " +
+                            "SELECT note_attachmentId, noteId, attachmentId FROM note_attachment " +
+                            "WHERE noteId IN (SELECT noteId FROM note) AND attachmentId IN (SELECT attachmentId FROM attachment);")
+                    self.cur.execute("DROP TABLE note_attachment;")
+                    self.cur.execute("ALTER TABLE note_attachment_new RENAME TO note_attachment;")
+                except:
+                    self.update_error("Problem with step 3 of update to version 0.12.x (adding foreign keys to 'note_attachment' table)")
+                try:
+                    self.cur.execute("CREATE INDEX IF NOT EXISTS notekeyword_noteid ON notekeyword(noteid);")
+                    self.cur.execute("CREATE INDEX IF NOT EXISTS notekeyword_keywordid ON notekeyword(keywordid);")
+                    self.cur.execute("CREATE INDEX IF NOT EXISTS keyword_keyword ON keyword(keyword);")
+                    self.cur.execute("CREATE INDEX IF NOT EXISTS note_attachment_noteId ON note_attachment(noteId);")
+                    self.cur.execute("CREATE INDEX IF NOT EXISTS note_book ON note(book);")
+                    self.cur.execute("CREATE INDEX IF NOT EXISTS note_date ON note(date);")
+                    self.set_version([0, 12, 0])
+                    self.con.commit()
+                    print("  Added foreign keys to 'notekeyword' and 'note_attachment' tables, and indexes to several tables.")
+                except:
+                    self.update_error("Problem with step 4 of update to version 0.12.x (adding indexes)")
+            if self.version_tuple(dbversion) < self.version_tuple("0.13"):
+                # Attachment contents are moved to a store keyed by SHA-256 digest, so
+                # that identical files are stored once. The contents are held in
+                # pieces of limited size, and each has a count of the attachments
+                # that refer to it, maintained by triggers. As in the 0.12.x step,
+                # the 'attachment' table is created if missing, and the whole step
+                # is one transaction.
+                print("Updating database %s to version 0.13.x ..." % db)
+                try:
+                    self.cur.execute("BEGIN;")
+                    self.cur.execute("CREATE TABLE IF NOT EXISTS attachment (attachmentId integer primary key autoincrement, filename, contents BLOB);")
+                    self.cur.execute("CREATE TABLE attachment_blob(sha256 PRIMARY KEY, size INTEGER, refcount INTEGER DEFAULT 0);")
+                    self.cur.execute("CREATE TABLE attachment_chunk(chunkId integer primary key autoincrement, sha256, seq INTEGER, data BLOB, UNIQUE(sha256, seq));")
+                    self.cur.execute("ALTER TABLE attachment ADD sha256;")
+                    self.cur.execute("CREATE INDEX attachment_sha256 ON attachment(sha256);")
+                    self.cur.execute("CREATE TRIGGER attachment_blob_acquire AFTER INSERT ON attachment WHEN new.sha256 IS NOT NULL BEGIN " +
+                            "UPDATE attachment_blob SET refcount = refcount + 1 WHERE sha256 = new.sha256; END;")
+                    self.cur.execute("CREATE TRIGGER attachment_blob_release AFTER DELETE ON attachment WHEN old.sha256 IS NOT NULL BEGIN " +
+                            "UPDATE attachment_blob SET refcount = refcount - 1 WHERE sha256 = old.sha256; END;")
+                except:
+                    self.update_error("Problem with step 1 of update to version 0.13.x (creating attachment store)")
+                try:
+                    attachmentIds = self.cur.execute("SELECT attachmentId FROM attachment WHERE contents IS NOT NULL;").fetchall()
+                    for (attachmentId,) in attachmentIds:
+                        contents = self.cur.execute("SELECT contents FROM attachment WHERE attachmentId=?;", [attachmentId]).fetchone()[0]
+                        if isinstance(contents, str):
+                            contents = contents.encode("utf-8")
+                        sha256 = self.store_blob(contents=bytes(contents))
+                        self.cur.execute("UPDATE attachment SET sha256=?, contents=NULL WHERE attachmentId=?;", [sha256, attachmentId])
+                        self.cur.execute("UPDATE attachment_blob SET refcount = refcount + 1 WHERE sha256=?;", [sha256])
+                    self.set_version([0, 13, 0])
+                    self.con.commit()
+                    print("  Moved %d attachments to the attachment store." % len(attachmentIds))
+                except:
+                    self.update_error("Problem with step 2 of update to version 0.13.x (moving attachments to attachment store)")
+            if self.version_tuple(dbversion) < self.version_tuple("0.14"):
+                # Each note caches its keywords, as a JSON array in note.keywords,
+                # so that listings need not join the keyword tables. Triggers on
+                # those tables keep the cache up to date, whatever the change.
+                print("Updating database %s to version 0.14.x ..." % db)
+                try:
+                    self.cur.execute("BEGIN;")
+                    self.cur.execute("ALTER TABLE note ADD keywords DEFAULT '[]';")
+                    self.cur.execute("CREATE TRIGGER note_keywords_link AFTER INSERT ON notekeyword BEGIN " +
+                            "UPDATE note SET keywords = json_insert(keywords, '$[#]', " +
+                            "(SELECT keyword FROM keyword WHERE keywordId = new.keywordid)) WHERE noteId = new.noteid; END;")
+                    self.cur.execute("CREATE TRIGGER note_keywords_unlink AFTER DELETE ON notekeyword BEGIN " +
+                            "UPDATE note SET keywords = " + self.keyword_cache_sql % "old.noteid" + " WHERE noteId = old.noteid; END;")
+                    self.cur.execute("CREATE TRIGGER note_keywords_rename AFTER UPDATE OF keyword ON keyword BEGIN " +
+                            "UPDATE note SET keywords = " + self.keyword_cache_sql % "note.noteId" +
+                            " WHERE noteId IN (SELECT noteid FROM notekeyword WHERE keywordid = new.keywordId); END;")
+                    self.cur.execute("UPDATE note SET keywords = " + self.keyword_cache_sql % "note.noteId" + ";")
+                    self.set_version([0, 14, 0])
+                    self.con.commit()
+                    print("  Added 'keywords' column to 'note' table.")
+                except:
+                    self.update_error("Problem with update to version 0.14.x (adding keywords column)")
+            if self.version_tuple(dbversion) < self.version_tuple("0.15"):
+                # Due times are also held as seconds since the epoch, in an indexed
+                # column, so that notes due within a given time are found by SQL.
+                # Triggers fill the column from the 'due' text, a local time. Few
+                # notes have due times, so the index leaves out those without.
+                print("Updating database %s to version 0.15.x ..." % db)
+                due_epoch = "CAST(strftime('%s', new.due, 'utc') AS INTEGER)"
+                try:
+                    self.cur.execute("BEGIN;")
+                    self.cur.execute("ALTER TABLE note ADD due_epoch INTEGER;")
+                    self.cur.execute("UPDATE note SET due_epoch = " + due_epoch.replace("new.", "") + " WHERE due IS NOT NULL AND due != '';")
+                    self.cur.execute("CREATE INDEX note_due_epoch ON note(due_epoch) WHERE due_epoch IS NOT NULL;")
+                    self.cur.execute("CREATE TRIGGER note_due_insert AFTER INSERT ON note WHEN new.due IS NOT NULL AND new.due != '' BEGIN " +
+                            "UPDATE note SET due_epoch = " + due_epoch + " WHERE noteId = new.noteId; END;")
+                    self.cur.execute("CREATE TRIGGER note_due_update AFTER UPDATE OF due ON note BEGIN " +
+                            "UPDATE note SET due_epoch = " + due_epoch + " WHERE noteId = new.noteId; END;")
+                    # Without statistics, SQLite prefers the index on 'book' to the
+                    # one on 'due_epoch', although the latter selects far fewer notes.
+                    self.cur.execute("ANALYZE;")
+                    self.set_version([0, 15, 0])
+                    self.con.commit()
+                    print("  Added 'due_epoch' column to 'note' table.")
+                except:
+                    self.update_error("Problem with update to version 0.15.x (adding due_epoch column)")
             # OK, done with the updates, so we now update the actual version number.
             try:
-                self.cur.execute("DROP TABLE version;")
-                self.cur.execute("CREATE TABLE version(major, middle, minor);")
-                self.cur.execute("INSERT INTO version(major, middle, minor) VALUES (?,?,?);",
-                        (self.appversion[0], self.appversion[1], self.appversion[2]))
+                self.set_version(self.appversion)
                 self.con.commit()
             except:
                 self.error("  Problem updating database version to %d.%d.%d" %
                         (self.appversion[0], self.appversion[1], self.appversion[2]))
             print("Database %s is now up-to-date with this version of 'nota'." % db)
         else:
-            self.fyi("Database %s version is up-to-date." % db)
+            self.fyi("Database %s version is up-to-date.", db)
+        # Turned on only now, since the updates above must be free to copy tables.
+        self.cur.execute("PRAGMA foreign_keys = ON;")
+
+
+    def apply_profile(self, profile):
+        '''
+        Apply the connection settings in 'profile' (see Nota.profiles), which
+        is either a profile name or a dictionary mapping pragma names to
+        values. Only the pragmas in Nota.profile_pragmas may be set.
+        '''
+        if isinstance(profile, str):
+            if profile not in self.profiles:
+                self.error("unknown profile '%s'; try one of: %s" % (profile, ", ".join(sorted(self.profiles))))
+            settings = self.profiles[profile]
+        else:
+            settings = profile
+        for name in settings:
+            if name not in self.profile_pragmas:
+                self.error("cannot set '%s' in a profile; try one of: %s" % (name, ", ".join(self.profile_pragmas)))
+            if not re.match(r'^-?\w+$', str(settings[name])):
+                self.error("invalid value '%s' for '%s' in a profile" % (settings[name], name))
+        self.profile = profile
+        for name in self.profile_pragmas: # in this order, so busy_timeout is set first
+            if name in settings:
+                try:
+                    result = self.cur.execute("PRAGMA %s = %s;" % (name, settings[name])).fetchone()
+                except:
+                    self.error("cannot set '%s' to '%s'" % (name, settings[name]))
+                self.fyi("PRAGMA %s = %s yielded %s", name, settings[name], result)
+        if "journal_mode" in settings:
+            mode = self.cur.execute("PRAGMA journal_mode;").fetchone()[0]
+            if mode.lower() != str(settings["journal_mode"]).lower():
+                self.warning("journal mode is '%s', not '%s' as requested" % (mode, settings["journal_mode"]))
 
 
-    def fyi(self, msg, prefix="  "):
+    def fyi(self, msg, *args, prefix="  "):
+        '''
+        Report a debugging message, msg % args, through the "nota" logger.
+        Pass the arguments, not a formatted message, since they are only
+        formatted if debugging is on, and so cost nothing otherwise.
+        '''
         if self.debug:
-            print(prefix + msg, file=sys.stderr)
+            import logging
+            log = self.logger()
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(prefix + msg, *args)
+
+
+    def logger(self):
+        '''
+        Return the "nota" logger, set up to print debugging messages to
+        stderr unless it has been set up already. The logging module is only
+        imported if debugging is on, since it slows the start of 'nota'.
+        '''
+        import logging
+        log = logging.getLogger("nota")
+        if not log.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log.addHandler(handler)
+            log.setLevel(logging.DEBUG)
+            log.propagate = False
+        return log
 
 
     def warning(self, msg, prefix="Warning: "):
@@ -246,18 +523,55 @@ class Nota:
     def error(self, msg, level=1, prefix="Error: "):
         if not self.quiet:
             print(prefix + msg, file=sys.stderr)
-        sys.exit(level)
+        raise NotaError(level)
 
 
     def version(self):
         return("nota version %d.%d.%d" % (self.appversion[0], self.appversion[1], self.appversion[2]))
 
 
+    def set_version(self, version):
+        '''
+        Record 'version', a list such as [0, 12, 0], as the version of the
+        database, without committing. Each step of an update records the
+        version it reaches, in the same transaction as its changes where it
+        can, so that an update that fails part way resumes from that step.
+        '''
+        self.cur.execute("DROP TABLE IF EXISTS version;")
+        self.cur.execute("CREATE TABLE version(major, middle, minor);")
+        self.cur.execute("INSERT INTO version(major, middle, minor) VALUES (?,?,?);", list(version))
+
+
+    def update_error(self, msg):
+        '''Undo the changes made by the database update in progress, and report 'msg' as an error.'''
+        self.con.rollback()
+        self.error(msg)
+
+
+    def has_fts5(self):
+        '''Return whether this version of SQLite has the FTS5 full-text search extension.'''
+        try:
+            self.cur.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x);")
+        except sqlite.OperationalError:
+            return False
+        self.cur.execute("DROP TABLE temp.fts5_probe;")
+        return True
+
+
+    def version_tuple(self, version):
+        '''Turn a version string such as "0.2" or "0.12.1" into a tuple such as (0, 2, 0), for comparison.'''
+        v = tuple(int(part) for part in version.split("."))
+        return v + (0,) * (3 - len(v))
+
+
     def compute_hash(self, noteId, date, title):
         '''
         Compute a hash. This is somewhat resistant to errors, e.g. if somehow the date is None,
         this will still work.
         '''
+        import hashlib
+        import random
+        import string
         if not noteId:
             noteId = ''.join(random.choice(string.digits) for _ in range(4))
         if not date:
@@ -268,6 +582,16 @@ class Nota:
         return(hashlib.sha256((str(title) + str(noteId) + str(date)).encode('utf8')).hexdigest())
 
 
+    def hash_range(self, hash):
+        '''
+        Return an SQL condition, and its parameters, that selects notes whose
+        hash starts with the given abbreviation. This is a range test, so that
+        the index on the 'hash' column can be used.
+        '''
+        upper = hash[:-1] + chr(ord(hash[-1]) + 1)
+        return("note.hash >= ? AND note.hash < ?", [hash, upper])
+
+
     def book_name(self, number):
         '''Return name of book with given index.'''
         try:
@@ -315,7 +639,7 @@ class Nota:
             self.cur.execute("INSERT INTO book (number, name) VALUES(?, ?);", (nexisting, name))
             self.con.commit()
         except:
-            self.fyi("Error adding a book named '%s'" % name)
+            self.fyi("Error adding a book named '%s'", name)
 
 
     def book_index(self, book):
@@ -341,7 +665,7 @@ class Nota:
         if len(note) == 0:
             self.error("The hash '%s' does not match any notes" % hash)
         noteId = int(note[0]['noteId'])
-        self.fyi("UPDATE note SET book=%s WHERE noteId=%s;" % (book_number, noteId))
+        self.fyi("UPDATE note SET book=%s WHERE noteId=%s;", book_number, noteId)
         try:
             self.cur.execute("UPDATE note SET book=? WHERE noteId=?;", [book_number, noteId])
             self.con.commit()
@@ -360,7 +684,7 @@ class Nota:
                 self.cur.execute("UPDATE book SET name=(?) WHERE name=(?);", (new, old))
                 self.con.commit()
             except:
-                self.fyi("Error changing book name from '%s' to '%s'" % (old, new))
+                self.fyi("Error changing book name from '%s' to '%s'", old, new)
         else:
             self.error("There is no book named '%s'." % old)
 
@@ -368,10 +692,10 @@ class Nota:
 
     def initialize(self, author=""):
         ''' Initialize the database.  This is dangerous since it removes any
-        existing content.'''
-        self.cur.execute("CREATE TABLE version(major, minor);")
-        self.cur.execute("INSERT INTO version(major, minor) VALUES (?,?);",
-                (self.appversion[0], self.appversion[1]))
+        existing content. The tables are those of version 0.8.12; later changes
+        are made by the updating code in __init__().'''
+        self.cur.execute("CREATE TABLE version(major, middle, minor);")
+        self.cur.execute("INSERT INTO version(major, middle, minor) VALUES (?,?,?);", (0, 8, 12))
         #20150314 self.cur.execute("CREATE TABLE note(noteId integer primary key autoincrement, authorId, date, modified, due, title, content, hash, privacy DEFAULT 0, in_trash DEFAULT 0);")
         self.cur.execute("CREATE TABLE note(noteId integer primary key autoincrement, authorId, date, modified, due, title, content, hash, privacy DEFAULT 0, book DEFAULT 1);")
         self.cur.execute("CREATE TABLE author(authorId integer primary key autoincrement, name, nickname);")
@@ -381,6 +705,8 @@ class Nota:
         self.cur.execute("CREATE TABLE book(bookId integer primary key autoincrement, number, name DEFAULT '');")
         self.cur.execute("INSERT INTO book(number, name) VALUES (0, 'Trash');")
         self.cur.execute("INSERT INTO book(number, name) VALUES (1, 'Default');")
+        self.cur.execute("CREATE TABLE attachment (attachmentId integer primary key autoincrement, filename, contents BLOB);")
+        self.cur.execute("CREATE TABLE note_attachment (note_attachmentId integer primary key autoincrement, noteId, attachmentId);")
         self.con.commit()
 
 
@@ -404,15 +730,17 @@ class Nota:
                 self.warning("the book is not known, so switching to \"Default\"")
             book = 1
         #print("book %s later" % book)
-        self.fyi("add with title='%s'" % title)
-        self.fyi("add with keywords='%s'" % keywords)
-        self.fyi("add with attachments='%s' (comma-separated string)" % attachments)
-        self.fyi("add with due='%s'" % due)
-        self.fyi("add with book='%s'" % book)
+        self.fyi("add with title='%s'", title)
+        self.fyi("add with keywords='%s'", keywords)
+        self.fyi("add with attachments='%s' (comma-separated string)", attachments)
+        self.fyi("add with due='%s'", due)
+        self.fyi("add with book='%s'", book)
         if not isinstance(due, str):
             due = ""
         due = self.interpret_time(due)[0]
-        self.fyi("due: %s" % due)
+        if due is not None:
+            due = due.strftime("%Y-%m-%d %H:%M:%S.%f")
+        self.fyi("due: %s", due)
         now = datetime.datetime.now()
         if date == "":
             date = now.strftime("%Y-%m-%d %H:%M:%S")
@@ -422,86 +750,184 @@ class Nota:
         except:
             self.error("error adding note to the database")
         noteId = self.cur.lastrowid
-        self.fyi("noteId: %s" % noteId)
+        self.fyi("noteId: %s", noteId)
         hash = self.compute_hash(noteId=noteId, date=date, title=title)
-        self.fyi("hash: %s" % hash)
+        self.fyi("hash: %s", hash)
         try:
             self.cur.execute("UPDATE note SET hash=? WHERE noteId=?;", (hash, noteId))
         except:
             self.error("error adding note hash to the database")
+        self.update_hash_abbreviation_length(hash)
         for keyword in keywords:
-            self.fyi("  inserting keyword:", keyword)
+            self.fyi("  inserting keyword: %s", keyword)
             keywordId = self.con.execute("SELECT keywordId FROM keyword WHERE keyword = ?;", [keyword]).fetchone()
             if keywordId:
-                self.fyi("  (existing keyword with id %s)" % keywordId)
+                self.fyi("  (existing keyword with id %s)", keywordId)
                 keywordId = keywordId[0]
             else:
                 self.fyi("  (new keyword)")
                 self.cur.execute("INSERT INTO keyword(keyword) VALUES (?);", [keyword])
                 keywordId = self.cur.lastrowid
+                if self.keyword_index is not None:
+                    self.keyword_index.add(keywordId, keyword)
             self.con.execute("INSERT INTO notekeyword(noteId, keywordID) VALUES(?, ?)", [noteId, keywordId])
         # Handle attachments, which must be existing files.
-        attachments = [key.lstrip().rstrip() for key in attachments.split(',')]
+        if isinstance(attachments, str):
+            attachments = attachments.split(',')
+        attachments = [key.lstrip().rstrip() for key in attachments]
         attachments = [_f for _f in attachments if _f] # remove blanks
         for attachment in attachments:
-            self.fyi("processing attachment '%s'" % attachment)
+            self.fyi("processing attachment '%s'", attachment)
+            attachment = os.path.expanduser(attachment)
             if not os.path.isfile(attachment):
                 self.warning(" cannot attach file '%s' because it does not exist" % attachment)
             else:
-                self.fyi("    '%s' exists" % attachment)
-                attachment = os.path.expanduser(attachment)
-                afile = open(attachment, "rb")
+                self.fyi("    '%s' exists", attachment)
+                sha256 = self.store_blob(attachment)
                 try:
-                    blob = afile.read()
-                    self.fyi("    read file '%s'" % attachment)
-                    self.cur.execute('INSERT INTO attachment(filename,contents) VALUES(?,?)', [attachment,buffer(blob)])
+                    self.cur.execute('INSERT INTO attachment(filename, sha256) VALUES(?,?)', [attachment, sha256])
                     attachmentId = self.cur.lastrowid
-                    self.fyi("    inserted OK; attachmentID=%d" % attachmentId)
-                    self.con.commit()
-                    self.fyi("    added to attachment table")
-                    self.fyi('    try "INSERT INTO note_attachment(noteId, attachmentId) VALUES(%d,%d)"' % (noteId,attachmentId))
+                    self.fyi("    inserted OK; attachmentID=%d", attachmentId)
                     self.cur.execute('INSERT INTO note_attachment(noteId, attachmentId) VALUES(?,?)', [noteId,attachmentId])
-                    self.con.commit()
                     self.fyi("    ... OK")
                 except:
                     self.error("Problem storing attachment named '%s'" % attachment)
-                finally:
-                    afile.close()
                 self.fyi(" ... all done, writing attachment")
         self.con.commit()
-        self.fyi("add() returning noteId=%d ... is all ok?" % noteId)
+        self.fyi("add() returning noteId=%d ... is all ok?", noteId)
         return noteId
 
 
-    def hash_abbreviation_length(self):
-        hash = []
-        #print("hash_abbreviation_length step 1")
+    def bulk_add(self, notes, book=1, batch=10000):
+        '''
+        Add many notes at once, e.g. when importing. The notes may be any
+        iterable (e.g. a generator reading a file) of dicts holding 'title',
+        'keywords', 'content', 'date' and 'due' entries, as written by
+        'nota --export'; missing entries take the defaults of add(). Unlike
+        add(), the 'due' entry is stored as given. All the notes are put into
+        the given book. Keyword IDs are cached, and the notes are written in
+        transactions of 'batch' notes, with links and hashes stored by
+        executemany(). Returns the number of notes added.
+        '''
+        known_books = [b[0] for b in self.cur.execute("SELECT number FROM book;").fetchall()]
+        if not book in known_books:
+            self.warning("the book is not known, so switching to \"Default\"")
+            book = 1
+        keywordIds = {}
+        for (keywordId, keyword) in self.cur.execute("SELECT keywordId, keyword FROM keyword ORDER BY keywordId;").fetchall():
+            keywordIds.setdefault(keyword, keywordId)
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        hashes = []
+        links = []
+        count = 0
+        try:
+            for note in notes:
+                title = note.get("title", "")
+                date = note.get("date") or now
+                self.cur.execute("INSERT INTO note(authorId, date, modified, title, content, privacy, due, book) VALUES(?, ?, ?, ?, ?, ?, ?, ?);",
+                        (self.authorId, date, note.get("modified", ""), title, note.get("content", ""), 0, note.get("due") or "", book))
+                noteId = self.cur.lastrowid
+                hashes.append((self.compute_hash(noteId=noteId, date=date, title=title), noteId))
+                for keyword in note.get("keywords", []):
+                    if keyword not in keywordIds:
+                        self.cur.execute("INSERT INTO keyword(keyword) VALUES (?);", [keyword])
+                        keywordIds[keyword] = self.cur.lastrowid
+                        if self.keyword_index is not None:
+                            self.keyword_index.add(keywordIds[keyword], keyword)
+                    links.append((noteId, keywordIds[keyword]))
+                count += 1
+                if 0 == count % batch:
+                    self.bulk_add_flush(hashes, links)
+            self.bulk_add_flush(hashes, links)
+        except sqlite.Error:
+            self.error("error adding note number %d to the database" % (count + 1))
+        self.refresh_hash_abbreviation_length()
+        return count
+
+
+    def bulk_add_flush(self, hashes, links):
+        '''Store the hashes and keyword links accumulated by bulk_add(), and commit.'''
+        self.cur.executemany("UPDATE note SET hash=? WHERE noteId=?;", hashes)
+        self.cur.executemany("INSERT INTO notekeyword(noteId, keywordID) VALUES(?, ?);", links)
+        self.con.commit()
+        del hashes[:]
+        del links[:]
+
+
+    def get_metadata(self, name, default=None):
+        '''Return the value stored under 'name' in the metadata table.'''
+        try:
+            row = self.cur.execute("SELECT value FROM metadata WHERE name = ?;", [name]).fetchone()
+        except:
+            self.error("cannot look up '%s' in the metadata table" % name)
+        return(row[0] if row else default)
+
+
+    def set_metadata(self, name, value):
+        '''Store a value under 'name' in the metadata table (not committed).'''
         try:
-            for h in self.cur.execute("SELECT hash FROM note;").fetchall():
-                hash.extend(h)
+            self.cur.execute("INSERT OR REPLACE INTO metadata(name, value) VALUES (?, ?);", [name, value])
+        except:
+            self.error("cannot store '%s' in the metadata table" % name)
+
+
+    def compute_hash_abbreviation_length(self):
+        '''
+        Return the number of characters needed to make all hashes distinct. This
+        walks the hashes in sorted order (as stored in the index), since the
+        needed length is one more than the longest prefix shared by neighbours.
+        '''
+        nc = 1
+        previous = None
+        try:
+            for (h,) in self.cur.execute("SELECT hash FROM note ORDER BY hash;"):
+                h = h or ""
+                if previous is not None:
+                    nc = max(nc, len(os.path.commonprefix([previous, h])) + 1)
+                previous = h
         except:
             self.error("ERROR: cannot find hashes")
-        #print("hash_abbreviation_length step 2")
-        n = len(hash)
-        #print("hash_abbreviation_length step 3; n=%d" % n)
-        for nc in range(1, 20): # unlikely to be > 7
-            #print("hash_abbreviation_length step 4; nc=%d" % nc)
-            h = hash[:]
-            for i in range(n):
-                #print("h[%d] '%s'" % (i, hash[i]))
-                h[i] = h[i][0:nc]
-            #print("h %s" % h)
-            hs = sorted(h)
-            duplicate = False
-            for i in range(n-1):
-                if hs[i] == hs[i+1]:
-                    duplicate = True
-                    break
-            if not duplicate:
-                break
+        return(min(nc, 19)) # unlikely to be > 7
+
+
+    def hash_abbreviation_length(self):
+        '''Return the number of hash characters to show in lists of notes.'''
+        nc = self.get_metadata("hash_abbreviation_length")
+        if nc is None:
+            nc = self.refresh_hash_abbreviation_length()
+        return(int(nc))
+
+
+    def refresh_hash_abbreviation_length(self):
+        '''Recompute the stored hash abbreviation length, e.g. after notes are removed.'''
+        nc = self.compute_hash_abbreviation_length()
+        self.set_metadata("hash_abbreviation_length", nc)
+        self.con.commit()
         return(nc)
 
 
+    def update_hash_abbreviation_length(self, hash):
+        '''
+        Update the stored hash abbreviation length for a newly added hash, by
+        comparing it with its neighbours in the hash index. Adding a hash can
+        only lengthen the abbreviation, so the other hashes need not be examined.
+        '''
+        nc = self.get_metadata("hash_abbreviation_length")
+        if nc is None:
+            return # computed in full when next needed
+        nc = int(nc)
+        try:
+            neighbours = self.cur.execute("SELECT hash FROM note WHERE hash < ? ORDER BY hash DESC LIMIT 1;", [hash]).fetchall()
+            neighbours.extend(self.cur.execute("SELECT hash FROM note WHERE hash > ? ORDER BY hash LIMIT 1;", [hash]).fetchall())
+            if self.cur.execute("SELECT count(*) FROM note WHERE hash = ?;", [hash]).fetchone()[0] > 1:
+                neighbours.append((hash,))
+        except:
+            self.error("ERROR: cannot find neighbouring hashes")
+        for (h,) in neighbours:
+            nc = max(nc, len(os.path.commonprefix([h or "", hash])) + 1)
+        self.set_metadata("hash_abbreviation_length", min(nc, 19))
+
+
     def keyword_hookup(self, noteId, keywords):
         '''
         Unhook existing cross-linking entries.
@@ -512,17 +938,19 @@ class Nota:
             self.error("ERROR: cannot unhook previous keywords")
         # Now, hook up new the entries, one by one.
         for keyword in keywords:
-            self.fyi(" inserting keyword:", keyword)
+            self.fyi(" inserting keyword: %s", keyword)
             # Make sure the keyword table contains the word in question.
             keywordId = self.con.execute("SELECT keywordId FROM keyword WHERE keyword = ?;", [keyword]).fetchone()
             try:
                 if keywordId:
-                    self.fyi("  (existing keyword with id: %s)" % keywordId)
+                    self.fyi("  (existing keyword with id: %s)", keywordId)
                     keywordId = keywordId[0]
                 else:
                     self.fyi("  (new keyword)")
                     self.cur.execute("INSERT INTO keyword(keyword) VALUES (?);", [keyword])
                     keywordId = self.cur.lastrowid
+                    if self.keyword_index is not None:
+                        self.keyword_index.add(keywordId, keyword)
                 # Finally, do the actual hookup for this word.
                 self.con.execute("INSERT INTO notekeyword(noteId, keywordID) VALUES(?, ?)", [noteId, keywordId])
             except:
@@ -530,6 +958,20 @@ class Nota:
         self.con.commit()
 
 
+    def get_keyword_index(self):
+        '''
+        Return the KeywordIndex used to resolve keywords typed by users. It is
+        built on first use, and then kept up to date by the methods that alter
+        the keyword table.
+        '''
+        if self.keyword_index is None:
+            try:
+                self.keyword_index = KeywordIndex(self.cur.execute("SELECT keywordId, keyword FROM keyword;").fetchall())
+            except:
+                self.error("ERROR: cannot find database table 'keyword'")
+        return self.keyword_index
+
+
     def list_keywords(self):
         ''' Return the list of keywords '''
         names = []
@@ -546,30 +988,16 @@ class Nota:
         return(names)
 
 
-    def rename_keyword(self, old, new):
-        existing = self.list_keywords()
-        if old in existing:
-            self.fyi("should rename keyword '%s' to '%s'" % (old, new))
-            try:
-                self.cur.execute("UPDATE book SET name=(?) WHERE name=(?);", (new, old))
-                self.con.commit()
-            except:
-                self.error("Error changing keyword '%s' to '%s'" % (old, new))
-        else:
-            self.error("There is no keyword '%s'." % old)
-        exit(0)
-
-
     def undelete(self, hash): # takes out of trash
         hash = str(hash)
         if not hash:
             self.error("must give the hash of the note that is to be undeleted")
         trash_contents = self.find_by_hash(hash, book=0)
-        self.fyi("trash_contents : %s" % trash_contents)
+        self.fyi("trash_contents : %s", trash_contents)
         hashlen = len(hash)
         for t in trash_contents:
             if t['hash'][0:hashlen] == hash:
-                self.fyi("undeleting note with hash %s" % t['hash'][0:7])
+                self.fyi("undeleting note with hash %s", t['hash'][0:7])
                 try:
                     # put into book 1
                     self.cur.execute("UPDATE note SET book = 1 WHERE noteId = ?;", [t['noteId']])
@@ -617,6 +1045,7 @@ class Nota:
                 except:
                     self.error("problem updating hash for noteId=%s" % n[0])
         self.con.commit()
+        self.refresh_hash_abbreviation_length()
 
 
     def delete(self, hash=""): # moves to trash
@@ -624,15 +1053,15 @@ class Nota:
         if 0 == len(hash):
             exit(0)
         old = self.find_by_hash(hash)
-        self.fyi("old: %s" % old)
+        self.fyi("old: %s", old)
         if not len(old):
             self.error("no active notes match abbreviated hash '%s'" % hash)
         if 1 != len(old):
             self.error("cannot delete %d notes at once; try adding more letters to the hash code" % len(old))
         id = int(old[0]["noteId"])
-        self.fyi("in delete(), id=%s" % id)
+        self.fyi("in delete(), id=%s", id)
         try:
-            self.fyi("move note with noteId = %s to the trash." % id)
+            self.fyi("move note with noteId = %s to the trash.", id)
             self.cur.execute("UPDATE note SET book = 0 WHERE noteId = ?;", [id])
             self.con.commit()
         except:
@@ -641,32 +1070,79 @@ class Nota:
         return True
 
 
-    def empty_trash(self):
+    def empty_trash(self, chunk=1000, vacuum=False):
+        '''
+        Permanently delete the notes in the trash, along with their attachments.
+        The deletions are set-based statements acting on up to 'chunk' notes at
+        a time, with a commit after each chunk, so that the journal stays small;
+        links to keywords and attachments go with the notes, by cascade. If
+        'vacuum' is True, the database file is then compacted. The return value
+        is a tuple holding the number of notes deleted and the number of bytes
+        freed within the database.
+        '''
         self.fyi("about to empty the trash")
         try:
-            noteIds = []
-            noteIds.extend(self.con.execute("SELECT noteId from note WHERE book=0;"))
-            for n in noteIds:
-                self.fyi("  trashing note with noteId: %s" % n)
-                self.con.execute("DELETE FROM note WHERE noteId=?", n)
-                # keywords
-                self.fyi("  trashing notekeyword with noteId: %s" % n)
-                self.con.execute("DELETE FROM notekeyword WHERE noteId=?", n)
-                # attachments
-                attachmentIds = []
-                attachmentIds.extend(self.con.execute("SELECT attachmentId from note_attachment WHERE noteId=?", n))
-                if len(attachmentIds):
-                    self.fyi("  trashing note_attachment with noteId: %s" % n)
-                    self.con.execute("DELETE FROM note_attachment WHERE noteId=?", n)
-                    for a in attachmentIds:
-                        self.fyi("  trashing attachmentId: %s" % a)
-                        self.con.execute("DELETE FROM attachment WHERE attachmentId=?", a)
-                else:
-                    self.fyi("  this note has no attachments")
-            self.fyi("trashed %s notes" % len(noteIds))
-            self.con.commit()
+            total = self.cur.execute("SELECT count(*) FROM note WHERE book = 0;").fetchone()[0]
+            used_before = self.bytes_used()
         except:
             self.error("problem encountered when emptying the trash")
+        chunk_notes = "SELECT noteId FROM note WHERE book = 0 ORDER BY noteId LIMIT %d" % int(chunk)
+        deleted = 0
+        while deleted < total:
+            try:
+                # Attachments go first, since deleting a note deletes its links to them.
+                self.cur.execute("DELETE FROM attachment WHERE attachmentId IN " +
+                        "(SELECT attachmentId FROM note_attachment WHERE noteId IN (" + chunk_notes + "));")
+                self.cur.execute("DELETE FROM note WHERE noteId IN (" + chunk_notes + ");")
+                n = self.cur.rowcount
+                self.con.commit()
+            except:
+                self.error("problem encountered when emptying the trash")
+            if n <= 0:
+                break
+            deleted += n
+            if total > chunk and not self.quiet:
+                print("Deleted %d of %d notes in the trash." % (deleted, total), file=sys.stderr)
+        try:
+            # Drop stored attachment contents that no attachment refers to any more.
+            self.cur.execute("DELETE FROM attachment_chunk WHERE sha256 IN (SELECT sha256 FROM attachment_blob WHERE refcount <= 0);")
+            self.cur.execute("DELETE FROM attachment_blob WHERE refcount <= 0;")
+            self.con.commit()
+        except:
+            self.error("problem encountered when removing unused attachment contents")
+        self.fyi("trashed %s notes", deleted)
+        self.refresh_hash_abbreviation_length()
+        if vacuum:
+            self.vacuum()
+        return(deleted, used_before - self.bytes_used())
+
+
+    def bytes_used(self):
+        '''Return the number of bytes in database pages that are in use.'''
+        page_size = self.cur.execute("PRAGMA page_size;").fetchone()[0]
+        page_count = self.cur.execute("PRAGMA page_count;").fetchone()[0]
+        freelist_count = self.cur.execute("PRAGMA freelist_count;").fetchone()[0]
+        return((page_count - freelist_count) * page_size)
+
+
+    def vacuum(self):
+        '''
+        Return unused pages of the database to the filesystem, and update the
+        statistics that SQLite uses to choose indexes.
+        '''
+        self.fyi("vacuuming database")
+        try:
+            self.cur.execute("ANALYZE;")
+            if self.cur.execute("SELECT name FROM sqlite_master WHERE name='note_fts';").fetchone():
+                # Merge the full-text index, so that space held by deleted entries is released.
+                self.cur.execute("INSERT INTO note_fts(note_fts) VALUES ('optimize');")
+                self.con.commit()
+            if 2 == self.cur.execute("PRAGMA auto_vacuum;").fetchone()[0]:
+                self.cur.execute("PRAGMA incremental_vacuum;").fetchall()
+            else:
+                self.cur.execute("VACUUM;")
+        except:
+            self.error("cannot vacuum the database")
 
 
     def edit(self, hash=""):
@@ -677,14 +1153,10 @@ class Nota:
         '''
         if not len(hash):
             exit(0)
-        self.fyi("nota.edit() has hash: %s" % hash)
+        self.fyi("nota.edit() has hash: %s", hash)
         ## do not use find_by_hash() because can be in hash or not.
-        rows = self.cur.execute("SELECT noteId, hash FROM note;").fetchall()
-        hash_len = len(hash)
-        noteIds = []
-        for r in rows:
-            if r[1][0:hash_len] == hash:
-                noteIds.append((r[0],))
+        (condition, params) = self.hash_range(hash)
+        noteIds = self.cur.execute("SELECT noteId FROM note WHERE " + condition + ";", params).fetchall()
         if not len(noteIds):
             self.error("no active notes match abbreviated hash '%s'" % hash)
         if 1 != len(noteIds):
@@ -714,6 +1186,8 @@ class Nota:
         if ee["due"] and ee["due"] != "None":
             try:
                 due = self.interpret_time(ee["due"])[0]
+                if due is not None:
+                    due = due.strftime("%Y-%m-%d %H:%M:%S.%f")
                 self.cur.execute("UPDATE note SET due=(?) WHERE noteId=?;", (due, noteId))
             except:
                 self.error("cannot update the 'due' date")
@@ -736,6 +1210,7 @@ class Nota:
             except:
                 self.error("There was a problem deleting keyword %s" % key)
         self.con.commit()
+        self.keyword_index = None
 
 
     def get_id_list(self):
@@ -752,195 +1227,358 @@ class Nota:
         except:
             self.error("cannot determine number of items in trash")
 
-    def find_by_hash(self, hash=None, book=-1):
-        '''Search notes for a given (possibly abbreviated) hash'''
-        if hash:
-            self.fyi("nota.find_by_hash() with abbreviated hash %s; book=%s" % (hash, book))
+    def hydrate_notes(self, where="1", params=(), order="note.noteId", limit=None, fields=None):
+        '''
+        Return a list of notes selected by an SQL condition on the 'note' table,
+        each as a dict holding the note columns and its keywords. The work is done
+        with a single query, since keywords are read from the note.keywords cache.
+        If 'fields' is given, only those items (see Nota.note_fields) are looked
+        up, along with 'noteId', which saves reading the contents of notes for
+        listings that do not show them.
+        '''
+        if fields is None:
+            fields = self.note_fields
+        else:
+            unknown = [field for field in fields if field not in self.note_fields]
+            if unknown:
+                self.error("unknown field(s) %s; try some of: %s" % (", ".join(unknown), ", ".join(self.note_fields)))
+            fields = ["noteId"] + [field for field in fields if field != "noteId"]
+        selection = "FROM note WHERE %s ORDER BY %s" % (where, order)
+        params = list(params)
+        if limit is not None:
+            selection += " LIMIT ?"
+            params.append(int(limit))
         try:
-            if book < 0:
-                rows = self.cur.execute("SELECT noteId, hash FROM note WHERE book > 0;").fetchall()
-            else:
-                rows = self.cur.execute("SELECT noteId, hash FROM note WHERE book=?;", [book]).fetchall()
+            notes = self.cur.execute("SELECT " + ", ".join("note." + field for field in fields) + " " +
+                    selection + ";", params).fetchall()
         except:
-            self.error("nota.find_by_hash() cannot look up note list")
-        # Possibly save time by finding IDs first.
-        noteIds = []
-        if hash:
-            l = len(hash)
-            for r in rows:
-                if hash == r[1][0:l]:
-                    noteIds.append((r[0],))
-        else:
-            for r in rows:
-                noteIds.append((r[0],))
-        self.fyi("noteIds: %s" % noteIds)
+            self.error("nota.hydrate_notes() cannot look up notes")
         rval = []
-        for n in noteIds:
-            try:
-                note = self.cur.execute("SELECT noteId, authorId, date, title, content, due, privacy, modified, hash, book FROM note WHERE noteId=?;", n).fetchone()
-            except:
-                self.warning("Problem extracting note %s from database" % n)
-                next
-            if note:
-                date = note[2]
-                due = note[5]
-                privacy = note[6]
-                keywordIds = []
-                keywordIds.extend(self.con.execute("SELECT keywordid FROM notekeyword WHERE notekeyword.noteid=?;", n))
-                keywords = []
-                for k in keywordIds:
-                    keywords.append(self.cur.execute("SELECT keyword FROM keyword WHERE keywordId=?;", k).fetchone()[0])
-                rval.append({"noteId":note[0], "title":note[3], "keywords":keywords,
-                    "content":note[4], "due":note[5], "privacy":note[6],
-                    "date":note[2], "modified":note[7], "hash":note[8], "book":note[9]})
+        for note in notes:
+            note = dict(zip(fields, note))
+            if "keywords" in note:
+                note["keywords"] = json.loads(note["keywords"])
+            rval.append(note)
         return rval
 
 
-    def find_by_keyword(self, keywords="", strict_match=False, book=-1):
-        self.fyi("find_by_keyword, ... book=%s" % book)
-        '''Search notes for a given keyword'''
-        self.fyi("nota.find_by_keyword() with keywords %s; book=%s" % (keywords, book))
-        keywordsKnown = []
-        if not strict_match:
-            keywords[0] = keywords[0].lower()
-        for k in self.cur.execute("SELECT keyword FROM keyword;").fetchall():
-            if strict_match:
-                keywordsKnown.extend(k)
-            else:
-                keywordsKnown.extend(k)
-                keywordsKnown.extend([str(k[0]).lower()])
-        self.fyi("keywordsKnown: %s" % keywordsKnown)
-        # FIXME: only using first keyword here!
-        if not strict_match:
-            keywords_partial = []
-            kl = len(keywords[0])
-            if kl > 3:
-                for K in keywordsKnown:
-                    if K[0:kl] == keywords[0]:
-                        if K not in keywords_partial:
-                            keywords_partial.append(K)
-            # Try fuzzy search only if no direct matches
-            keywords_fuzzy = []
-            if not len(keywords_partial):
-                keywords_fuzzy = difflib.get_close_matches(keywords[0], keywordsKnown, n=1, cutoff=0.6)
-            self.fyi("  keywords_partial %s" % keywords_partial)
-            self.fyi("  keywords_fuzzy %s" % keywords_fuzzy)
-            keywords = list(set(keywords_partial + keywords_fuzzy))
-        self.fyi("nota.find_by_keyword() later, keywords: %s" % keywords)
-        noteIds = []
-        for keyword in keywords:
-            self.fyi("keyword: %s" % keyword)
-            if strict_match:
-                self.fyi("strict match on keyword '%s'" % keyword)
-                try:
-                    keywordId = self.con.execute("SELECT keywordId FROM keyword WHERE keyword=?;",
-                            [keyword]).fetchone()
-                except:
-                    self.error("cannot look up keyword '%s'" % [keyword])
-            else:
-                self.fyi("non-strict match on keyword '%s'" % keyword)
-                try:
-                    keywordId = []
-                    for k in self.cur.execute("SELECT keywordId FROM keyword WHERE keyword=? COLLATE NOCASE;", [keyword]).fetchall():
-                        keywordId.extend(k)
-                except:
-                    self.error("cannot look up keyword '%s'" % [keyword])
-            try:
-                if len(keywordId):
-                    self.fyi("looking for noteID matches to keywordId %s" % keywordId)
-                    for k in keywordId:
-                        self.fyi("k: %s" % k)
-                        try:
-                            if strict_match:
-                                noteIdtest = self.cur.execute("SELECT noteId FROM notekeyword WHERE keywordId=?;", [k])
-                            else:
-                                noteIdtest = self.cur.execute("SELECT noteId FROM notekeyword WHERE keywordId=? COLLATE NOCASE;", [k])
-                        except:
-                            self.error("cannot query database to find noteId corresponding to keywordId value %s" % [k])
-                        for noteId in noteIdtest:
-                            self.fyi("got match to noteID %s" % noteId)
-                            if noteId not in noteIds:
-                                noteIds.append(noteId)
-                                self.fyi("adding to list")
-                            else:
-                                self.fyi("already in list")
-                        self.fyi("done with keyword %s" % k)
-                else:
-                    pass
-            except:
-                #20150314 self.error("problem finding keyword or note in database")
-                #20150314 shouldn't be an error to not find a note!
-                pass
-        ## convert from hash to ids. Note that one hash may create several ids.
-        self.fyi("noteIds: %s" % noteIds)
-        ## Find IDs of just the notes with the proper book value
-        noteIds2 = []
-        self.fyi("ORIGINAL noteIds: %s" % noteIds)
-        for n in noteIds:
-            self.fyi("n=%s" % n)
-            try:
-                row = self.cur.execute("SELECT noteId, book FROM note WHERE noteID=?;", n).fetchone()
-            except:
-                self.error("cannot look up noteId %s" % n)
-            self.fyi("row %s; book=%s" % (row, book))
-            if book < 0 or row[1] == book:
-                self.fyi("appending id %s" % row[0])
-                noteIds2.append((row[0],))
-            else:
-                self.fyi("skipping id %s because book is wrong" % row[0])
-        noteIds = noteIds2
-        #self.fyi("  LATER    noteIds2: %s" % noteIds2)
-        #self.fyi("  LATER    noteIds: %s" % noteIds)
-        rval = []
-        for n in noteIds:
-            #self.fyi(" processing id=%s" % n)
-            try:
-                note = self.cur.execute("SELECT noteId, authorId, date, title, content, due, privacy, modified, hash, book FROM note WHERE noteId=?;", n).fetchone()
-            except:
-                self.warning("Problem extracting note %s from database" % n)
-                next
-            if note:
-                date = note[2]
-                due = note[5]
-                privacy = note[6]
-                keywordIds = []
-                keywordIds.extend(self.con.execute("SELECT keywordid FROM notekeyword WHERE notekeyword.noteid=?;", n))
-                keywords = []
-                for k in keywordIds:
-                    keywords.append(self.cur.execute("SELECT keyword FROM keyword WHERE keywordId=?;", k).fetchone()[0])
-                rval.append({"noteId":note[0], "title":note[3], "keywords":keywords,
-                    "content":note[4], "due":note[5], "privacy":note[6],
-                    "date":note[2], "modified":note[7], "hash":note[8], "book":note[9]})
-        return rval
+    def hash_condition(self, hash=None, book=-1):
+        '''
+        Return an SQL condition on the note table, and its parameters, that
+        selects notes in the given book (or in any book but the trash, if book
+        is negative, or in any book at all, if book is None) whose hash starts
+        with the given abbreviation (if any).
+        '''
+        # Non-trashed notes are selected with '!=', which (unlike '>') does not lead
+        # SQLite to use the index on 'book', as that would be slower for the
+        # common case of most notes being selected.
+        if book is None:
+            where = "1"
+            params = []
+        elif book < 0:
+            where = "note.book != 0"
+            params = []
+        else:
+            where = "note.book = ?"
+            params = [book]
+        if hash:
+            (condition, hash_params) = self.hash_range(hash)
+            where += " AND " + condition
+            params.extend(hash_params)
+        return(where, params)
+
+
+    def note_condition(self, hash=None, keywords=None, strict_match=False, book=-1, due_between=None):
+        '''
+        Return an SQL condition on the note table, and its parameters, that
+        selects notes in the given book whose hash starts with the given
+        abbreviation, if any (see hash_condition()), that match the given
+        keyword terms, if any (see keyword_condition()), and that are due
+        within the (start, end) window 'due_between', if given (see
+        due_window()). The condition is None if no note can match.
+        '''
+        (where, params) = self.hash_condition(hash, book)
+        if due_between is not None:
+            where += " AND note.due_epoch >= ? AND note.due_epoch < ?"
+            params.extend(due_between)
+        if keywords:
+            if isinstance(keywords, str):
+                keywords = keywords.split(",")
+            (condition, keyword_params) = self.keyword_condition(keywords, strict_match)
+            if condition is None:
+                return(None, [])
+            where += " AND " + condition
+            params.extend(keyword_params)
+        return(where, params)
+
+
+    def count(self, hash=None, keywords=None, strict_match=False, book=-1, due_between=None):
+        '''
+        Return a tuple holding the number of notes selected as for
+        note_condition(), and the number of notes in the trash that would be
+        selected if 'book' were 0. Both are found with a single statement,
+        without looking up the notes.
+        '''
+        (where, params) = self.note_condition(hash=hash, keywords=keywords, strict_match=strict_match,
+                book=None, due_between=due_between)
+        if where is None:
+            return (0, 0)
+        if book < 0:
+            selected = "note.book != 0"
+        else:
+            selected = "note.book = %d" % int(book)
+        try:
+            return self.cur.execute("SELECT count(CASE WHEN %s THEN 1 END), count(CASE WHEN note.book = 0 THEN 1 END) " % selected +
+                    "FROM note WHERE " + where + ";", params).fetchone()
+        except:
+            self.error("cannot count notes")
+
+
+    def page_of_notes(self, where="1", params=(), limit=None, after=None, fields=None):
+        '''
+        Return up to 'limit' notes selected by an SQL condition on the note
+        table, in noteId order, starting after the note whose noteId is 'after'
+        (if given). Since the start is found with the primary key, rather than
+        by skipping notes, the cost of a page does not depend on how many
+        pages come before it.
+        '''
+        if after is not None:
+            where = "(%s) AND note.noteId > ?" % where
+            params = list(params) + [after]
+        return self.hydrate_notes(where, params, limit=limit, fields=fields)
+
 
+    def iter_notes(self, where="1", params=(), batch=1000, after=None, fields=None):
+        '''
+        Yield the notes selected by an SQL condition on the note table, in
+        noteId order, starting after the note whose noteId is 'after' (if
+        given). The notes are looked up 'batch' at a time with page_of_notes(),
+        so that memory use does not depend on the number of notes.
+        '''
+        while True:
+            notes = self.page_of_notes(where, params, limit=batch, after=after, fields=fields)
+            if len(notes) == batch:
+                after = notes[-1]["noteId"] # before callers can change the note
+            for note in notes:
+                yield note
+            if len(notes) < batch:
+                break
 
-    def find_recent(self, nrecent=4):
-        '''Find recent non-trashed notes'''
+
+    def books_of(self, hash=None, keywords=None, strict_match=False, book=-1, due_between=None):
+        '''Return the numbers of the books holding the notes selected as for note_condition().'''
+        (where, params) = self.note_condition(hash=hash, keywords=keywords, strict_match=strict_match,
+                book=book, due_between=due_between)
+        if where is None:
+            return []
         try:
-            rows = self.cur.execute("SELECT noteId FROM note WHERE book > 0 ORDER BY date DESC LIMIT %d;"%nrecent).fetchall()
+            return [row[0] for row in self.cur.execute("SELECT DISTINCT note.book FROM note WHERE %s;" % where, params)]
         except:
-            self.error("nota.find_recent() cannot look up note list")
-        # Possibly save time by finding IDs first.
-        noteIds = []
-        for r in rows:
-            noteIds.append(r[0],)
-        self.fyi("noteIds: %s" % noteIds)
-        rval = []
-        for n in noteIds:
-            note = None
+            self.error("cannot look up the books holding notes")
+
+
+    def find_by_hash(self, hash=None, book=-1, fields=None, limit=None, after=None):
+        '''
+        Search notes for a given (possibly abbreviated) hash. The result may be
+        paged with 'limit' and 'after', as for page_of_notes().
+        '''
+        if hash:
+            self.fyi("nota.find_by_hash() with abbreviated hash %s; book=%s", hash, book)
+        (where, params) = self.hash_condition(hash, book)
+        return self.page_of_notes(where, params, limit=limit, after=after, fields=fields)
+
+
+    def iter_by_hash(self, hash=None, book=-1, batch=1000, fields=None):
+        '''
+        Yield the notes that find_by_hash() would return, in noteId order,
+        looking them up 'batch' at a time, as for iter_notes(). This is used
+        for exporting.
+        '''
+        return self.iter_found(hash=hash, book=book, batch=batch, fields=fields)
+
+
+    def iter_found(self, hash=None, keywords=None, strict_match=False, book=-1, due_between=None,
+            batch=1000, after=None, fields=None):
+        '''
+        Yield the notes that find_notes() would return, in noteId order,
+        starting after the note whose noteId is 'after' (if given), and
+        looking them up 'batch' at a time, as for iter_notes().
+        '''
+        while True:
+            notes = self.find_notes(hash=hash, keywords=keywords, strict_match=strict_match, book=book,
+                    due_between=due_between, limit=batch, after=after, fields=fields)
+            if len(notes) == batch:
+                after = notes[-1]["noteId"] # before callers can change the note
+            for note in notes:
+                yield note
+            if len(notes) < batch:
+                break
+
+
+    def keyword_ids(self, keyword, strict_match=False):
+        '''
+        Return the IDs of the keywords matching the given one. With strict_match,
+        only identical keywords match. Otherwise, case is ignored, keywords of
+        more than 3 characters also match longer keywords that start with them,
+        and if nothing matches that way, the closest similar keyword is used.
+        '''
+        index = self.get_keyword_index()
+        if strict_match:
+            self.fyi("strict match on keyword '%s'", keyword)
+            return index.exact(keyword)
+        keyword = keyword.lower()
+        keywords_partial = []
+        if len(keyword) > 3:
+            keywords_partial = index.prefix(keyword)
+        # Try fuzzy search only if no direct matches
+        keywords_fuzzy = []
+        if not len(keywords_partial):
+            keywords_fuzzy = index.fuzzy(keyword, n=1, cutoff=0.6)
+        self.fyi("  keywords_partial %s", keywords_partial)
+        self.fyi("  keywords_fuzzy %s", keywords_fuzzy)
+        keywordIds = []
+        for k in keywords_partial + keywords_fuzzy:
+            keywordIds.extend(index.nocase(k))
+        return sorted(set(keywordIds))
+
+
+    def keyword_condition(self, keywords, strict_match=False):
+        '''
+        Return an SQL condition on the note table, and its parameters, that
+        selects the notes matching a list of keyword terms. Every term must
+        match. A term may hold alternatives separated by '|', any of which may
+        match, and a term starting with '!' must not match. For example,
+        ["a", "b|c", "!d"] selects notes having keyword a, keyword b or c, and
+        not keyword d. Keywords are matched as by keyword_ids(), except that
+        those to be excluded must be the same (ignoring case, unless
+        strict_match is given), so that e.g. "!foo" does not exclude "food".
+        The condition is None if no note can match.
+        '''
+        conditions = []
+        params = []
+        for term in keywords:
+            term = term.strip()
+            negate = term.startswith("!")
+            if negate:
+                term = term[1:]
+            keywordIds = []
+            for keyword in term.split("|"):
+                keyword = keyword.strip()
+                if keyword and negate:
+                    index = self.get_keyword_index()
+                    keywordIds.extend(index.exact(keyword) if strict_match else index.nocase(keyword))
+                elif keyword:
+                    keywordIds.extend(self.keyword_ids(keyword, strict_match))
+            keywordIds = sorted(set(keywordIds))
+            self.fyi("term '%s' has keywordIds %s", term, keywordIds)
+            if not keywordIds:
+                if negate or not term:
+                    continue # nothing to exclude
+                return(None, [])
+            conditions.append("note.noteId %sIN (SELECT noteid FROM notekeyword WHERE keywordid IN (%s))" %
+                    ("NOT " if negate else "", ",".join("?" * len(keywordIds))))
+            params.extend(keywordIds)
+        if not conditions:
+            conditions = ["1"]
+        return(" AND ".join(conditions), params)
+
+
+    def find_by_keyword(self, keywords="", strict_match=False, book=-1, fields=None, limit=None, after=None):
+        '''
+        Search notes for keywords, given as a list of terms (or a string of
+        comma-separated terms) as described for keyword_condition(). The result
+        may be paged with 'limit' and 'after', as for page_of_notes().
+        '''
+        self.fyi("nota.find_by_keyword() with keywords %s; book=%s", keywords, book)
+        (where, params) = self.note_condition(keywords=keywords, strict_match=strict_match, book=book)
+        if where is None:
+            return []
+        return self.page_of_notes(where, params, limit=limit, after=after, fields=fields)
+
+
+    def find_notes(self, hash=None, keywords=None, strict_match=False, book=-1, due_between=None,
+            fields=None, limit=None, after=None):
+        '''
+        Find the notes selected as for note_condition(), by any of hash,
+        keywords and due time. The result may be paged with 'limit' and
+        'after', as for page_of_notes().
+        '''
+        (where, params) = self.note_condition(hash=hash, keywords=keywords, strict_match=strict_match,
+                book=book, due_between=due_between)
+        if where is None:
+            return []
+        return self.page_of_notes(where, params, limit=limit, after=after, fields=fields)
+
+
+    def find_by_id(self, noteId, fields=None):
+        '''Return a list holding the note whose noteId is given, if there is one.'''
+        return self.hydrate_notes("note.noteId = ?", [int(noteId)], fields=fields)
+
+
+    def find_recent(self, nrecent=4, fields=None, after=None, due_between=None):
+        '''
+        Find recent non-trashed notes, newest first, limited to those due
+        within 'due_between' if that is given (see due_window()). For the next
+        page, let 'after' be a tuple holding the date and noteId of the last
+        note found.
+        '''
+        where = "note.book != 0"
+        params = []
+        if due_between is not None:
+            where += " AND note.due_epoch >= ? AND note.due_epoch < ?"
+            params.extend(due_between)
+        if after is not None:
+            where += " AND (note.date, note.noteId) < (?, ?)"
+            params.extend(after)
+        return self.hydrate_notes(where, params, order="note.date DESC, note.noteId DESC", limit=nrecent, fields=fields)
+
+
+    def search(self, query, book=-1, limit=None, markers=("", ""), fields=None):
+        '''
+        Search the titles and contents of notes, using the full-text index.
+        The query uses the SQLite FTS5 syntax, so e.g. 'foo bar' finds notes
+        containing both words, 'foo OR bar' finds notes containing either, and
+        'foo*' finds words starting with 'foo'. The result is a list of notes,
+        best match first, each with a 'snippet' of the matching text, in which
+        matches are surrounded by the strings in 'markers'.
+        '''
+        self.fyi("nota.search() with query '%s'; book=%s", query, book)
+        if not self.cur.execute("SELECT name FROM sqlite_master WHERE name='note_fts';").fetchone():
+            self.error("full-text search requires a version of SQLite that has FTS5")
+        if book < 0:
+            where = "note.book != 0"
+            params = []
+        else:
+            where = "note.book = ?"
+            params = [book]
+        ranked = "SELECT note_fts.rowid, snippet(note_fts, -1, ?, ?, '...', 12) FROM note_fts " + \
+                "JOIN note ON note.noteId = note_fts.rowid " + \
+                "WHERE note_fts MATCH ? AND " + where + " ORDER BY bm25(note_fts, 5.0, 1.0)"
+        if limit is not None:
+            ranked += " LIMIT %d" % int(limit)
+        try:
+            rows = self.cur.execute(ranked + ";", [markers[0], markers[1], query] + params).fetchall()
+        except sqlite.OperationalError:
+            # Not valid FTS5 syntax (e.g. 'foo-bar'), so search for the words literally.
+            query = " ".join('"%s"' % word.replace('"', '""') for word in query.split())
             try:
-                note = self.cur.execute("SELECT noteId, date, title, content, hash, book FROM note WHERE noteId = ?;", [n]).fetchone()
+                rows = self.cur.execute(ranked + ";", [markers[0], markers[1], query] + params).fetchall()
             except:
-                self.warning("Problem extracting note %s from database for recent-list" % n)
-                next
-            if note:
-                keywordIds = []
-                keywordIds.extend(self.con.execute("SELECT keywordid FROM notekeyword WHERE notekeyword.noteid=?;", [n]))
-                keywords = []
-                for k in keywordIds:
-                    keywords.append(self.cur.execute("SELECT keyword FROM keyword WHERE keywordId=?;", k).fetchone()[0])
-                rval.append({"noteId":note[0], "date":note[1], "title":note[2], "keywords":keywords,
-                    "content":note[3], "hash":note[4], "book":note[5]})
+                self.error("cannot search for '%s'" % query)
+        if not rows:
+            return []
+        # Look up just the ranked notes, in batches to stay within SQLite's limit on parameters.
+        noteIds = [row[0] for row in rows]
+        notes = {}
+        for i in range(0, len(noteIds), 500):
+            batch = noteIds[i:i+500]
+            for note in self.hydrate_notes("note.noteId IN (%s)" % ",".join("?" * len(batch)), batch, fields=fields):
+                notes[note["noteId"]] = note
+        rval = []
+        for (noteId, snippet) in rows:
+            note = notes[noteId]
+            note["snippet"] = snippet
+            rval.append(note)
         return rval
 
 
@@ -948,12 +1586,27 @@ class Nota:
         if id < 0:
             self.error("Cannot have a negative note ID")
             return None
-        keywordIds = []
-        keywordIds.extend(self.con.execute("SELECT keywordid FROM notekeyword WHERE notekeyword.noteid = ?;", [id]))
-        keywords = []
-        for k in keywordIds:
-            keywords.append(self.cur.execute("SELECT keyword FROM keyword WHERE keywordId = ?;", k).fetchone()[0])
-        return keywords
+        keywords = self.con.execute("SELECT keywords FROM note WHERE noteId = ?;", [id]).fetchone()
+        return json.loads(keywords[0]) if keywords else []
+
+
+    def rebuild_keyword_cache(self):
+        '''
+        Check the keywords cached in note.keywords against the keyword tables,
+        rebuilding the cache for any notes where they differ, and return the
+        number of such notes. Since triggers maintain the cache, this ought to
+        return 0, except for a database altered by a version of nota that
+        predates the cache.
+        '''
+        try:
+            self.cur.execute("UPDATE note SET keywords = " + self.keyword_cache_sql % "note.noteId" +
+                    " WHERE keywords IS NOT " + self.keyword_cache_sql % "note.noteId" + ";")
+            n = self.cur.rowcount
+            self.con.commit()
+        except:
+            self.error("cannot rebuild the cache of keywords")
+        self.fyi("rebuilt the cache of keywords for %d notes", n)
+        return n
 
     def get_attachment_list(self, noteId):
         if noteId < 0:
@@ -972,9 +1625,145 @@ class Nota:
         return filename
 
     def get_attachment_contents(self, attachmentId):
-        contents = self.con.execute("SELECT contents FROM attachment WHERE attachmentId=?;",
+        '''
+        Return a tuple holding the contents of an attachment. Since this holds
+        the whole file in memory, extract_attachment() is better for large files.
+        '''
+        row = self.con.execute("SELECT contents, sha256 FROM attachment WHERE attachmentId=?;",
                 [attachmentId]).fetchone()
-        return contents
+        if row is None:
+            return None
+        if row[0] is not None: # not yet moved to the store (should not happen)
+            return (row[0],)
+        chunks = self.con.execute("SELECT data FROM attachment_chunk WHERE sha256=? ORDER BY seq;", [row[1]])
+        return (b"".join(chunk[0] for chunk in chunks),)
+
+
+    def extract_attachment(self, attachmentId, path, con=None):
+        '''
+        Write the contents of an attachment to the file named 'path', and
+        return the number of bytes written. The stored chunks are read with
+        incremental blob I/O, extract_buffer_size bytes at a time, so memory
+        use does not depend on the size of the attachment, and the SHA-256
+        digest of what is read is checked against the stored one before the
+        file is put in place. Since an sqlite connection cannot be shared
+        between threads, extract_attachments() passes one of its own in 'con'.
+        '''
+        if con is None:
+            con = self.con
+        import hashlib
+        row = con.execute("SELECT contents, sha256, filename FROM attachment WHERE attachmentId=?;",
+                [attachmentId]).fetchone()
+        if row is None:
+            self.error("there is no attachment with ID %d" % attachmentId)
+        (contents, sha256, filename) = row
+        def pieces():
+            if contents is not None: # not yet moved to the store (should not happen)
+                yield bytes(contents)
+                return
+            chunks = con.execute("SELECT chunkId, length(data) FROM attachment_chunk WHERE sha256=? ORDER BY seq;", [sha256]).fetchall()
+            for (chunkId, size) in chunks:
+                if hasattr(con, "blobopen"): # python 3.11 and later
+                    with con.blobopen("attachment_chunk", "data", chunkId) as blob:
+                        for piece in iter(lambda: blob.read(self.extract_buffer_size), b""):
+                            yield piece
+                else:
+                    for start in range(1, size + 1, self.extract_buffer_size):
+                        yield con.execute("SELECT substr(data, ?, ?) FROM attachment_chunk WHERE chunkId=?;",
+                                [start, self.extract_buffer_size, chunkId]).fetchone()[0]
+        digest = hashlib.sha256()
+        written = 0
+        partial = path + ".part"
+        try:
+            with open(partial, "wb") as f:
+                for piece in pieces():
+                    digest.update(piece)
+                    f.write(piece)
+                    written += len(piece)
+        except IOError:
+            self.error("cannot write attachment '%s' to '%s'" % (filename, path))
+        if sha256 is not None and digest.hexdigest() != sha256:
+            os.remove(partial)
+            self.error("attachment '%s' is damaged (its SHA-256 digest does not match the stored one)" % filename)
+        os.replace(partial, path)
+        self.fyi("extracted %d bytes of attachment '%s' to '%s'", written, filename, path)
+        return written
+
+
+    def extract_attachments(self, attachments, directory=".", jobs=4):
+        '''
+        Extract several attachments at once, using 'jobs' threads, each with a
+        connection of its own. The 'attachments' argument is a list of
+        (attachmentId, name) tuples, and each is written to the named file
+        within 'directory', which is created if need be. The return value is
+        the list of paths written, in the order of 'attachments'.
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        self.con.commit() # the other connections cannot read past a pending write
+        directory = os.path.expanduser(directory)
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            self.error("cannot create directory '%s' for attachments" % directory)
+        def extract(attachment):
+            path = os.path.join(directory, attachment[1])
+            con = sqlite.connect(self.db)
+            try:
+                self.extract_attachment(attachment[0], path, con=con)
+            finally:
+                con.close()
+            return path
+        if jobs <= 1 or len(attachments) <= 1:
+            return [extract(attachment) for attachment in attachments]
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(extract, attachments))
+
+
+    def store_blob(self, filename=None, contents=None):
+        '''
+        Put the contents of a file (or, if filename is None, the given bytes)
+        into the attachment store, and return their SHA-256 digest, which is
+        the key for the 'attachment' table. Contents already in the store are
+        not stored again. Files are read, and stored, in pieces of
+        attachment_chunk_size bytes, so memory use does not depend on their
+        size. The 'refcount' of the stored contents is maintained by triggers
+        on the 'attachment' table, and empty_trash() drops contents that are no
+        longer referred to.
+        '''
+        import hashlib
+        def pieces():
+            if filename is None:
+                for start in range(0, len(contents), self.attachment_chunk_size):
+                    yield contents[start:start + self.attachment_chunk_size]
+            else:
+                with open(filename, "rb") as f:
+                    for piece in iter(lambda: f.read(self.attachment_chunk_size), b""):
+                        yield piece
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            for piece in pieces():
+                digest.update(piece)
+                size += len(piece)
+        except IOError:
+            self.error("cannot read attachment '%s'" % filename)
+        sha256 = digest.hexdigest()
+        if self.cur.execute("SELECT sha256 FROM attachment_blob WHERE sha256=?;", [sha256]).fetchone():
+            self.fyi("    contents already stored, with sha256 %s", sha256)
+            return sha256
+        try:
+            self.cur.execute("INSERT INTO attachment_blob(sha256, size, refcount) VALUES (?, ?, 0);", [sha256, size])
+            check = hashlib.sha256()
+            for (seq, piece) in enumerate(pieces()):
+                check.update(piece)
+                self.cur.execute("INSERT INTO attachment_chunk(sha256, seq, data) VALUES (?, ?, ?);", [sha256, seq, piece])
+        except:
+            self.error("Problem storing attachment named '%s'" % filename)
+        if check.hexdigest() != sha256:
+            self.con.rollback()
+            self.error("attachment '%s' changed while being stored" % filename)
+        self.fyi("    stored %d bytes, with sha256 %s", size, sha256)
+        return sha256
 
     def interpret_time(self, due):
         # catch "tomorrow" and "Nhours", "Ndays", "Nweeks" (with N an integer)
@@ -1003,10 +1792,34 @@ class Nota:
                             due = (now + datetime.timedelta(weeks=4*int(test.group(1))), sperday*7)
                         else:
                             due = (None, None)
-        self.fyi("due '%s'; tolerance '%s'" % (due[0], due[1]))
+        self.fyi("due '%s'; tolerance '%s'", due[0], due[1])
         return due
 
 
+    def due_window(self, due):
+        '''
+        Return a tuple (start, end) of times, in seconds since the epoch, for
+        finding notes due at or after 'start' and before 'end', as described by
+        'due'. For "today" and "tomorrow", the window is that whole day. For the
+        other forms of 'due' understood by interpret_time(), such as "3 days",
+        it is from now until then. If 'due' is not understood, the tuple holds
+        None values.
+        '''
+        now = datetime.datetime.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if due == "today":
+            window = (midnight, midnight + datetime.timedelta(days=1))
+        elif due == "tomorrow":
+            window = (midnight + datetime.timedelta(days=1), midnight + datetime.timedelta(days=2))
+        else:
+            window = (now, self.interpret_time(due)[0])
+        if window[1] is None:
+            return (None, None)
+        window = tuple(int(time.mktime(t.timetuple())) for t in window)
+        self.fyi("due '%s' gives window %s", due, window)
+        return window
+
+
     def editor_entry(self, title, content, keywords, attachments, book=1, privacy=0, due=""):
         remaining = None
         books = self.list_books()
@@ -1050,6 +1863,7 @@ CONTENT...
         #exit(0)
         try:
             # FIXME: is this polluting filespace with tmp files?
+            import tempfile
             file = tempfile.NamedTemporaryFile(suffix=".tmp") #, delete=False)
         except:
             self.error('cannot create tempfile')
@@ -1092,18 +1906,18 @@ CONTENT...
         keywords = [key.lstrip().rstrip() for key in keywords.split(',')]
         if not title and not content and (len(keywords) == 1 and not keywords[0]):
             self.error("empty note, not stored. Please add title, keywords, or content.")
-        self.fyi("LATE keywords= %s" % keywords)
+        self.fyi("LATE keywords= %s", keywords)
         return {"title":title, "keywords":keywords, "content":content, "attachments":attachments,
                 "privacy":privacy, "book":book, "due":due}
 
 
     def rename_keyword(self, old, new):
-        # FIXME: hook this up to args
-        self.fyi("UPDATE keyword SET keyword=\"%s\" WHERE keyword=\"%s\";" % (new, old))
+        self.fyi("UPDATE keyword SET keyword=\"%s\" WHERE keyword=\"%s\";", new, old)
         try:
             self.cur.execute("UPDATE keyword SET keyword = ? WHERE keyword = ?;", (new, old))
         except:
             self.error("cannot change keyword from '%s' to '%s'" % (old, new))
+        self.keyword_index = None
         try:
             self.con.commit()
         except:
@@ -1111,28 +1925,58 @@ CONTENT...
 
 
     def age(self, d):
-        d = datetime.datetime.strptime(d, '%Y-%m-%d %H:%M:%S')
-        diff = datetime.datetime.now() - d
-        s = diff.seconds
-        if diff.days < 0:
-            return d.strftime('%b %d, %Y')
-        elif diff.days > 200:
-            return d.strftime('%b %d, %Y')
-        elif diff.days > 7*4:
-            return '{} months ago'.format(trunc(0.5+diff.days/28))
-        elif diff.days > 7*2:
-            return '{} weeks ago'.format(trunc(0.5+diff.days/7))
-        elif diff.days > 1 and diff.days < 14:
-            return '{} days ago'.format(trunc(diff.days))
-        elif s <= 1:
-            return 'just now'
-        elif s < 60:
-            return '{} seconds ago'.format(trunc(s))
-        elif s < 120:
-            return 'about a minute ago'
-        elif s < 3600:
-            return '{} minutes ago'.format(trunc(s/60))
-        elif s < 7200:
-            return 'about an hour ago'
-        else:
-            return '{} hours ago'.format(trunc(s/3600))
+        '''Describe the time since 'd', a date such as "2020-01-01 12:00:00", e.g. as "2 days ago".'''
+        return self.ages([d])[0]
+
+
+    def ages(self, dates, now=None, cache=None):
+        '''
+        Return a list of descriptions of the times since the given dates, as
+        age() does, all relative to 'now' (by default, the present time). The
+        dates are parsed by slicing out their fixed-width fields, which is
+        much faster than strptime(), and each distinct date is described only
+        once; 'cache' may be a dictionary kept between calls with the same
+        'now', e.g. for the batches of a long listing.
+        '''
+        if now is None:
+            now = datetime.datetime.now()
+        if cache is None:
+            cache = {}
+        rval = []
+        for date in dates:
+            label = cache.get(date)
+            if label is None:
+                try:
+                    d = datetime.datetime(int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                            int(date[11:13]), int(date[14:16]), int(date[17:19]))
+                    if len(date) != 19:
+                        raise ValueError
+                except (ValueError, TypeError):
+                    d = datetime.datetime.strptime(date, '%Y-%m-%d %H:%M:%S') # reports the problem
+                diff = now - d
+                s = diff.seconds
+                if diff.days < 0:
+                    label = d.strftime('%b %d, %Y')
+                elif diff.days > 200:
+                    label = d.strftime('%b %d, %Y')
+                elif diff.days > 7*4:
+                    label = '{} months ago'.format(trunc(0.5+diff.days/28))
+                elif diff.days > 7*2:
+                    label = '{} weeks ago'.format(trunc(0.5+diff.days/7))
+                elif diff.days > 1 and diff.days < 14:
+                    label = '{} days ago'.format(trunc(diff.days))
+                elif s <= 1:
+                    label = 'just now'
+                elif s < 60:
+                    label = '{} seconds ago'.format(trunc(s))
+                elif s < 120:
+                    label = 'about a minute ago'
+                elif s < 3600:
+                    label = '{} minutes ago'.format(trunc(s/60))
+                elif s < 7200:
+                    label = 'about an hour ago'
+                else:
+                    label = '{} hours ago'.format(trunc(s/3600))
+                cache[date] = label
+            rval.append(label)
+        return rval
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+import datetime
+import sys
+
+indent = "  "
+
+
+class PlainFormatter:
+    # Escape codes put around the parts of a note; see ColorFormatter.
+    hash_color = title_color = keyword_color = book_color = normal = ""
+
+    def __init__(self, age, hash_length=7, show_id=False):
+        '''
+
+        Format notes for listing, as text without colors. Each method returns
+        the complete text for one item, ending in a newline, so that a
+        Renderer can write it in one piece. The 'age' function turns the date
+        of a note into text such as '2 days ago' (see Nota.age()), for notes
+        that do not have that text already as their 'age', and 'hash_length'
+        is the number of characters of hash shown in summaries.
+
+        '''
+        self.age = age
+        self.hash_length = hash_length
+        self.show_id = show_id
+
+
+    def book(self, name):
+        '''The heading of the notes in the named book.'''
+        return self.book_color + "Book: %s" % name + self.normal + "\n"
+
+
+    def id(self, note):
+        return "(%s) " % note['noteId'] if self.show_id else ""
+
+
+    def due(self, due):
+        '''Describe a due date such as "2020-01-01 12:00:00.000000" relative to now.'''
+        due = datetime.datetime.strptime(due, '%Y-%m-%d %H:%M:%S.%f')
+        now = datetime.datetime.now()
+        when = abs(due - now).total_seconds()
+        if due > now:
+            if when < 2 * 3600:
+                return("(due in %d minutes)" % round(when / 60))
+            elif when < 86400:
+                return("(due in %d hours)" % round(when / 3600))
+            else:
+                return("(due in %d days)" % round(when / 3600 / 24))
+        else:
+            if when < 2 * 3600:
+                return("(overdue by %d minutes)" % (when / 60))
+            elif when < 86400:
+                return("(overdue by %d hours)" % (when / 3600))
+            else:
+                return("(overdue by %.1f days)" % (when / 3600 / 24))
+
+
+    def keywords(self, note):
+        return "[" + ", ".join(self.keyword_color + k + self.normal for k in note['keywords']) + "]"
+
+
+    def heading(self, note, hash_length):
+        return (indent + self.hash_color + note['hash'][0:hash_length] + " " + self.normal + self.id(note) +
+                self.title_color + "%s" % note['title'] + self.normal + " " + self.keywords(note) +
+                " %s " % (note['age'] if 'age' in note else self.age(note['date'])))
+
+
+    def summary(self, note):
+        '''One line for a note in a listing of several notes.'''
+        return self.heading(note, self.hash_length) + "\n"
+
+
+    def trashed(self, note):
+        '''One line for a note in a listing of the trash.'''
+        return (self.hash_color + "%s: " % note['hash'][0:self.hash_length] + self.normal + self.id(note) +
+                self.title_color + "%s" % note['title'] + self.normal + " " + self.keywords(note) + "\n")
+
+
+    def found(self, note):
+        '''A note found by a search, and the 'snippet' of its text that matched.'''
+        return (indent + self.hash_color + note['hash'][0:self.hash_length] + " " + self.normal + self.id(note) +
+                self.title_color + "%s" % note['title'] + self.normal + " " + self.keywords(note) + "\n" +
+                indent + indent + " ".join(note['snippet'].split()) + "\n")
+
+
+    def full(self, note, heading=True):
+        '''A note shown in full, with its heading line unless 'heading' is False.'''
+        lines = []
+        if heading:
+            try:
+                due = self.due(note['due']) if note['due'] else ""
+            except:
+                due = ""
+            lines.append(self.heading(note, 7) + due + "\n")
+        for line in note['content'].replace('\\n', '\n').split('\n'):
+            lines.append("  " + line + "\n")
+        return "".join(lines)
+
+
+class ColorFormatter(PlainFormatter):
+    def __init__(self, colors, age, hash_length=7, show_id=False):
+        '''
+        Format notes as PlainFormatter does, using the escape codes given by
+        the 'hash', 'title', 'keyword', 'book' and 'normal' attributes of
+        'colors'.
+        '''
+        PlainFormatter.__init__(self, age, hash_length, show_id)
+        self.hash_color = colors.hash
+        self.title_color = colors.title
+        self.keyword_color = colors.keyword
+        self.book_color = colors.book
+        self.normal = colors.normal
+
+
+class MarkdownFormatter(PlainFormatter):
+    '''Format notes as markdown, each as a block of lines.'''
+
+    def book(self, name):
+        return "Book: %s\n\n" % name
+
+
+    def summary(self, note):
+        return ("%s\n" % note['hash'][0:self.hash_length] + self.id(note) + "%s\n\n" % note['title'] +
+                "[" + ", ".join("*%s*" % k for k in note['keywords']) + "]\n\n")
+
+
+    def trashed(self, note):
+        return self.summary(note)
+
+
+    def found(self, note):
+        return self.summary(note) + " ".join(note['snippet'].split()) + "\n\n"
+
+
+    def full(self, note, heading=True):
+        lines = ["Hash: `%s`\n\n" % note['hash'][0:7] + self.id(note) + "%s\n\n" % note['title'] +
+                "Keywords: " + ", ".join(note['keywords']) + "\n\n" +
+                "Created: %s " % note['date'] + (self.due(note['due']) if note['due'] else "") + "\n\n"]
+        for line in note['content'].replace('\\n', '\n').split('\n'):
+            lines.append(line + "\n")
+        lines.append("\n")
+        return "".join(lines)
+
+
+class Renderer:
+    def __init__(self, formatter, stream=None, buffer_size=64 * 1024):
+        '''
+
+        Write a listing of notes, formatted by 'formatter' (a PlainFormatter,
+        ColorFormatter or MarkdownFormatter), to 'stream' (by default,
+        sys.stdout). Text is collected until about 'buffer_size' characters
+        are waiting, and then written at once, so that a long listing takes
+        a few large writes to a pipe or pager, not many small ones. Call
+        flush() before writing to the stream in any other way.
+
+        '''
+        self.formatter = formatter
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.npending = 0
+
+
+    def write(self, text):
+        self.pending.append(text)
+        self.npending += len(text)
+        if self.npending >= self.buffer_size:
+            self.flush()
+
+
+    def book(self, name):
+        self.write(self.formatter.book(name))
+
+
+    def summary(self, note):
+        self.write(self.formatter.summary(note))
+
+
+    def trashed(self, note):
+        self.write(self.formatter.trashed(note))
+
+
+    def found(self, note):
+        self.write(self.formatter.found(note))
+
+
+    def full(self, note, heading=True):
+        self.write(self.formatter.full(note, heading))
+
+
+    def flush(self):
+        stream = self.stream or sys.stdout
+        if self.pending:
+            stream.write("".join(self.pending))
+            self.pending = []
+            self.npending = 0
+        stream.flush()
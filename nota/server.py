@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+from .notaclass import NotaError
+from .sockets import socket_path, owned
+
+
+class NotaServer(socketserver.UnixStreamServer):
+    # The Nota methods that clients may call. Only methods that read the
+    # database, taking values rather than SQL as their arguments, and that
+    # neither interact with the terminal nor depend on the working directory
+    # are included; anything else is done by the client itself.
+    exported = ["books_of", "book_index", "book_name", "book_number", "count", "due_window", "find_by_hash",
+            "find_by_id", "find_by_keyword", "find_notes", "find_recent", "get_attachment_filename", "get_attachment_list",
+            "get_keywords", "get_metadata", "list_books", "list_keywords", "search", "trash_length", "version"]
+
+    def __init__(self, nota, path=None):
+        '''
+
+        A server that answers requests for a Nota object over a Unix-domain
+        socket, so that its connection, keyword index and SQLite cache stay
+        warm between invocations of 'nota'. Each request is a line holding a
+        JSON-RPC 2.0 object, naming one of the methods in NotaServer.exported
+        and giving its arguments by name, sent on a connection of its own, and
+        is answered with a line holding the result, or an error. Requests are
+        handled one at a time, since the Nota object has just one connection.
+
+        '''
+        self.nota = nota
+        self.nota.cur.execute("PRAGMA query_only = ON;") # the server never writes, whatever it is asked
+        self.path = path or socket_path(nota.db)
+        self.data_version = None
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            try:
+                os.mkdir(directory, 0o700)
+            except OSError:
+                nota.error("cannot create directory '%s' for the socket" % directory)
+        if not owned(directory, stat.S_ISDIR, private=True):
+            nota.error("the directory '%s' for the socket must belong to you, with no permissions for others" % directory)
+        if os.path.exists(self.path):
+            try:
+                probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                probe.connect(self.path)
+                probe.close()
+                nota.error("a server is already running for database '%s', on socket '%s'" % (nota.db, self.path))
+            except ConnectionRefusedError:
+                os.remove(self.path) # left by a server that did not shut down cleanly
+        umask = os.umask(0o077) # so that only this user can connect
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.path, NotaRequestHandler)
+        finally:
+            os.umask(umask)
+
+
+    def call(self, method, params):
+        '''
+        Call a Nota method, returning a JSON-RPC 2.0 result or error object.
+        Nota reports errors by printing a message and raising NotaError, so
+        the message is captured and returned as the error. Any other
+        SystemExit, e.g. from the handler of SIGTERM, stops the server.
+        '''
+        if method not in self.exported:
+            return {"error": {"code": -32601, "message": "Error: nota --serve does not provide '%s'\n" % method}}
+        self.check_data_version()
+        stderr = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(stderr):
+                result = getattr(self.nota, method)(**params)
+        except NotaError as e:
+            self.nota.con.rollback()
+            return {"error": {"code": 1, "message": stderr.getvalue(), "data": e.code}}
+        except Exception as e:
+            self.nota.con.rollback()
+            return {"error": {"code": -32603, "message": "Error: %s\n" % e}}
+        return {"result": result}
+
+
+    def check_data_version(self):
+        '''
+        Forget cached information if another connection has changed the
+        database since the last request, as reported by SQLite's data_version.
+        '''
+        data_version = self.nota.cur.execute("PRAGMA data_version;").fetchone()[0]
+        if data_version != self.data_version:
+            self.nota.fyi("database changed by another connection, so dropping cached keyword index")
+            self.nota.keyword_index = None
+            self.data_version = data_version
+
+
+    def serve(self):
+        '''Serve requests until interrupted, then remove the socket.'''
+        self.check_data_version()
+        self.nota.get_keyword_index() # so the first request need not build it
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class NotaRequestHandler(socketserver.StreamRequestHandler):
+    # Each connection carries a single request, so that a client that keeps
+    # its connection open cannot hold up the others, nor can one that does
+    # not send its request in time.
+    timeout = 5
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except OSError:
+            return
+        if not line:
+            return # a client checking that the server is running
+        try:
+            request = json.loads(line)
+            response = self.server.call(request["method"], request.get("params", {}))
+            response["id"] = request.get("id")
+        except (ValueError, KeyError, TypeError):
+            response = {"error": {"code": -32700, "message": "Error: cannot parse request\n"}, "id": None}
+        response["jsonrpc"] = "2.0"
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        self.wfile.flush()
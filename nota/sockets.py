@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+# Where 'nota --serve' puts its sockets, and how clients check them. These
+# are kept apart from nota/server.py, so that clients need not import it.
+
+import os
+import stat
+
+
+def socket_dir():
+    '''
+    Return the directory holding the sockets used by 'nota --serve', which
+    must be private to the user: $XDG_RUNTIME_DIR, if set, or else a
+    directory named for the user in $TMPDIR, or /tmp, as
+    tempfile.gettempdir() would give on the systems that have Unix-domain
+    sockets (tempfile is slow to import).
+    '''
+    return os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.environ.get("TMPDIR") or "/tmp", "nota-%d" % os.getuid())
+
+
+def socket_path(db):
+    '''
+    Return the name of the socket used by 'nota --serve' for the database
+    named 'db'. The name depends on the full path of the database, so that
+    clients find the server for their own database.
+    '''
+    import hashlib # only needed if a server may be used
+    db = os.path.abspath(os.path.expanduser(db))
+    return os.path.join(socket_dir(), "nota-%s.sock" % hashlib.sha1(db.encode("utf-8")).hexdigest()[0:12])
+
+
+def owned(path, kind, private=False):
+    '''
+    Return whether 'path' is of the kind tested by 'kind' (e.g. stat.S_ISDIR)
+    and belongs to this user, and, if 'private' is true, whether other users
+    have no permissions for it.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return kind(st.st_mode) and st.st_uid == os.getuid() and not (private and st.st_mode & 0o077)
+
+
+def trusted_socket(path):
+    '''
+    Return whether 'path' is a socket of this user's, in a directory private
+    to this user, so that no one else can be listening on it. Clients send
+    the contents of notes over the socket, so they check this before use.
+    '''
+    return owned(os.path.dirname(path), stat.S_ISDIR, private=True) and owned(path, stat.S_ISSOCK)
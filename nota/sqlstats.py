@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+import sqlite3 as sqlite
+import sys
+import time
+
+
+class SqlStats:
+    def __init__(self, slow=0.1):
+        '''
+
+        Counts and timings of the SQL statements run on a connection, for
+        finding slow queries, and loops that run one query per note. Use
+        attach() to start collecting them for a connection. SQLite reports
+        every statement it runs, including those run by triggers, and these
+        are counted in 'count'. The statements run with the cursor made by
+        cursor() are also timed, from the start of execute() to the end of
+        the last fetch of its rows, whether by fetchone() and the like or by
+        iterating over the cursor, and recorded in 'statements', a
+        dictionary of [calls, seconds] keyed by the text of the statement.
+        Statements run in other ways, e.g. with the execute() method of the
+        connection itself, are counted but not timed.
+        For any statement that takes longer than 'slow' seconds, the query
+        plan is looked up and kept in 'slow_statements'.
+
+        '''
+        self.slow = slow
+        self.count = 0
+        self.time = 0.0
+        self.statements = {}
+        self.slow_statements = [] # [seconds, sql, query plan rows]
+        self.explaining = False
+
+
+    def attach(self, con):
+        '''Count the statements run on connection 'con'.'''
+        con.set_trace_callback(self.trace)
+
+
+    def trace(self, sql):
+        if not self.explaining:
+            self.count += 1
+
+
+    def cursor(self, con):
+        '''Return a cursor for 'con' that times the statements run with it.'''
+        stats = self
+        class TimedCursor(sqlite.Cursor):
+            def execute(self, sql, params=()):
+                self.timing = [sql, params, 0.0, True, None]
+                return self.timed(sqlite.Cursor.execute, sql, params)
+            def executemany(self, sql, params):
+                self.timing = [sql, None, 0.0, True, None]
+                return self.timed(sqlite.Cursor.executemany, sql, params)
+            def fetchone(self):
+                return self.timed(sqlite.Cursor.fetchone)
+            def fetchmany(self, *args):
+                return self.timed(sqlite.Cursor.fetchmany, *args)
+            def fetchall(self):
+                return self.timed(sqlite.Cursor.fetchall)
+            def __next__(self):
+                return self.timed(sqlite.Cursor.__next__)
+            def timed(self, method, *args):
+                start = time.perf_counter()
+                try:
+                    return method(self, *args)
+                finally:
+                    if hasattr(self, "timing"):
+                        stats.record(self.connection, self.timing, time.perf_counter() - start)
+        return con.cursor(factory=TimedCursor)
+
+
+    def record(self, con, timing, seconds):
+        '''
+        Add 'seconds' to the time taken by a statement, whose 'timing' is a
+        list holding its text, its parameters (None for executemany()), the
+        time taken so far, whether it has yet to be counted, and its entry in
+        slow_statements, if it has one.
+        '''
+        (sql, params, elapsed, first, slow) = timing
+        entry = self.statements.setdefault(sql, [0, 0.0])
+        if first:
+            entry[0] += 1
+            timing[3] = False
+        entry[1] += seconds
+        self.time += seconds
+        timing[2] = elapsed + seconds
+        if slow is not None:
+            slow[0] = timing[2]
+        elif timing[2] > self.slow and params is not None:
+            timing[4] = [timing[2], sql, self.explain(con, sql, params)]
+            self.slow_statements.append(timing[4])
+
+
+    def explain(self, con, sql, params):
+        '''Return the rows of EXPLAIN QUERY PLAN for a statement, or [] if it cannot be explained.'''
+        self.explaining = True
+        try:
+            return con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        except sqlite.Error:
+            return []
+        finally:
+            self.explaining = False
+
+
+    def report(self, file=None, top=10):
+        '''Print a summary, listing the 'top' statements that took longest in all.'''
+        file = file or sys.stderr
+        def shorten(sql, width=90):
+            sql = " ".join(sql.split())
+            return sql if len(sql) <= width else sql[0:width - 3] + "..."
+        print("SQL: %d statements run (including those run by triggers), %d timed, taking %.3f ms in all"
+                % (self.count, sum(s[0] for s in self.statements.values()), 1000 * self.time), file=file)
+        if self.statements:
+            print("  %8s %12s %10s  %s" % ("calls", "total ms", "mean ms", "statement"), file=file)
+            for (sql, (calls, seconds)) in sorted(self.statements.items(), key=lambda s: -s[1][1])[0:top]:
+                print("  %8d %12.3f %10.3f  %s" % (calls, 1000 * seconds, 1000 * seconds / calls, shorten(sql)), file=file)
+        for (seconds, sql, plan) in self.slow_statements:
+            print("Slow statement (%.3f ms): %s" % (1000 * seconds, shorten(sql, 200)), file=file)
+            for row in plan:
+                print("    %s" % row[-1], file=file)
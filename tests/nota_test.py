@@ -1,7 +1,18 @@
 import unittest
 import tempfile
 import logging
+import sqlite3
 from nota.notaclass import Nota
+from nota.server import NotaServer
+from nota.sockets import trusted_socket
+from nota.client import NotaClient
+from nota.main import argument_parser, fast_args
+from nota.renderer import Renderer, PlainFormatter, MarkdownFormatter
+import io
+from nota.sqlstats import SqlStats
+import threading
+import socket
+import subprocess
 import os, sys
 
 logger = logging.getLogger()
@@ -28,6 +39,8 @@ class TestNota(unittest.TestCase):
         self.nota.delete(hash=hash0)
         self.assertEqual(1, len(self.nota.find_by_hash(hash=None)))
         self.assertEqual(1, len(self.nota.find_by_hash(hash=None, book=1)))
+        self.assertEqual(1, len(self.nota.find_by_hash(hash=hash0[0:5], book=0)))
+        self.assertEqual(0, len(self.nota.find_by_hash(hash=hash0[0:5])))
 
 
     def test_books(self):
@@ -68,6 +81,458 @@ class TestNota(unittest.TestCase):
         self.assertEqual(keywords[1], "foo")
         self.assertEqual(keywords[2], "test")
 
+    def test_query_count(self):
+        # Listing notes must cost a fixed number of queries, however many notes match.
+        def count_queries(nnotes):
+            for i in range(nnotes):
+                self.nota.add(title="note %d" % i, keywords=["test", "k%d" % i], content="")
+            self.nota.get_keyword_index() # built once, on first use
+            statements = []
+            self.nota.con.set_trace_callback(statements.append)
+            found = self.nota.find_by_hash(hash=None)
+            found.extend(self.nota.find_by_keyword(keywords=["test"], strict_match=True))
+            found.extend(self.nota.find_recent(nrecent=nnotes))
+            self.nota.con.set_trace_callback(None)
+            return len(statements)
+        few = count_queries(2)
+        many = count_queries(50)
+        self.assertEqual(few, many)
+        notes = self.nota.find_by_hash(hash=None)
+        self.assertEqual(52, len(notes))
+        self.assertEqual(["test", "k0"], notes[0]["keywords"])
+
+    def test_hash_abbreviation_length(self):
+        self.assertEqual(1, self.nota.hash_abbreviation_length())
+        for i in range(100):
+            self.nota.add(title="note %d" % i, keywords=[], content="")
+        hashes = [n["hash"] for n in self.nota.find_by_hash(hash=None)]
+        nc = self.nota.hash_abbreviation_length()
+        self.assertEqual(len(hashes), len(set(h[0:nc] for h in hashes)))
+        self.assertGreater(len(hashes), len(set(h[0:nc-1] for h in hashes)))
+        self.assertEqual(nc, self.nota.compute_hash_abbreviation_length())
+
+    def test_search(self):
+        self.nota.add(title="shopping", keywords=["list"], content="buy apples and pears")
+        self.nota.add(title="meeting", keywords=["work"], content="discussed the apple-pie budget")
+        self.assertEqual(["meeting"], [n["title"] for n in self.nota.search("apple")])
+        self.assertEqual(2, len(self.nota.search("apple*")))
+        self.assertEqual(1, len(self.nota.search("apple-pie")))
+        self.assertIn("[pears]", self.nota.search("pears", markers=("[", "]"))[0]["snippet"])
+        self.nota.delete(hash=self.nota.search("shopping")[0]["hash"])
+        self.assertEqual(0, len(self.nota.search("pears")))
+        self.assertEqual(1, len(self.nota.search("pears", book=0)))
+        self.nota.empty_trash()
+        self.assertEqual(0, len(self.nota.search("pears", book=0)))
+
+    def test_keyword_matching(self):
+        self.nota.add(title="a", keywords=["Python", "physics"], content="")
+        self.nota.add(title="b", keywords=["python3", "oceanography"], content="")
+        self.assertEqual(2, len(self.nota.find_by_keyword(keywords=["pyth"])))
+        self.assertEqual(1, len(self.nota.find_by_keyword(keywords=["Python"], strict_match=True)))
+        self.assertEqual(["b"], [n["title"] for n in self.nota.find_by_keyword(keywords=["oceanografy"])])
+        self.assertEqual(0, len(self.nota.find_by_keyword(keywords=["zzz"])))
+        self.nota.add(title="c", keywords=["zzz"], content="")
+        self.assertEqual(["c"], [n["title"] for n in self.nota.find_by_keyword(keywords=["zzz"])])
+
+    def test_keyword_queries(self):
+        self.nota.add(title="a", keywords=["red", "green"], content="")
+        self.nota.add(title="b", keywords=["red", "blue"], content="")
+        self.nota.add(title="c", keywords=["blue"], content="")
+        def titles(keywords):
+            return sorted(n["title"] for n in self.nota.find_by_keyword(keywords=keywords, strict_match=True))
+        self.assertEqual(["a", "b"], titles(["red"]))
+        self.assertEqual(["b"], titles(["red", "blue"]))
+        self.assertEqual(["a", "b", "c"], titles(["green|blue"]))
+        self.assertEqual(["a"], titles(["red", "!blue"]))
+        self.assertEqual(["c"], titles(["!red"]))
+        self.assertEqual([], titles(["red", "missing"]))
+        self.assertEqual(["b"], titles("red,blue"))
+        self.nota.delete(hash=self.nota.find_by_keyword(keywords=["green"])[0]["hash"])
+        self.assertEqual(["b"], titles(["red"]))
+        # Without strict_match, excluded keywords are matched exactly, though not by case.
+        self.nota.add(title="d", keywords=["notes"], content="")
+        self.nota.add(title="e", keywords=["Note"], content="")
+        def loose(keywords):
+            return sorted(n["title"] for n in self.nota.find_by_keyword(keywords=keywords))
+        self.assertEqual(["d", "e"], loose(["note"])) # a prefix of 'notes'
+        self.assertEqual(["b", "c", "d"], loose(["!note"]))
+
+    def test_cascade(self):
+        noteId = self.nota.add(title="foo", keywords=["test", "foo"], content="")
+        self.nota.add(title="bar", keywords=["test", "bar"], content="")
+        self.nota.cur.execute("DELETE FROM note WHERE noteId = ?;", [noteId])
+        self.assertEqual(2, self.nota.cur.execute("SELECT count(*) FROM notekeyword;").fetchone()[0])
+
+    def make_old_database(self, version):
+        '''Make a database with the tables of nota 0.8.12, which had no attachment tables, marked as at 'version'.'''
+        name = self.database.name + ".old"
+        con = sqlite3.connect(name)
+        if len(version) == 2:
+            con.execute("CREATE TABLE version(major, minor);")
+        else:
+            con.execute("CREATE TABLE version(major, middle, minor);")
+        con.execute("INSERT INTO version VALUES (%s);" % ", ".join("?" * len(version)), version)
+        con.execute("CREATE TABLE note(noteId integer primary key autoincrement, authorId, date, modified, due, title, content, hash, privacy DEFAULT 0, book DEFAULT 1);")
+        con.execute("CREATE TABLE author(authorId integer primary key autoincrement, name, nickname);")
+        con.execute("CREATE TABLE alias(aliasId integer primary key autoincrement, item, alias);")
+        con.execute("CREATE TABLE keyword(keywordId integer primary key autoincrement, keyword);")
+        con.execute("CREATE TABLE notekeyword(notekeywordId integer primary key autoincrement, noteid, keywordid);")
+        con.execute("CREATE TABLE book(bookId integer primary key autoincrement, number, name DEFAULT '');")
+        con.execute("INSERT INTO book(number, name) VALUES (0, 'Trash'), (1, 'Default');")
+        con.execute("INSERT INTO note(authorId, date, modified, due, title, content, hash) " +
+                "VALUES (1, '2020-01-01 00:00:00', '2020-01-01 00:00:00', '', 'old note', 'old content', 'abc123');")
+        con.execute("INSERT INTO keyword(keyword) VALUES ('old');")
+        con.execute("INSERT INTO notekeyword(noteid, keywordid) VALUES (1, 1);")
+        con.commit()
+        return (name, con)
+
+    def test_update_baseline(self):
+        # Also left as an update that failed at version 0.12.x used to leave it.
+        (name, con) = self.make_old_database([0, 8])
+        con.execute("CREATE VIRTUAL TABLE note_fts USING fts5(title, content, content='note', content_rowid='noteId');")
+        con.execute("CREATE TABLE notekeyword_new(notekeywordId integer primary key autoincrement, noteid, keywordid);")
+        con.commit()
+        con.close()
+        try:
+            nota = Nota(db=name, quiet=True)
+            self.assertEqual(tuple(nota.appversion), tuple(nota.cur.execute("SELECT * FROM version;").fetchone()))
+            notes = nota.find_by_keyword(keywords=["old"], strict_match=True)
+            self.assertEqual(["old note"], [n["title"] for n in notes])
+            self.assertEqual(["old"], notes[0]["keywords"])
+            self.assertEqual(1, len(nota.search("content")))
+            self.assertEqual(0, nota.cur.execute("SELECT count(*) FROM attachment;").fetchone()[0])
+            nota.con.close()
+            Nota(db=name, quiet=True).con.close() # opens again, with nothing to update
+        finally:
+            os.remove(name)
+
+    def test_update_attachments(self):
+        (name, con) = self.make_old_database([0, 12, 0])
+        con.close()
+        try:
+            nota = Nota(db=name, quiet=True)
+            self.assertEqual(tuple(nota.appversion), tuple(nota.cur.execute("SELECT * FROM version;").fetchone()))
+            self.assertEqual(0, nota.cur.execute("SELECT count(*) FROM attachment;").fetchone()[0])
+            self.assertEqual(["old"], nota.find_by_hash(hash="abc")[0]["keywords"])
+            nota.con.close()
+        finally:
+            os.remove(name)
+
+    def test_empty_trash(self):
+        for i in range(5):
+            self.nota.add(title="note %d" % i, keywords=["test"], content="x" * 10000)
+        keep = self.nota.add(title="keep", keywords=["test"], content="")
+        for note in self.nota.find_by_hash(hash=None):
+            if note["noteId"] != keep:
+                self.nota.delete(note["hash"])
+        self.nota.quiet = True
+        (deleted, freed) = self.nota.empty_trash(chunk=2, vacuum=True)
+        self.assertEqual(5, deleted)
+        self.assertGreater(freed, 40000)
+        self.assertEqual(0, len(self.nota.find_by_hash(hash=None, book=0)))
+        self.assertEqual(1, self.nota.cur.execute("SELECT count(*) FROM notekeyword;").fetchone()[0])
+        self.assertEqual(1, len(self.nota.find_by_keyword(keywords=["test"])))
+
+    def test_bulk_add(self):
+        self.nota.add(title="first", keywords=["old"], content="")
+        notes = ({"title": "note %d" % i, "keywords": ["bulk", "old"], "content": "",
+            "date": "2020-01-01 00:00:00", "due": ""} for i in range(25))
+        self.assertEqual(25, self.nota.bulk_add(notes, batch=10))
+        self.assertEqual(26, len(self.nota.find_by_keyword(keywords=["old"], strict_match=True)))
+        self.assertEqual(25, len(self.nota.find_by_keyword(keywords=["bulk"])))
+        self.assertEqual(["bulk", "old"], self.nota.list_keywords())
+        hashes = [n["hash"] for n in self.nota.find_by_hash(hash=None)]
+        nc = self.nota.hash_abbreviation_length()
+        self.assertEqual(len(hashes), len(set(h[0:nc] for h in hashes)))
+
+    def test_iter_by_hash(self):
+        for i in range(10):
+            self.nota.add(title="note %d" % i, keywords=["test"], content="")
+        self.assertEqual(self.nota.find_by_hash(hash=None), list(self.nota.iter_by_hash(batch=3)))
+        self.assertEqual(10, len(list(self.nota.iter_by_hash(batch=5))))
+
+    def test_attachments(self):
+        attachment = tempfile.NamedTemporaryFile(prefix="nota", delete=False)
+        attachment.write(b"0123456789" * 10)
+        attachment.close()
+        self.nota.attachment_chunk_size = 32
+        first = self.nota.add(title="first", keywords=["test"], content="", attachments=[attachment.name])
+        self.nota.add(title="second", keywords=["test"], content="", attachments=attachment.name)
+        os.remove(attachment.name)
+        self.assertEqual(1, self.nota.cur.execute("SELECT count(*) FROM attachment_blob;").fetchone()[0])
+        self.assertEqual(4, self.nota.cur.execute("SELECT count(*) FROM attachment_chunk;").fetchone()[0])
+        attachmentId = self.nota.get_attachment_list(first)[0][0]
+        self.assertEqual((b"0123456789" * 10,), self.nota.get_attachment_contents(attachmentId))
+        self.nota.quiet = True
+        self.nota.delete(self.nota.find_by_hash(hash=None)[0]["hash"])
+        self.nota.empty_trash()
+        self.assertEqual(1, self.nota.cur.execute("SELECT refcount FROM attachment_blob;").fetchone()[0])
+        self.nota.delete(self.nota.find_by_hash(hash=None)[0]["hash"])
+        self.nota.empty_trash()
+        self.assertEqual(0, self.nota.cur.execute("SELECT count(*) FROM attachment_chunk;").fetchone()[0])
+
+    def test_extract_attachments(self):
+        attachment = tempfile.NamedTemporaryFile(prefix="nota", delete=False)
+        attachment.write(bytes(range(256)) * 10)
+        attachment.close()
+        self.nota.attachment_chunk_size = 1000
+        self.nota.extract_buffer_size = 64
+        noteId = self.nota.add(title="foo", keywords=["test"], content="", attachments=[attachment.name])
+        os.remove(attachment.name)
+        directory = tempfile.mkdtemp(prefix="nota")
+        attachmentId = self.nota.get_attachment_list(noteId)[0][0]
+        paths = self.nota.extract_attachments([(attachmentId, "a"), (attachmentId, "b")], directory, jobs=2)
+        for path in paths:
+            with open(path, "rb") as f:
+                self.assertEqual(bytes(range(256)) * 10, f.read())
+            os.remove(path)
+        self.nota.cur.execute("UPDATE attachment_chunk SET data = zeroblob(1000) WHERE seq = 1;")
+        self.nota.quiet = True
+        with self.assertRaises(SystemExit):
+            self.nota.extract_attachment(attachmentId, os.path.join(directory, "c"))
+        self.assertEqual([], os.listdir(directory))
+        os.rmdir(directory)
+
+    def test_profiles(self):
+        self.nota.con.close()
+        self.nota = Nota(db=self.database.name, debug=self.debug, profile="wal")
+        self.assertEqual("wal", self.nota.cur.execute("PRAGMA journal_mode;").fetchone()[0])
+        self.assertEqual(2, self.nota.cur.execute("PRAGMA temp_store;").fetchone()[0])
+        self.nota.apply_profile({"journal_mode": "DELETE"})
+        self.assertEqual("delete", self.nota.cur.execute("PRAGMA journal_mode;").fetchone()[0])
+        self.nota.quiet = True
+        with self.assertRaises(SystemExit):
+            self.nota.apply_profile("nonexistent")
+        with self.assertRaises(SystemExit):
+            self.nota.apply_profile({"cache_size": "1; DROP TABLE note"})
+
+    def test_keyword_cache(self):
+        noteId = self.nota.add(title="foo", keywords=["b", "a"], content="")
+        self.nota.add(title="bar", keywords=["a"], content="")
+        self.assertEqual(["b", "a"], self.nota.get_keywords(noteId))
+        self.nota.keyword_hookup(noteId, ["c", "b"])
+        self.nota.rename_keyword("b", "d")
+        self.assertEqual(["c", "d"], self.nota.find_by_hash(hash=None)[0]["keywords"])
+        self.assertEqual(["a"], self.nota.find_by_hash(hash=None)[1]["keywords"])
+        self.assertEqual(0, self.nota.rebuild_keyword_cache())
+        self.nota.cur.execute("UPDATE note SET keywords = '[]';")
+        self.assertEqual(2, self.nota.rebuild_keyword_cache())
+        self.assertEqual(["c", "d"], self.nota.get_keywords(noteId))
+        # The command renames keywords in the cached column too.
+        subprocess.run([sys.executable, "-m", "nota", "--database", self.database.name, "--local",
+            "--rename-keyword", "a", "e"], stdout=subprocess.DEVNULL, check=True)
+        self.assertEqual(["e"], self.nota.find_by_hash(hash=None)[1]["keywords"])
+
+    def test_fields(self):
+        self.nota.add(title="foo", keywords=["test"], content="long content")
+        self.assertEqual([{"noteId": 1, "title": "foo", "keywords": ["test"]}],
+                self.nota.find_by_keyword(keywords=["test"], fields=["title", "keywords"]))
+        self.assertEqual([{"noteId": 1}], self.nota.find_by_hash(hash=None, fields=[]))
+        self.nota.quiet = True
+        with self.assertRaises(SystemExit):
+            self.nota.find_recent(fields=["title", "nonexistent"])
+
+    def test_pagination(self):
+        for i in range(10):
+            self.nota.add(title="note %d" % i, keywords=["test", "even" if i % 2 == 0 else "odd"], content="")
+        first = self.nota.find_by_hash(hash=None, limit=4)
+        second = self.nota.find_by_hash(hash=None, limit=4, after=first[-1]["noteId"])
+        self.assertEqual(["note 4", "note 5", "note 6", "note 7"], [n["title"] for n in second])
+        evens = self.nota.find_by_keyword(keywords=["even"], limit=2, after=first[-1]["noteId"])
+        self.assertEqual(["note 4", "note 6"], [n["title"] for n in evens])
+        recent = self.nota.find_recent(nrecent=3, fields=["date"])
+        older = self.nota.find_recent(nrecent=3, after=(recent[-1]["date"], recent[-1]["noteId"]))
+        self.assertEqual(6, len(set(n["noteId"] for n in recent + older)))
+        (where, params) = self.nota.note_condition(keywords="odd")
+        self.assertEqual(5, len(list(self.nota.iter_notes(where, params, batch=2))))
+        exported = 0
+        for n in self.nota.iter_by_hash(batch=3):
+            del n["noteId"] # as 'nota --export' does
+            exported += 1
+        self.assertEqual(10, exported)
+        self.assertEqual([1], self.nota.books_of(keywords="odd"))
+        self.assertEqual(3, len(list(self.nota.iter_found(keywords="odd", batch=2, after=first[-1]["noteId"]))))
+
+    def test_due(self):
+        self.nota.add(title="soon", keywords=["test"], content="", due="2 hours")
+        self.nota.add(title="later", keywords=["test"], content="", due="2 weeks")
+        self.nota.add(title="never", keywords=["test"], content="")
+        self.assertEqual(2, self.nota.cur.execute("SELECT count(due_epoch) FROM note;").fetchone()[0])
+        (where, params) = self.nota.note_condition(due_between=self.nota.due_window("1 day"))
+        self.assertEqual(["soon"], [n["title"] for n in self.nota.hydrate_notes(where, params)])
+        (where, params) = self.nota.note_condition(keywords="test", due_between=self.nota.due_window("3 weeks"))
+        self.assertEqual(["soon", "later"], [n["title"] for n in self.nota.hydrate_notes(where, params)])
+        self.nota.cur.execute("UPDATE note SET due = NULL WHERE title = 'soon';")
+        self.assertEqual(["later"], [n["title"] for n in self.nota.find_recent(due_between=self.nota.due_window("3 weeks"))])
+        self.assertEqual((None, None), self.nota.due_window("whenever"))
+
+    def test_count(self):
+        for i in range(6):
+            self.nota.add(title="note %d" % i, keywords=["test", "even" if i % 2 == 0 else "odd"], content="")
+        self.nota.delete(self.nota.find_by_keyword(keywords="odd")[0]["hash"])
+        self.assertEqual((5, 1), self.nota.count())
+        self.assertEqual((2, 1), self.nota.count(keywords="odd"))
+        self.assertEqual((1, 1), self.nota.count(book=0))
+        self.assertEqual((0, 0), self.nota.count(keywords="even,!test"))
+        statements = []
+        self.nota.get_keyword_index()
+        self.nota.con.set_trace_callback(statements.append)
+        self.nota.count(keywords="test")
+        self.nota.con.set_trace_callback(None)
+        self.assertEqual(1, len(statements))
+
+    def test_server(self):
+        self.nota.add(title="foo", keywords=["test"], content="")
+        ready = threading.Event()
+        servers = []
+        def serve():
+            servers.append(NotaServer(Nota(db=self.database.name, quiet=True)))
+            ready.set()
+            try:
+                servers[0].serve()
+            except SystemExit:
+                pass
+        thread = threading.Thread(target=serve)
+        thread.start()
+        ready.wait()
+        try:
+            client = NotaClient(db=self.database.name, quiet=True)
+            self.assertTrue(client.connect())
+            self.assertEqual(["foo"], [n["title"] for n in client.find_by_keyword(["test"], strict_match=True)])
+            self.assertEqual([1, 0], client.count(keywords="test"))
+            # A change made elsewhere is seen, although the server has its keywords cached.
+            self.nota.add(title="bar", keywords=["new"], content="")
+            self.assertEqual(["bar"], [n["title"] for n in client.find_by_keyword("new", strict_match=True)])
+            self.assertEqual(2, len(list(client.iter_by_hash(batch=1))))
+            self.assertEqual(["bar"], [n["title"] for n in client.find_notes(keywords="new", fields=["title"])])
+            self.assertEqual(1, client.hash_abbreviation_length())
+            self.assertEqual(["foo"], [n["title"] for n in client.find_by_id(1)])
+            self.assertNotIn("hydrate_notes", NotaServer.exported) # takes SQL
+            with self.assertRaises(SystemExit):
+                client.find_notes(fields=["no such field"])
+            self.assertEqual("nota version", client.version()[0:12]) # connection still usable
+            # Two clients at once, one part way through a listing, both get answers.
+            other = NotaClient(db=self.database.name, quiet=True)
+            self.assertTrue(other.connect())
+            notes = client.iter_by_hash(batch=1)
+            self.assertEqual("foo", next(notes)["title"])
+            self.assertEqual([2, 0], other.count())
+            self.assertEqual("bar", next(notes)["title"])
+            other.close()
+            # A SystemExit not raised by Nota.error() stops the server.
+            servers[0].nota.version = lambda: sys.exit(0)
+            with self.assertRaises(SystemExit):
+                client.version()
+            thread.join()
+            client.close()
+        finally:
+            servers[0].shutdown()
+            thread.join()
+        self.assertFalse(os.path.exists(servers[0].path))
+        self.assertFalse(NotaClient(db=self.database.name).connect())
+
+    def test_trusted_socket(self):
+        directory = tempfile.mkdtemp(prefix="nota")
+        path = os.path.join(directory, "test.sock")
+        try:
+            open(path, "w").close()
+            self.assertFalse(trusted_socket(path)) # not a socket
+            os.remove(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(path)
+            self.assertTrue(trusted_socket(path))
+            os.chmod(directory, 0o755)
+            self.assertFalse(trusted_socket(path)) # others may replace it
+            sock.close()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rmdir(directory)
+
+    def test_startup(self):
+        # The arguments made without the parser are those the parser would make.
+        parser = argument_parser("nota.db", "synced")
+        for argv in ([], ["ab"]):
+            self.assertEqual(vars(parser.parse_args(argv)), vars(fast_args(argv, "nota.db", "synced")))
+        self.assertIsNone(fast_args(["-k", "foo"]))
+        self.assertIsNone(fast_args(["--version"]))
+        # The server's modules are not loaded by the command, unless it uses a server.
+        code = "import sys, nota.main; print(sorted(m for m in ('nota.server', 'socketserver') if m in sys.modules))"
+        self.assertEqual("[]", subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                universal_newlines=True).stdout.strip())
+        self.assertEqual((0, 2, 0), self.nota.version_tuple("0.2"))
+        self.assertTrue(self.nota.version_tuple("0.10") > self.nota.version_tuple("0.9.1"))
+
+    def test_renderer(self):
+        self.nota.add(title="foo", keywords=["a", "b"], content="one\\ntwo")
+        note = self.nota.find_by_hash()[0]
+        stream = io.StringIO()
+        renderer = Renderer(PlainFormatter(lambda date: "just now", hash_length=3), stream, buffer_size=10)
+        renderer.book("Default")
+        renderer.summary(note)
+        renderer.full(note)
+        self.assertTrue(stream.getvalue().startswith("Book: Default\n  %s foo [a, b] just now \n" % note["hash"][0:3]))
+        self.assertTrue(stream.getvalue().endswith("just now \n  one\n  two\n"))
+        self.assertEqual("%s\nfoo\n\n[*a*, *b*]\n\n" % note["hash"][0:3], MarkdownFormatter(None, 3).summary(note))
+        plain = PlainFormatter(None, hash_length=3)
+        self.assertEqual("%s: foo [a, b]\n" % note["hash"][0:3], plain.trashed(note))
+        note["snippet"] = "one\n [two]"
+        self.assertEqual("  %s foo [a, b]\n    one [two]\n" % note["hash"][0:3], plain.found(note))
+
+    def test_ages(self):
+        import datetime
+        now = datetime.datetime(2020, 3, 1, 12, 0, 0)
+        dates = ["2020-03-01 11:59:59", "2020-03-01 11:30:00", "2020-02-25 12:00:00", "2019-01-01 00:00:00",
+                "2020-03-01 11:30:00"]
+        cache = {}
+        self.assertEqual(["just now", "30 minutes ago", "5 days ago", "Jan 01, 2019", "30 minutes ago"],
+                self.nota.ages(dates, now, cache))
+        self.assertEqual(4, len(cache))
+        with self.assertRaises(ValueError):
+            self.nota.ages(["2020-03-01"])
+        self.assertEqual("Jan 01, 2019", self.nota.age("2019-01-01 00:00:00"))
+
+    def test_sqlstats(self):
+        self.nota.add(title="foo", keywords=["a"], content="")
+        stats = SqlStats(slow=0)
+        nota = Nota(db=self.database.name, stats=stats)
+        count = stats.count
+        nota.find_by_hash(hash="", fields=["title"])
+        self.assertTrue(stats.count > count)
+        sql = [s for s in stats.statements if s.startswith("SELECT note.") and "note.title" in s]
+        self.assertEqual(1, len(sql))
+        self.assertEqual(1, stats.statements[sql[0]][0])
+        plans = [plan for (seconds, s, plan) in stats.slow_statements if s == sql[0]]
+        self.assertTrue(plans and plans[0])
+        # Rows read by iterating over the cursor are timed too.
+        cursor = nota.cur.execute("SELECT noteId FROM note;")
+        seconds = stats.statements["SELECT noteId FROM note;"][1]
+        self.assertEqual([(1,)], list(cursor))
+        self.assertGreater(stats.statements["SELECT noteId FROM note;"][1], seconds)
+        report = io.StringIO()
+        stats.report(file=report)
+        self.assertIn("statements run", report.getvalue())
+        nota.con.close()
+
+    def test_fyi(self):
+        class Argument:
+            formatted = 0
+            def __str__(self):
+                Argument.formatted += 1
+                return "argument"
+        self.nota.fyi("value %s", Argument())
+        self.assertEqual(0, Argument.formatted) # not formatted unless debugging
+        self.nota.debug = True
+        with self.assertLogs("nota", level="DEBUG") as logs:
+            self.nota.fyi("value %s", Argument())
+        self.nota.debug = False
+        self.assertEqual(["DEBUG:nota:  value argument"], logs.output)
+        client = NotaClient(db=self.database.name, debug=True)
+        with self.assertLogs("nota", level="DEBUG") as logs:
+            client.fyi("value %s", Argument())
+        self.assertEqual(["DEBUG:nota:  value argument"], logs.output)
+        self.assertIsNone(client.local) # no Nota object of its own was needed
+
     def tearDown(self):
         logger.debug("Removing temporary database file.")
         os.remove(self.database.name)